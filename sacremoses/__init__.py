@@ -2,6 +2,7 @@ from sacremoses.corpus import *
 from sacremoses.tokenize import *
 from sacremoses.truecase import *
 from sacremoses.normalize import *
+from sacremoses.pipeline import *
 
 # from sacremoses.subwords import *
 
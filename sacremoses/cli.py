@@ -1,16 +1,37 @@
 # -*- coding: utf-8 -*-
 
+import glob
 import os
-from copy import deepcopy
+import shutil
+import tempfile
+from collections import OrderedDict, namedtuple
+from contextlib import nullcontext
 from functools import partial
 from functools import update_wrapper
 
 import click
 
-from sacremoses.tokenize import MosesTokenizer, MosesDetokenizer
+from sacremoses.tokenize import MosesTokenizer, MosesDetokenizer, ProtectedPatternSet
 from sacremoses.truecase import MosesTruecaser, MosesDetruecaser
 from sacremoses.normalize import MosesPunctNormalizer
-from sacremoses.util import parallelize_preprocess
+from sacremoses.pipeline import Pipeline
+from sacremoses.util import (
+    DEFAULT_BUFFER_SIZE,
+    TimeBudget,
+    atomic_open,
+    atomic_temp_files,
+    compression,
+    newline_aligned,
+    newline_ranges,
+    open_file,
+    parallelize_preprocess,
+    read_compressed_range_lines,
+    read_lines,
+    read_range_lines,
+    stream_ranges,
+    whitespace_split,
+    write_lines,
+)
 
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
 
@@ -21,11 +42,106 @@ CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
 )
 @click.option("--processes", "-j", default=1, help="No. of processes.")
 @click.option("--encoding", "-e", default="utf8", help="Specify encoding of file.")
+@click.option(
+    "--buffer-size",
+    type=click.IntRange(min=1),
+    default=DEFAULT_BUFFER_SIZE,
+    help="No. of bytes read from stdin, and characters written to stdout, at once.",
+)
+@click.option(
+    "--input",
+    "input_file",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="File to read instead of stdin, .gz, .bz2 and .xz are decompressed, "
+    "with -j the workers read parts of it on their own.",
+)
+@click.option(
+    "--output",
+    "output_file",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="File to write instead of stdout, compressed if .gz, .bz2 or .xz.",
+)
+@click.option(
+    "--input-glob",
+    "input_globs",
+    multiple=True,
+    help="Pattern of the files to process one by one instead of stdin, ** "
+    "matches any directories, can be repeated.",
+)
+@click.option(
+    "--input-list",
+    type=click.File("r"),
+    default=None,
+    help="File that lists the files to process one by one, one per line.",
+)
+@click.option(
+    "--output-dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Directory of the outputs of the --input-glob and --input-list files, "
+    "under the same names and subdirectories.",
+)
+@click.option(
+    "--checkpoint",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Manifest of the files that are done, skipped when the run is "
+    "resumed, defaults to .sacremoses-checkpoint in the --output-dir.",
+)
 @click.option(
     "--quiet", "-q", is_flag=True, default=False, help="Disable progress bar."
 )
+@click.option(
+    "--line-timeout",
+    type=float,
+    default=None,
+    help="No. of seconds per line, before the line falls back to --timeout-fallback.",
+)
+@click.option(
+    "--timeout-fallback",
+    type=click.Choice(["split", "unchanged"]),
+    default="split",
+    help="Whitespace split the lines that timed out, or emit them unchanged.",
+)
+@click.option(
+    "--slow-line-log",
+    type=click.File("w"),
+    default=None,
+    help="File to log the line no., stage and seconds of the slow lines, defaults to stderr.",
+)
+@click.option(
+    "--start-method",
+    type=click.Choice(["fork", "spawn", "forkserver"]),
+    default=None,
+    help="Start method of the worker processes, with fork they share the loaded models copy-on-write.",
+)
+@click.option(
+    "--backend",
+    type=click.Choice(["processes", "threads"]),
+    default="processes",
+    help="Run -j worker processes, or threads that share the loaded models.",
+)
 @click.version_option()
-def cli(language, encoding, processes, quiet):
+def cli(
+    language,
+    encoding,
+    buffer_size,
+    input_file,
+    output_file,
+    input_globs,
+    input_list,
+    output_dir,
+    checkpoint,
+    processes,
+    quiet,
+    line_timeout,
+    timeout_fallback,
+    slow_line_log,
+    start_method,
+    backend,
+):
     pass
 
 
@@ -33,42 +149,425 @@ def cli(language, encoding, processes, quiet):
 # https://github.com/alvations/sacremoses/issues/130
 result_callback = cli.resultcallback if int(click.__version__.split('.')[0]) < 8 else cli.result_callback
 
+# The per-line time budget shared by the commands of the pipeline.
+LineBudget = namedtuple("LineBudget", ["timeout", "fallback", "log"])
+
+# A command that maps every line to a line on its own, consecutive ones are
+# fused into a single Pipeline.
+LineStage = namedtuple("LineStage", ["name", "func"])
+
+
+def unchanged(line):
+    """Emits a line that timed out as it was read."""
+    if isinstance(line, str):
+        return line.rstrip("\n")
+    return " ".join(line)
+
+
 @result_callback()
-def process_pipeline(processors, encoding, **kwargs):
-    with click.get_text_stream("stdin", encoding=encoding) as fin:
-        iterator = fin  # Initialize fin as the first iterator.
+def process_pipeline(
+    processors,
+    encoding,
+    buffer_size,
+    input_file,
+    output_file,
+    input_globs,
+    input_list,
+    output_dir,
+    checkpoint,
+    line_timeout,
+    timeout_fallback,
+    slow_line_log,
+    **kwargs
+):
+    if input_globs or input_list:
+        if input_file or output_file or line_timeout:
+            raise click.UsageError(
+                "--input, --output and --line-timeout are for a single input."
+            )
+        if not output_dir:
+            raise click.UsageError(
+                "--input-glob and --input-list require an --output-dir."
+            )
+        jobs = batch_jobs(input_globs, input_list, output_dir)
+        stages = [proc(**kwargs) for proc in processors]
+        if not all(isinstance(stage, LineStage) for stage in stages):
+            raise click.UsageError(
+                "Only the commands that map a line to a line run on several "
+                "files, e.g. truecase with an existing model file."
+            )
+        checkpoint = checkpoint or os.path.join(output_dir, ".sacremoses-checkpoint")
+        run_batch(jobs, checkpoint, stages, encoding, buffer_size, **kwargs)
+        return
+    slow_line_log = slow_line_log or click.get_text_stream("stderr")
+    fallback = whitespace_split if timeout_fallback == "split" else unchanged
+    budget = LineBudget(line_timeout, fallback, slow_line_log) if line_timeout else None
+    if input_file:
+        fin = open_file(input_file, "rb")
+    else:
+        fin = click.get_binary_stream("stdin")
+    with fin:
+        # Initialize the lines of fin as the first iterator.
+        iterator = read_lines(fin, encoding, buffer_size)
+        # The stages are chained generators, a line is read when the last
+        # stage asks for it and the parallel stages keep a bounded no. of
+        # chunks in flight, so the memory use doesn't grow with the input.
+        # The consecutive LineStages run as one, so with -j a line makes a
+        # single round trip to the workers for all of them.
+        fused, per_line = [], True
         for proc in processors:
-            iterator = proc(list(iterator), **kwargs)
+            stage = proc(**kwargs)
+            if isinstance(stage, LineStage):
+                fused.append(stage)
+                continue
+            iterator = run_fused(iterator, fused, budget, **kwargs)
+            fused, per_line = [], False
+            iterator = stage(iterator, budget)
+        # The workers read and write the parts of a regular file on their own,
+        # if the whole pipeline is per-line. The slow lines are numbered
+        # in the order of the input, so not with --line-timeout.
+        if per_line and fused and not budget and newline_aligned(encoding):
+            file_ranges = input_ranges(input_file, kwargs["processes"])
+            if file_ranges is not None:
+                run_sharded(
+                    input_file,
+                    file_ranges,
+                    output_file,
+                    fused,
+                    encoding,
+                    buffer_size,
+                    **kwargs
+                )
+                return
+        iterator = run_fused(iterator, fused, budget, **kwargs)
         if iterator:
-            for item in iterator:
-                click.echo(item)
+            with open_output(output_file) as fout:
+                write_lines(iterator, fout, encoding, buffer_size)
+
+
+def open_output(output_file, compress=True):
+    """
+    Opens the --output file, compressed as its extension says unless not
+    *compress*, or stdout without closing it afterwards.
+    """
+    if output_file:
+        return open_file(output_file, "wb") if compress else open(output_file, "wb")
+    return nullcontext(click.get_binary_stream("stdout"))
+
+
+def input_ranges(input_file, processes):
+    """
+    Returns the byte ranges of the --input file for the workers to read on
+    their own, or None if the file is read as a stream.
+    """
+    if not input_file or not os.path.isfile(input_file) or processes < 2:
+        return None
+    # A few ranges per worker, so that a slow one doesn't keep the rest idle.
+    if compression(input_file):
+        # A single compressed stream is decompressed as it is read instead.
+        file_ranges = stream_ranges(input_file, processes * 4)
+        return file_ranges if len(file_ranges) > 1 else None
+    return newline_ranges(input_file, processes * 4)
+
+
+def process_range(
+    file_range, input_file, func, encoding, buffer_size, tmpdir, suffix
+):
+    """
+    Processes the lines of the (start, end) byte range of the *input_file*
+    and writes them to a temporary file in *tmpdir*, returns its name.
+    """
+    start, end = file_range
+    if compression(input_file):
+        read = read_compressed_range_lines
+    else:
+        read = read_range_lines
+    lines = read(input_file, start, end, encoding, buffer_size)
+    # The outputs are compressed on their own, the concatenated streams are a
+    # valid compressed file.
+    fd, output = tempfile.mkstemp(suffix=suffix, dir=tmpdir)
+    os.close(fd)
+    with open_file(output, "wb") as fout:
+        write_lines(map(func, lines), fout, encoding, buffer_size)
+    return output
+
+
+def run_sharded(
+    input_file,
+    file_ranges,
+    output_file,
+    stages,
+    encoding,
+    buffer_size,
+    processes,
+    quiet,
+    start_method,
+    backend,
+    **kwargs
+):
+    """
+    Runs the LineStages *stages* with every worker reading and writing the
+    lines of a byte range of the *input_file*, and copies their outputs in
+    order to the *output_file*, or stdout.
+    """
+    with tempfile.TemporaryDirectory(prefix="sacremoses-") as tmpdir:
+        func = partial(
+            process_range,
+            input_file=input_file,
+            func=Pipeline([stage.func for stage in stages]),
+            encoding=encoding,
+            buffer_size=buffer_size,
+            tmpdir=tmpdir,
+            suffix=compression(output_file or "") or "",
+        )
+        outputs = parallelize_preprocess(
+            func,
+            file_ranges,
+            processes,
+            progress_bar=(not quiet),
+            chunksize=1,
+            start_method=start_method,
+            backend=backend,
+        )
+        with open_output(output_file, compress=False) as fout:
+            for output in outputs:
+                with open(output, "rb") as part:
+                    shutil.copyfileobj(part, fout, buffer_size)
+                os.remove(output)
+            fout.flush()
+
+
+def batch_jobs(input_globs, input_list, output_dir):
+    """
+    Returns the (input, output) file names of the --input-glob and
+    --input-list files, in order and without duplicates. The outputs keep the
+    paths of the inputs relative to their common directory.
+
+    The files under the *output_dir* are not matched by the globs, e.g. the
+    outputs of a previous run when the output directory is among the inputs.
+    """
+    output_dir = os.path.abspath(output_dir)
+    outputs_prefix = os.path.normcase(os.path.join(output_dir, ""))
+    inputs = []
+    for pattern in input_globs:
+        matches = [
+            filename
+            for filename in map(os.path.abspath, glob.glob(pattern, recursive=True))
+            if os.path.isfile(filename)
+            and not os.path.normcase(filename).startswith(outputs_prefix)
+        ]
+        if not matches:
+            raise click.UsageError("--input-glob {} matches no files.".format(pattern))
+        inputs.extend(sorted(matches))
+    if input_list:
+        inputs.extend(line.strip() for line in input_list if line.strip())
+    inputs = list(OrderedDict.fromkeys(map(os.path.abspath, inputs)))
+    if not inputs:
+        return []
+    for filename in inputs:
+        if not os.path.isfile(filename):
+            raise click.BadParameter(
+                "{} is not a file.".format(filename), param_hint="--input-list"
+            )
+    root = os.path.commonpath([os.path.dirname(filename) for filename in inputs])
+    jobs = []
+    for filename in inputs:
+        output = os.path.join(output_dir, os.path.relpath(filename, root))
+        if output == filename:
+            raise click.BadParameter(
+                "{} would overwrite its input.".format(output),
+                param_hint="--output-dir",
+            )
+        jobs.append((filename, output))
+    return jobs
+
+
+def read_checkpoint(checkpoint):
+    """Returns the set of the files in the *checkpoint* manifest."""
+    if not os.path.exists(checkpoint):
+        return set()
+    with open(checkpoint, "rb") as fin:
+        lines = fin.read().split(b"\n")
+    # The last line is partial if the run was killed while writing it.
+    return set(map(os.fsdecode, lines[:-1]))
+
+
+def process_file(job, func, encoding, buffer_size):
+    """
+    Processes the lines of the input file of the (input, output) *job* into
+    its output file, which replaces the previous one once it is complete.
+    Returns the input file.
+    """
+    input_file, output_file = job
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    with open_file(input_file, "rb") as fin:
+        with atomic_open(output_file, "wb") as fout:
+            lines = read_lines(fin, encoding, buffer_size)
+            write_lines(map(func, lines), fout, encoding, buffer_size)
+    return input_file
+
+
+def run_batch(
+    jobs,
+    checkpoint,
+    stages,
+    encoding,
+    buffer_size,
+    processes,
+    quiet,
+    start_method,
+    backend,
+    **kwargs
+):
+    """
+    Runs the LineStages *stages* over the (input, output) files of the
+    *jobs* with a single pool of workers, and of loaded models, for all of
+    them. The files in the *checkpoint* manifest are skipped, and every file
+    that is done is appended to it, so a killed run resumes where it stopped.
+    """
+    for temp in atomic_temp_files(output_file for _, output_file in jobs):
+        os.remove(temp)
+    done = read_checkpoint(checkpoint)
+    jobs = [job for job in jobs if job[0] not in done]
+    os.makedirs(os.path.dirname(os.path.abspath(checkpoint)), exist_ok=True)
+    func = partial(
+        process_file,
+        func=Pipeline([stage.func for stage in stages]),
+        encoding=encoding,
+        buffer_size=buffer_size,
+    )
+    with open(checkpoint, "a+b") as manifest:
+        # Drops the partial line of a killed run.
+        manifest.seek(0)
+        manifest.truncate(manifest.read().rfind(b"\n") + 1)
+        for input_file in parallelize_preprocess(
+            func,
+            jobs,
+            processes,
+            progress_bar=(not quiet),
+            chunksize=1,
+            start_method=start_method,
+            backend=backend,
+        ):
+            manifest.write(os.fsencode(input_file) + b"\n")
+            # The file is only skipped by a resumed run once its line is on
+            # the disk, after its output.
+            manifest.flush()
+            os.fsync(manifest.fileno())
+
+
+def run_fused(
+    iterator, stages, budget, processes, quiet, start_method, backend, **kwargs
+):
+    """Runs the LineStages *stages* as a single Pipeline over the lines."""
+    if iterator is None or not stages:
+        return iterator
+    return parallel_or_not(
+        iterator,
+        Pipeline([stage.func for stage in stages]),
+        processes,
+        quiet,
+        budget=budget,
+        stage="+".join(stage.name for stage in stages),
+        start_method=start_method,
+        backend=backend,
+    )
+
+
+def spool(iterator, fileobj):
+    """Yields the lines of the *iterator* while copying them to *fileobj*."""
+    for line in iterator:
+        fileobj.write(line.rstrip("\n") + "\n")
+        yield line
+
+
+def read_and_close(fileobj):
+    """Yields the lines of *fileobj* and closes it after the last one."""
+    with fileobj:
+        yield from fileobj
 
 
 def processor(f, **kwargs):
     """Helper decorator to rewrite a function so that
-    it returns another function from it.
+    it returns another function from it. The function takes the command's
+    options and the global options and returns a LineStage, or a function of
+    the lines and the LineBudget that returns the output lines.
     """
 
     def new_func(**kwargs):
-        def processor(stream, **kwargs):
-            return f(stream, **kwargs)
-
-        return partial(processor, **kwargs)
+        return partial(f, **kwargs)
 
     return update_wrapper(new_func, f, **kwargs)
 
 
-def parallel_or_not(iterator, func, processes, quiet):
+def detokenize_line(line, detokenize):
+    """Detokenizes the whitespace separated tokens of a line."""
+    return detokenize(line.split())
+
+
+def parallel_or_not(
+    iterator,
+    func,
+    processes,
+    quiet,
+    budget=None,
+    stage=None,
+    start_method=None,
+    backend="processes",
+):
+    if budget:
+        yield from budget_lines(
+            iterator, func, processes, quiet, budget, stage, start_method, backend
+        )
+        return
     if processes == 1:
         for line in iterator:
             yield func(line)
     else:
         for outline in parallelize_preprocess(
-            func, iterator, processes, progress_bar=(not quiet)
+            func,
+            iterator,
+            processes,
+            progress_bar=(not quiet),
+            start_method=start_method,
+            backend=backend,
         ):
             yield outline
 
 
+def budget_lines(
+    iterator,
+    func,
+    processes,
+    quiet,
+    budget,
+    stage,
+    start_method=None,
+    backend="processes",
+):
+    """Runs every line under the time budget and logs the slow lines."""
+    func = TimeBudget(func, budget.timeout, fallback=budget.fallback).run
+    if processes == 1:
+        outputs = map(func, iterator)
+    else:
+        outputs = parallelize_preprocess(
+            func,
+            iterator,
+            processes,
+            progress_bar=(not quiet),
+            start_method=start_method,
+            backend=backend,
+        )
+    for lineno, (outline, elapsed, timed_out) in enumerate(outputs, 1):
+        if elapsed >= budget.timeout:
+            budget.log.write(
+                "{}\t{}\t{:.3f}\t{}\n".format(
+                    lineno, stage, elapsed, "timeout" if timed_out else "slow"
+                )
+            )
+        yield outline
+
+
 ########################################################################
 # Tokenize
 ########################################################################
@@ -101,27 +600,30 @@ def parallel_or_not(iterator, func, processes, quiet):
 )
 @processor
 def tokenize_file(
-    iterator,
     language,
     processes,
     quiet,
+    start_method,
+    backend,
     xml_escape,
     aggressive_dash_splits,
     protected_patterns,
     custom_nb_prefixes,
 ):
+    # The threads share the tokenizer, its rules release the GIL.
     moses = MosesTokenizer(
-        lang=language, custom_nonbreaking_prefixes_file=custom_nb_prefixes
+        lang=language,
+        custom_nonbreaking_prefixes_file=custom_nb_prefixes,
+        concurrent=backend == "threads",
     )
 
     if protected_patterns:
         if protected_patterns == ":basic:":
-            protected_patterns = moses.BASIC_PROTECTED_PATTERNS
+            protected_patterns = ProtectedPatternSet(moses.BASIC_PROTECTED_PATTERNS)
         elif protected_patterns == ":web:":
-            protected_patterns = moses.WEB_PROTECTED_PATTERNS
+            protected_patterns = ProtectedPatternSet(moses.WEB_PROTECTED_PATTERNS)
         else:
-            with open(protected_patterns, encoding="utf8") as fin:
-                protected_patterns = [pattern.strip() for pattern in fin.readlines()]
+            protected_patterns = ProtectedPatternSet.from_file(protected_patterns)
 
     moses_tokenize = partial(
         moses.tokenize,
@@ -130,7 +632,7 @@ def tokenize_file(
         escape=xml_escape,
         protected_patterns=protected_patterns,
     )
-    return parallel_or_not(iterator, moses_tokenize, processes, quiet)
+    return LineStage("tokenize", moses_tokenize)
 
 
 ########################################################################
@@ -148,16 +650,17 @@ def tokenize_file(
 )
 @processor
 def detokenize_file(
-    iterator,
     language,
     processes,
     quiet,
+    start_method,
+    backend,
     xml_unescape,
 ):
     moses = MosesDetokenizer(lang=language)
     moses_detokenize = partial(moses.detokenize, return_str=True, unescape=xml_unescape)
-    return parallel_or_not(
-        list(map(str.split, iterator)), moses_detokenize, processes, quiet
+    return LineStage(
+        "detokenize", partial(detokenize_line, detokenize=moses_detokenize)
     )
 
 
@@ -193,10 +696,11 @@ def detokenize_file(
 )
 @processor
 def normalize_file(
-    iterator,
     language,
     processes,
     quiet,
+    start_method,
+    backend,
     normalize_quote_commas,
     normalize_numbers,
     replace_unicode_puncts,
@@ -210,7 +714,7 @@ def normalize_file(
         post_remove_control_chars=remove_control_chars,
     )
     moses_normalize = partial(moses.normalize)
-    return parallel_or_not(iterator, moses_normalize, processes, quiet)
+    return LineStage("normalize", moses_normalize)
 
 
 ########################################################################
@@ -238,17 +742,27 @@ def normalize_file(
 )
 @processor
 def train_truecaser(
-    iterator, language, processes, quiet, modelfile, is_asr, possibly_use_first_token
+    language,
+    processes,
+    quiet,
+    start_method,
+    backend,
+    modelfile,
+    is_asr,
+    possibly_use_first_token,
 ):
-    moses = MosesTruecaser(is_asr=is_asr)
-    # iterator_copy = deepcopy(iterator)
-    model = moses.train(
-        iterator,
-        possibly_use_first_token=possibly_use_first_token,
-        processes=processes,
-        progress_bar=(not quiet),
-    )
-    moses.save_model(modelfile)
+
+    def train(iterator, budget):
+        moses = MosesTruecaser(is_asr=is_asr)
+        model = moses.train(
+            iterator,
+            possibly_use_first_token=possibly_use_first_token,
+            processes=processes,
+            progress_bar=(not quiet),
+        )
+        moses.save_model(modelfile)
+
+    return train
 
 
 ########################################################################
@@ -276,23 +790,47 @@ def train_truecaser(
 )
 @processor
 def truecase_file(
-    iterator, language, processes, quiet, modelfile, is_asr, possibly_use_first_token
+    language,
+    processes,
+    quiet,
+    start_method,
+    backend,
+    modelfile,
+    is_asr,
+    possibly_use_first_token,
 ):
+    # Truecase the file.
+    if os.path.isfile(modelfile):
+        moses = MosesTruecaser(load_from=modelfile, is_asr=is_asr)
+        return LineStage("truecase", partial(moses.truecase, return_str=True))
+
     # If model file doesn't exists, train a model.
-    if not os.path.isfile(modelfile):
-        iterator_copy = deepcopy(iterator)
+    def train_and_truecase(iterator, budget):
+        # The input is read once to train and once more to truecase, it is
+        # spooled to a temporary file instead of kept in memory in between.
+        spooled = tempfile.TemporaryFile("w+", encoding="utf8")
         truecaser = MosesTruecaser(is_asr=is_asr)
         model = truecaser.train(
-            iterator_copy,
+            spool(iterator, spooled),
             possibly_use_first_token=possibly_use_first_token,
             processes=processes,
             progress_bar=(not quiet),
         )
         truecaser.save_model(modelfile)
-    # Truecase the file.
-    moses = MosesTruecaser(load_from=modelfile, is_asr=is_asr)
-    moses_truecase = partial(moses.truecase, return_str=True)
-    return parallel_or_not(iterator, moses_truecase, processes, quiet)
+        spooled.seek(0)
+        moses = MosesTruecaser(load_from=modelfile, is_asr=is_asr)
+        return parallel_or_not(
+            read_and_close(spooled),
+            partial(moses.truecase, return_str=True),
+            processes,
+            quiet,
+            budget=budget,
+            stage="truecase",
+            start_method=start_method,
+            backend=backend,
+        )
+
+    return train_and_truecase
 
 
 ########################################################################
@@ -309,9 +847,9 @@ def truecase_file(
     help="Whether the file are headlines.",
 )
 @processor
-def detruecase_file(iterator, language, processes, quiet, is_headline):
+def detruecase_file(language, processes, quiet, start_method, backend, is_headline):
     moses = MosesDetruecaser()
     moses_detruecase = partial(
         moses.detruecase, return_str=True, is_headline=is_headline
     )
-    return parallel_or_not(iterator, moses_detruecase, processes, quiet)
+    return LineStage("detruecase", moses_detruecase)
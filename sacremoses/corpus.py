@@ -2,7 +2,40 @@
 # -*- coding: utf-8 -*-
 
 import os
-import pkgutil
+import re
+import struct
+import sys
+import threading
+from array import array
+
+# The directory of the data files the package is shipped with.
+DATADIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+def get_data(relative_path):
+    """
+    Reads a data file of the package, like pkgutil.get_data("sacremoses", ...)
+    but without the cost of importing pkgutil.
+    """
+    return __loader__.get_data(os.path.join(os.path.dirname(__file__), relative_path))
+
+
+def merge_ranges(ranges):
+    """
+    Sorts and merges the overlapping and adjacent (first, last) codepoint
+    ranges.
+
+        >>> merge_ranges([(48, 57), (10, 10), (50, 60), (61, 61), (9, 9)])
+        [(9, 10), (48, 61)]
+    """
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    return merged
 
 
 class Perluniprops:
@@ -59,11 +92,30 @@ class Perluniprops:
 
         :return: a generator of characters given the specific unicode character category
         """
-        relative_path = os.path.join("data", "perluniprops", category + ".txt")
-        binary_data = pkgutil.get_data("sacremoses", relative_path)
-        for ch in binary_data.decode("utf-8"):
+        for ch in self.text(category):
             yield ch
 
+    def text(self, category):
+        """Returns the characters of the *category* as a single string."""
+        bundle = data_bundle()
+        if bundle is not None and category in bundle.classes:
+            return bundle.text(category)
+        relative_path = os.path.join("data", "perluniprops", category + ".txt")
+        return get_data(relative_path).decode("utf-8")
+
+    def ranges(self, category):
+        """
+        Returns the sorted, disjoint (first, last) codepoint ranges of the
+        characters of the *category*.
+
+            >>> Perluniprops().ranges("IsN")[1]
+            (48, 57)
+        """
+        bundle = data_bundle()
+        if bundle is not None and category in bundle.classes:
+            return bundle.ranges(category)
+        return merge_ranges((cp, cp) for cp in map(ord, self.text(category)))
+
 
 class NonbreakingPrefixes:
     """
@@ -144,13 +196,385 @@ class NonbreakingPrefixes:
         else:
             filenames = ["nonbreaking_prefix.en"]
 
+        bundle = data_bundle()
         for filename in filenames:
-            relative_path = os.path.join("data", "nonbreaking_prefixes", filename)
-            binary_data = pkgutil.get_data("sacremoses", relative_path)
-            for line in binary_data.decode("utf-8").splitlines():
+            if bundle is not None:
+                lines = bundle.prefix_lines(filename)
+            else:
+                relative_path = os.path.join("data", "nonbreaking_prefixes", filename)
+                lines = get_data(relative_path).decode("utf-8").splitlines()
+            for line in lines:
                 line = line.strip()
                 if line and not line.startswith(ignore_lines_startswith):
                     yield line
 
 
-__all__ = ["Perluniprops", "NonbreakingPrefixes"]
+class CharClasses:
+    """
+    A registry of the Perluniprops character classes, prebuilt once as
+    frozensets and codepoint bitmaps and shared by the tokenizer, detokenizer
+    and truecaser, so that the membership checks in their hot paths don't
+    have to build a set of thousands of characters per call.
+
+        >>> from sacremoses.corpus import charclasses
+        >>> charclasses.charset("IsLower").issuperset("abc")
+        True
+        >>> charclasses.charset("IsAlpha").isdisjoint("1, 2!")
+        True
+        >>> charclasses.contains("IsSc", "$")
+        True
+    """
+
+    def __init__(self, perluniprops=None):
+        self.perluniprops = perluniprops if perluniprops else Perluniprops()
+        self._strings = {}
+        self._charsets = {}
+        self._ranges = {}
+        self._bitmaps = {}
+
+    def string(self, *categories, extra=""):
+        """
+        Returns the characters of the *categories* and the *extra* characters
+        as a string, in file order, e.g. to build regex character classes.
+        """
+        key = (categories, extra)
+        try:
+            return self._strings[key]
+        except KeyError:
+            chars = "".join(self.perluniprops.text(c) for c in categories) + extra
+            self._strings[key] = chars
+            return chars
+
+    def charset(self, *categories, extra=""):
+        """
+        Returns the frozenset of the characters from the *categories* and the
+        *extra* characters.
+        """
+        key = (categories, extra)
+        try:
+            return self._charsets[key]
+        except KeyError:
+            chars = frozenset(self.string(*categories, extra=extra))
+            self._charsets[key] = chars
+            return chars
+
+    def ranges(self, *categories, extra=""):
+        """
+        Returns the characters of the *categories* and the *extra* characters
+        as the body of a regex character class of codepoint ranges, e.g.
+        ``0-9`` instead of the ten digits. It matches the same characters as
+        the string() but compiles faster into a smaller pattern.
+
+            >>> import re
+            >>> re.findall("[{}]+".format(charclasses.ranges("IsN")), "a 12 b \xb3")
+            ['12', '\xb3']
+        """
+        key = (categories, extra)
+        try:
+            return self._ranges[key]
+        except KeyError:
+            pass
+        ranges = [(ord(c), ord(c)) for c in extra]
+        for category in categories:
+            ranges += self.perluniprops.ranges(category)
+        parts = []
+        for first, last in merge_ranges(ranges):
+            # A newline is kept as a bare member of its own, which is how
+            # sacremoses.program.linewise() finds and drops it in block mode.
+            if first < 10 < last:
+                parts += [self._range(first, 9), "\n", self._range(11, last)]
+            elif first == 10:
+                parts += ["\n", self._range(11, last) if last > 10 else ""]
+            elif last == 10:
+                parts += [self._range(first, 9), "\n"]
+            else:
+                parts.append(self._range(first, last))
+        self._ranges[key] = "".join(parts)
+        return self._ranges[key]
+
+    @staticmethod
+    def _range(first, last):
+        if first == last:
+            return re.escape(chr(first))
+        return re.escape(chr(first)) + "-" + re.escape(chr(last))
+
+    def bitmap(self, *categories, extra=""):
+        """
+        Returns the codepoint bitmap of the charset(), the bit ``cp & 7`` of
+        the byte ``cp >> 3`` is set if the codepoint *cp* is in the class.
+
+        :rtype: bytes
+        """
+        key = (categories, extra)
+        try:
+            return self._bitmaps[key]
+        except KeyError:
+            codepoints = [ord(c) for c in self.charset(*categories, extra=extra)]
+            bitmap = bytearray((max(codepoints) >> 3) + 1 if codepoints else 0)
+            for cp in codepoints:
+                bitmap[cp >> 3] |= 1 << (cp & 7)
+            self._bitmaps[key] = bytes(bitmap)
+            return self._bitmaps[key]
+
+    def contains(self, category, char):
+        """Checks the *char* against the bitmap of the *category*."""
+        bitmap, cp = self.bitmap(category), ord(char)
+        return (cp >> 3) < len(bitmap) and bool(bitmap[cp >> 3] >> (cp & 7) & 1)
+
+
+class DataBundle:
+    """
+    A compact binary bundle of the data files, generated from sacremoses/data,
+    that a process reads at once, or memory-maps, instead of decoding the text
+    files one by one. It holds, for every Perluniprops character class, its
+    characters in file order and its sorted codepoint ranges, and the
+    stripped lines of every nonbreaking prefix file.
+
+    The bundle is built with the package, see setup.py, and shipped next to
+    the data files. It records the sizes of the data files it is built from,
+    and data_bundle() ignores it when they change.
+
+        >>> bundle = DataBundle(DataBundle.build(DATADIR))
+        >>> bundle.text("IsSc")[:5] == "".join(Perluniprops().chars("IsSc"))[:5]
+        True
+        >>> bundle.ranges("IsN")[:3]
+        [(10, 10), (48, 57), (178, 179)]
+        >>> [line for line in bundle.prefix_lines("nonbreaking_prefix.en") if line[0] != "#"][:3]
+        ['A', 'B', 'C']
+
+    The layout is a header of the magic string, the format version and the
+    length of the table of contents, then the table of contents, one
+    tab-separated entry per line, and the data blocks it points to. The
+    characters of a class are stored either as long runs of consecutive
+    codepoints, (start, length) pairs of little-endian unsigned 32-bit
+    integers, or as zlib compressed UTF-8.
+    """
+
+    MAGIC = b"SMDB"
+    VERSION = 2
+    HEADER = struct.Struct("<4sII")
+    FILENAME = "sacremoses.bundle"
+    # The typecode of the unsigned 32-bit integers.
+    UINT32 = "I" if array("I").itemsize == 4 else "L"
+
+    def __init__(self, buffer):
+        """
+        :param buffer: The bundle, e.g. the bytes of a file or a mmap.
+        :type buffer: bytes
+        """
+        magic, version, toc_size = self.HEADER.unpack_from(buffer)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError("Not a version {} data bundle.".format(self.VERSION))
+        start = self.HEADER.size
+        self.buffer = buffer
+        self.sources_listing, self.classes, self.prefixes = [], {}, {}
+        toc = bytes(buffer[start : start + toc_size]).decode("utf-8")
+        # The table of contents is padded with newlines.
+        for entry in filter(None, toc.split("\n")):
+            section, name, *fields = entry.split("\t")
+            if section == "source":
+                self.sources_listing.append([name] + [int(f) for f in fields])
+            elif section == "class":
+                self.classes[name] = fields[:1] + [int(f) for f in fields[1:]]
+            elif section == "prefixes":
+                self.prefixes[name] = [int(f) for f in fields]
+        self._data = memoryview(buffer)[start + toc_size :]
+        self._texts = {}
+        self._lines = {}
+
+    @staticmethod
+    def sources(datadir=DATADIR):
+        """
+        Lists the [relative path, size] of the data files the bundle is built
+        from. The modification times change when the package is installed.
+        """
+        listing = []
+        for subdir, is_source in (
+            ("perluniprops", lambda name: name.endswith(".txt")),
+            ("nonbreaking_prefixes", lambda name: name.startswith("nonbreaking_prefix.")),
+        ):
+            for entry in os.scandir(os.path.join(datadir, subdir)):
+                if is_source(entry.name):
+                    path = subdir + "/" + entry.name
+                    listing.append([path, entry.stat().st_size])
+        return sorted(listing)
+
+    @classmethod
+    def _uint32s(cls, numbers):
+        """Packs the *numbers* as little-endian unsigned 32-bit integers."""
+        numbers = array(cls.UINT32, numbers)
+        if sys.byteorder == "big":
+            numbers.byteswap()
+        return numbers.tobytes()
+
+    @classmethod
+    def build(cls, datadir=DATADIR):
+        """Builds the bundle from the data files in *datadir*, returns its bytes."""
+        import zlib
+
+        sources = cls.sources(datadir)
+        toc = ["\t".join(["source"] + [str(field) for field in source]) for source in sources]
+        blocks, offset = [], 0
+
+        def add_block(block):
+            nonlocal offset
+            # Keep the blocks aligned to 4 bytes.
+            block += bytes(-len(block) % 4)
+            blocks.append(block)
+            offset += len(block)
+            return offset - len(block)
+
+        for path, _ in sources:
+            subdir, filename = path.split("/")
+            with open(os.path.join(datadir, subdir, filename), "rb") as fin:
+                binary_data = fin.read()
+            text = binary_data.decode("utf-8")
+            if subdir == "perluniprops":
+                runs = []
+                for cp in map(ord, text):
+                    if runs and runs[-2] + runs[-1] == cp:
+                        runs[-1] += 1
+                    else:
+                        runs += [cp, 1]
+                compressed = zlib.compress(binary_data, 9)
+                # Short runs are slower to expand than to decompress.
+                if len(runs) * 4 < len(compressed) and len(text) >= len(runs) * 8:
+                    encoding, block = "runs", cls._uint32s(runs)
+                else:
+                    encoding, block = "zlib", compressed
+                ranges = merge_ranges((cp, cp) for cp in map(ord, text))
+                fields = [encoding, add_block(block), len(block)]
+                ranges = cls._uint32s([bound for r in ranges for bound in r])
+                fields += [add_block(ranges), len(ranges)]
+                entry = ["class", filename[: -len(".txt")]] + fields
+            else:
+                lines = (line.strip() for line in text.splitlines())
+                block = zlib.compress("\n".join(l for l in lines if l).encode("utf-8"), 9)
+                entry = ["prefixes", filename, add_block(block), len(block)]
+            toc.append("\t".join(str(field) for field in entry))
+        toc = "\n".join(toc).encode("utf-8")
+        toc += b"\n" * (-(cls.HEADER.size + len(toc)) % 4)
+        header = cls.HEADER.pack(cls.MAGIC, cls.VERSION, len(toc))
+        return b"".join([header, toc] + blocks)
+
+    @classmethod
+    def load(cls, path, use_mmap=False):
+        """
+        Reads the bundle at *path* with a single read, or memory-maps it.
+        """
+        with open(path, "rb") as fin:
+            if not use_mmap:
+                return cls(fin.read())
+            import mmap
+
+            return cls(mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def is_stale(self, datadir=DATADIR):
+        """Checks if the data files changed since the bundle was built."""
+        return self.sources_listing != self.sources(datadir)
+
+    def _uint32s_at(self, offset, size):
+        numbers = array(self.UINT32)
+        numbers.frombytes(self._data[offset : offset + size])
+        if sys.byteorder == "big":
+            numbers.byteswap()
+        return numbers
+
+    def text(self, category):
+        """Returns the characters of the Perluniprops *category* as a string."""
+        try:
+            return self._texts[category]
+        except KeyError:
+            pass
+        encoding, offset, size = self.classes[category][:3]
+        if encoding == "zlib":
+            import zlib
+
+            text = zlib.decompress(self._data[offset : offset + size]).decode("utf-8")
+        else:
+            runs, codepoints = self._uint32s_at(offset, size), array(self.UINT32)
+            for start, length in zip(runs[::2], runs[1::2]):
+                codepoints.extend(range(start, start + length))
+            # The codepoints in the native byte order, e.g. "utf-32-le".
+            text = codepoints.tobytes().decode("utf-32-{}e".format(sys.byteorder[0]))
+        self._texts[category] = text
+        return text
+
+    def ranges(self, category):
+        """
+        Returns the sorted, disjoint (first, last) codepoint ranges of the
+        characters of the Perluniprops *category*.
+        """
+        offset, size = self.classes[category][3:]
+        bounds = self._uint32s_at(offset, size)
+        return list(zip(bounds[::2], bounds[1::2]))
+
+    def prefix_lines(self, filename):
+        """Returns the stripped, non-empty lines of a nonbreaking prefix file."""
+        try:
+            return self._lines[filename]
+        except KeyError:
+            pass
+        import zlib
+
+        offset, size = self.prefixes[filename]
+        lines = zlib.decompress(self._data[offset : offset + size]).decode("utf-8")
+        self._lines[filename] = lines.split("\n")
+        return self._lines[filename]
+
+
+_data_bundle = None
+_data_bundle_loaded = False
+_data_bundle_lock = threading.Lock()
+
+
+def data_bundle(use_mmap=False):
+    """
+    Returns the DataBundle of the process, loaded on the first call. Returns
+    None, and the data files are read one by one instead, if the bundle isn't
+    shipped with the package, e.g. in a source checkout where it isn't built,
+    or is stale, or if the data files aren't on the file system, e.g. in a
+    zipped package.
+
+    :param use_mmap: Memory-map the bundle file, if it is loaded by this call.
+    :type use_mmap: bool
+    """
+    global _data_bundle, _data_bundle_loaded
+    if _data_bundle_loaded:
+        return _data_bundle
+    with _data_bundle_lock:
+        if not _data_bundle_loaded and os.path.isdir(DATADIR):
+            _data_bundle = _load_data_bundle(use_mmap)
+        _data_bundle_loaded = True
+    return _data_bundle
+
+
+def _load_data_bundle(use_mmap):
+    try:
+        bundle = DataBundle.load(os.path.join(DATADIR, DataBundle.FILENAME), use_mmap)
+    except (OSError, ValueError):
+        return None
+    return None if bundle.is_stale() else bundle
+
+
+def write_data_bundle(datadir=DATADIR):
+    """
+    Builds the bundle of the data files in *datadir* and writes it next to
+    them, when the package is built, see setup.py. Returns the path of the
+    bundle.
+    """
+    path = os.path.join(datadir, DataBundle.FILENAME)
+    # Write to a temporary file and rename it, in case another process is
+    # reading the bundle at the same time.
+    temporary_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(temporary_path, "wb") as fout:
+        fout.write(DataBundle.build(datadir))
+    os.replace(temporary_path, path)
+    return path
+
+
+# The registry shared by the modules.
+charclasses = CharClasses()
+
+
+__all__ = ["Perluniprops", "NonbreakingPrefixes", "CharClasses", "DataBundle"]
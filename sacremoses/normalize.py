@@ -2,15 +2,20 @@
 # -*- coding: utf-8 -*-
 
 import re
-import regex
 
 from itertools import chain
 
+from sacremoses.util import LRUCache, SharedInstances, rebuild
 
-class MosesPunctNormalizer:
+
+class MosesPunctNormalizer(SharedInstances):
     """
     This is a Python port of the Moses punctuation normalizer from
     https://github.com/moses-smt/mosesdecoder/blob/master/scripts/tokenizer/normalize-punctuation.perl
+
+    Thread safety: normalize() can be called concurrently on a shared
+    instance, the substitutions are only read and the line cache is locked.
+    The removal of the control characters releases the GIL while matching.
     """
 
     EXTRA_WHITESPACE = [  # lines 21 - 30
@@ -132,7 +137,8 @@ class MosesPunctNormalizer:
         norm_numbers=True,
         pre_replace_unicode_punct=False,
         post_remove_control_chars=False,
-        perl_parity=False
+        perl_parity=False,
+        cache_size=None,
     ):
         """
         :param language: The two-letter language code.
@@ -145,7 +151,21 @@ class MosesPunctNormalizer:
         :type norm_numbers: bool
         :param perl_parity: exact parity with perl script
         :type perl_parity: bool
+        :param cache_size: If set, memoize the normalize() results of up to
+            *cache_size* distinct lines, see sacremoses.util.LRUCache.
+        :type cache_size: int
         """
+        # The constructor arguments, see __reduce__().
+        self._config = dict(
+            lang=lang,
+            penn=penn,
+            norm_quote_commas=norm_quote_commas,
+            norm_numbers=norm_numbers,
+            pre_replace_unicode_punct=pre_replace_unicode_punct,
+            post_remove_control_chars=post_remove_control_chars,
+            perl_parity=perl_parity,
+            cache_size=cache_size,
+        )
 
         if perl_parity:
             self.NORMALIZE_UNICODE[11] = ("’", r'"')
@@ -178,11 +198,25 @@ class MosesPunctNormalizer:
 
         self.pre_replace_unicode_punct = pre_replace_unicode_punct
         self.post_remove_control_chars = post_remove_control_chars
+        self.cache = LRUCache(cache_size) if cache_size else None
+
+    def __reduce__(self):
+        # Pickles the configuration, the copy is rebuilt with an empty cache.
+        return rebuild, (self.__class__, self._config)
 
     def normalize(self, text):
         """
         Returns a string with normalized punctuation.
         """
+        if self.cache is None:
+            return self._normalize(text)
+        normalized = self.cache.get(text)
+        if normalized is None:
+            normalized = self._normalize(text)
+            self.cache.put(text, normalized)
+        return normalized
+
+    def _normalize(self, text):
         # Optionally, replace unicode puncts BEFORE normalization.
         if self.pre_replace_unicode_punct:
             text = self.replace_unicode_punct(text)
@@ -205,4 +239,8 @@ class MosesPunctNormalizer:
         return text
 
     def remove_control_chars(self, text):
-        return regex.sub(r"\p{C}", "", text)
+        # Imported on first use, only the -c/--remove-control-chars option needs it.
+        import regex
+
+        # Releases the GIL while matching, for the threads of the other lines.
+        return regex.sub(r"\p{C}", "", text, concurrent=True)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""
+Chains per-line processors, e.g. a normalizer, a tokenizer and a truecaser,
+into a single callable that runs all of them on a line in one go.
+"""
+
+from sacremoses.util import parallelize_preprocess
+
+
+class Pipeline(object):
+    """
+    A chain of functions from a line to a line, applied in order.
+
+        >>> from functools import partial
+        >>> from sacremoses import MosesPunctNormalizer, MosesTokenizer
+        >>> pipeline = Pipeline([
+        ...     MosesPunctNormalizer().normalize,
+        ...     partial(MosesTokenizer().tokenize, return_str=True),
+        ... ])
+        >>> pipeline("Hello,  world!")
+        'Hello , world !'
+        >>> pipeline.process_batch(["«Bonjour»", "Mr. Smith"])
+        ['&quot; Bonjour &quot;', 'Mr. Smith']
+
+    A pipeline is picklable if its steps are, so in worker processes every
+    line goes through all the steps in a single round trip.
+    """
+
+    def __init__(self, steps):
+        """
+        :param steps: The functions that each take the output of the previous
+            one, e.g. MosesPunctNormalizer.normalize, or a partial() of
+            MosesTokenizer.tokenize with return_str=True.
+        :type steps: list(callable)
+        """
+        self.steps = list(steps)
+        for step in self.steps:
+            if not callable(step):
+                raise TypeError(
+                    "The steps of a Pipeline must be callable, got {!r}".format(step)
+                )
+
+    def __call__(self, line):
+        for step in self.steps:
+            line = step(line)
+        return line
+
+    def process_stream(
+        self,
+        lines,
+        processes=1,
+        chunksize=1000,
+        backend="processes",
+        start_method=None,
+        progress_bar=False,
+    ):
+        """
+        Lazily yields the output of every line of *lines*, in order, with
+        *processes* workers, see parallelize_preprocess().
+
+        :param lines: The input lines.
+        :type lines: iter(str)
+        :rtype: iter(str)
+        """
+        return parallelize_preprocess(
+            self,
+            lines,
+            processes,
+            progress_bar=progress_bar,
+            chunksize=chunksize,
+            start_method=start_method,
+            backend=backend,
+        )
+
+    def process_batch(self, lines, **kwargs):
+        """
+        Returns the list of the outputs of the *lines*, with the options of
+        process_stream().
+
+        :type lines: list(str)
+        :rtype: list(str)
+        """
+        return list(self.process_stream(lines, **kwargs))
+
+    def __repr__(self):
+        return "Pipeline({!r})".format(self.steps)
+
+
+__all__ = ["Pipeline"]
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Compiles chains of (regexp, substitution) rules into execution plans that
+produce the same output as applying the rules one by one but rescan the
+text fewer times.
+"""
+
+import re
+
+# Cache of the line-wise variants of the substitution regexes, see linewise().
+_LINEWISE_REGEXES = {}
+
+# Cache of the compiled programs, see RegexProgram.compile().
+_PROGRAMS = {}
+
+# Cache of the regex module variants of the regexes, see concurrent_regex().
+_CONCURRENT_REGEXES = {}
+
+
+def linewise(regexp):
+    """
+    Returns a variant of the compiled *regexp* that behaves on a block of
+    newline-joined lines exactly as the original regexp does on every line on
+    its own, i.e. anchors match at line boundaries and character classes
+    never match the newline separating two lines.
+
+        >>> print(linewise(re.compile(r"([^0-9])[,]$")).pattern)
+        ([^\\n0-9])[,]$
+
+    :param regexp: A compiled regex that is applied on single lines.
+    :type regexp: re.Pattern
+    :rtype: re.Pattern
+    """
+    try:
+        return _LINEWISE_REGEXES[regexp]
+    except KeyError:
+        pass
+    pattern, chars, i, in_class = regexp.pattern, [], 0, False
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\":
+            chars.append(pattern[i : i + 2])
+            i += 2
+            continue
+        if in_class:
+            # The Perluniprops character sets contain a literal newline.
+            if char == "]":
+                in_class = False
+            if char != "\n":
+                chars.append(char)
+        elif char == "[":
+            in_class = True
+            chars.append(char)
+            if pattern.startswith("^", i + 1):
+                chars.append("^\\n")
+                i += 1
+            # A leading "]" is a literal member of the class.
+            if pattern.startswith("]", i + 1):
+                chars.append("]")
+                i += 1
+        else:
+            chars.append(char)
+        i += 1
+    compiled = re.compile("".join(chars), regexp.flags | re.MULTILINE)
+    _LINEWISE_REGEXES[regexp] = compiled
+    return compiled
+
+
+def concurrent_regex(regexp):
+    """
+    Returns the compiled *regexp* recompiled with the ``regex`` module, whose
+    matchers release the GIL when called with ``concurrent=True``, or the
+    *regexp* itself if the ``regex`` module rejects the pattern.
+
+        >>> regexp = concurrent_regex(re.compile(r"([^0-9])[,]"))
+        >>> regexp.sub(r"\\1 , ", "a,1", concurrent=True)
+        'a , 1'
+
+    The ``regex`` module is meant to match the ``re`` patterns alike, which
+    RegexProgram.verify() checks on a sample of texts.
+
+    :param regexp: A compiled regex.
+    :type regexp: re.Pattern
+    :rtype: regex.Pattern or re.Pattern
+    """
+    try:
+        return _CONCURRENT_REGEXES[regexp]
+    except KeyError:
+        pass
+    # Imported on first use, only the concurrent programs need it.
+    import regex
+
+    try:
+        compiled = regex.compile(regexp.pattern, regexp.flags)
+    except regex.error:
+        compiled = regexp
+    _CONCURRENT_REGEXES[regexp] = compiled
+    return compiled
+
+
+def literal(pattern):
+    """
+    Returns the string matched by *pattern* if it is a plain literal, i.e.
+    it has no metacharacters other than escaped punctuations, else None.
+
+        >>> literal(r"\\(")
+        '('
+        >>> literal(r"'ll ")
+        "'ll "
+        >>> literal(r"'([sS]) ") is None
+        True
+    """
+    chars, i = [], 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\":
+            escaped = pattern[i + 1 : i + 2]
+            if not escaped or escaped.isalnum() or escaped == "_":
+                return None
+            chars.append(escaped)
+            i += 2
+        elif char in ".^$*+?{[|()":
+            return None
+        else:
+            chars.append(char)
+            i += 1
+    return "".join(chars) or None
+
+
+def _class_end(pattern, i):
+    """Returns the index of the "]" closing the character class at *i*."""
+    j = i + 1
+    if pattern.startswith("^", j):
+        j += 1
+    if pattern.startswith("]", j):
+        j += 1
+    while j < len(pattern) and pattern[j] != "]":
+        j += 2 if pattern[j] == "\\" else 1
+    return j
+
+
+def _group_end(pattern, i):
+    """Returns the index of the ")" closing the group at *i*."""
+    depth, j = 0, i
+    while j < len(pattern):
+        char = pattern[j]
+        if char == "\\":
+            j += 2
+            continue
+        if char == "[":
+            j = _class_end(pattern, j)
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth == 0:
+                return j
+        j += 1
+    return j
+
+
+def _skip_quantifier(pattern, i):
+    """
+    Skips the quantifier at *i*, returns the next index and whether the
+    quantified atom may be absent from a match.
+    """
+    quantifier = pattern[i : i + 1]
+    if quantifier == "{":
+        i = pattern.find("}", i) + 1 or len(pattern)
+    elif quantifier in ("?", "*", "+"):
+        i += 1
+    else:
+        return i, False
+    # Skip the lazy modifier.
+    if pattern.startswith("?", i):
+        i += 1
+    return i, quantifier != "+"
+
+
+def required_chars(regexp):
+    """
+    Returns the set of characters that any match of the compiled *regexp*
+    contains. The analysis is conservative, characters inside alternations,
+    optional atoms and lookarounds are ignored, and so are the cased
+    characters of a case-insensitive regexp.
+
+        >>> sorted(required_chars(re.compile(r"([^a-z])[']([a-z])")))
+        ["'"]
+        >>> sorted(required_chars(re.compile(r"n't ")))
+        [' ', "'", 'n', 't']
+        >>> sorted(required_chars(re.compile(r"@[a-z]+", re.IGNORECASE)))
+        ['@']
+        >>> required_chars(re.compile(r"a|b"))
+        set()
+    """
+    pattern, chars, i = regexp.pattern, set(), 0
+    # Alternations make the analysis moot.
+    if re.search(r"(?<!\\)(?:\\\\)*\|", pattern):
+        return chars
+    while i < len(pattern):
+        char, atom = pattern[i], None
+        if char == "\\":
+            escaped = pattern[i + 1 : i + 2]
+            if escaped and not (escaped.isalnum() or escaped == "_"):
+                atom = escaped
+            i += 2
+        elif char == "[":
+            end = _class_end(pattern, i)
+            members = literal(pattern[i + 1 : end])
+            if members and len(members) == 1:
+                atom = members
+            i = end + 1
+        elif char == "(":
+            end = _group_end(pattern, i)
+            optional = _skip_quantifier(pattern, end + 1)[1]
+            if pattern.startswith("(?", i) or optional:
+                # Skip lookarounds, flags and optional groups as a whole.
+                i = end + 1
+            else:
+                i += 1
+            continue
+        elif char == ")":
+            i = _skip_quantifier(pattern, i + 1)[0]
+            continue
+        elif char not in ".^${":
+            atom = char
+        if char not in "\\[":
+            i += 1
+        i, optional = _skip_quantifier(pattern, i)
+        if atom is not None and not optional:
+            chars.add(atom)
+    if regexp.flags & re.IGNORECASE:
+        chars = {char for char in chars if char.lower() == char.upper()}
+    return chars
+
+
+def _guard_char(chars):
+    """Picks the character least likely to occur in ordinary text."""
+    return sorted(chars, key=lambda c: (c.isspace(), c.isalnum(), c))[0]
+
+
+def _mergeable(literals):
+    """
+    Checks that a chain of literal (pattern, substitution) rules gives the
+    same output when all rules are matched in a single scan: no two patterns
+    can overlap and no substitution can create a match for a later pattern.
+    """
+    for i, (pattern, substitution) in enumerate(literals):
+        if not substitution or "\n" in pattern:
+            return False
+        for later, _ in literals[i + 1 :]:
+            if set(later) & set(substitution):
+                return False
+            for a, b in ((pattern, later), (later, pattern)):
+                if a in b or any(a.endswith(b[:k]) for k in range(1, len(b))):
+                    return False
+    return True
+
+
+class _ConcurrentPattern(object):
+    """The sub() of a regex module pattern, matching with concurrent=True."""
+
+    __slots__ = ("regexp",)
+
+    def __init__(self, regexp):
+        self.regexp = regexp
+
+    @classmethod
+    def wrap(cls, regexp):
+        compiled = concurrent_regex(regexp)
+        return regexp if compiled is regexp else cls(compiled)
+
+    def sub(self, substitution, text):
+        return self.regexp.sub(substitution, text, concurrent=True)
+
+
+class RegexProgram(object):
+    """
+    An execution plan for a chain of (regexp, substitution) rules that gives
+    the same output as applying the rules sequentially, i.e.
+
+        for regexp, substitution in rules:
+            text = regexp.sub(substitution, text)
+
+    The compiler merges consecutive rules that replace independent literal
+    strings into a single pass (a str.translate() when all literals are
+    single characters, an alternation regex with a dispatch table otherwise)
+    and skips runs of rules whose matches all require a character that is
+    absent from the text.
+
+    A concurrent program matches with the ``regex`` module variants of the
+    regexes (see concurrent_regex()), called with ``concurrent=True``: they
+    release the GIL while matching, so that threads sharing the program run
+    on several cores. The sequential reference keeps the original regexes.
+
+        >>> rules = [(re.compile(r"\\("), "-LRB-"), (re.compile(r"\\)"), "-RRB-")]
+        >>> program = RegexProgram.compile(rules)
+        >>> program("(a)")
+        '-LRB-a-RRB-'
+        >>> program.plan()
+        [('translate', 2)]
+    """
+
+    def __init__(self, rules, block=False, concurrent=False):
+        """
+        :param rules: The (regexp, substitution) rules in order of application.
+        :type rules: list(tuple(re.Pattern, str))
+        :param block: Compile the line-wise variants of the rules, to apply
+            the program on blocks of newline-joined lines.
+        :type block: bool
+        :param concurrent: Match with the ``regex`` module, releasing the GIL.
+        :type concurrent: bool
+        """
+        self.rules = [
+            (linewise(regexp) if block else regexp, substitution)
+            for regexp, substitution in rules
+        ]
+        self.block = block
+        self.concurrent = concurrent
+        self.steps = []
+        self._compile()
+        if concurrent:
+            self.steps = [self._concurrent_step(step) for step in self.steps]
+
+    @classmethod
+    def compile(cls, rules, block=False, concurrent=False):
+        """Returns the (cached) program for the *rules*."""
+        key = (tuple(rules), block, concurrent)
+        try:
+            return _PROGRAMS[key]
+        except KeyError:
+            program = _PROGRAMS[key] = cls(rules, block, concurrent)
+            return program
+
+    @staticmethod
+    def _concurrent_step(step):
+        """Swaps the regexes of a step for their regex module variants."""
+        if step[0] == "alternation":
+            return step[0], _ConcurrentPattern.wrap(step[1]), step[2]
+        if step[0] == "guarded":
+            rules = [
+                (_ConcurrentPattern.wrap(regexp), substitution)
+                for regexp, substitution in step[2]
+            ]
+            return step[0], step[1], rules
+        return step
+
+    def _compile(self):
+        i = 0
+        while i < len(self.rules):
+            # Greedily merge a run of independent literal substitutions.
+            j, literals = i, []
+            while j < len(self.rules):
+                regexp, substitution = self.rules[j]
+                string = None
+                if not regexp.flags & ~(re.UNICODE | re.MULTILINE):
+                    string = literal(regexp.pattern)
+                if (
+                    string is None
+                    or not isinstance(substitution, str)
+                    or "\\" in substitution
+                    or not _mergeable(literals + [(string, substitution)])
+                ):
+                    break
+                literals.append((string, substitution))
+                j += 1
+            if len(literals) > 1:
+                table = dict(literals)
+                if all(len(string) == 1 for string in table):
+                    self.steps.append(("translate", str.maketrans(table)))
+                else:
+                    alternation = "|".join(re.escape(string) for string in table)
+                    self.steps.append(("alternation", re.compile(alternation), table))
+                i = j
+                continue
+
+            # Otherwise, group a run of rules that require a common character.
+            j, common = i, None
+            while j < len(self.rules):
+                chars = required_chars(self.rules[j][0])
+                if not chars or (common is not None and not common & chars):
+                    break
+                common = chars if common is None else common & chars
+                j += 1
+            if j > i:
+                self.steps.append(("guarded", _guard_char(common), self.rules[i:j]))
+                i = j
+            else:
+                self.steps.append(("guarded", None, self.rules[i : i + 1]))
+                i += 1
+
+    def plan(self):
+        """
+        Summarizes the execution plan as (kind, no. of rules) pairs, where kind
+        is one of "translate", "alternation", "guarded" or "rule".
+        """
+        summary = []
+        for step in self.steps:
+            if step[0] == "translate":
+                summary.append(("translate", len(step[1])))
+            elif step[0] == "alternation":
+                summary.append(("alternation", len(step[2])))
+            elif step[1] is None:
+                summary.append(("rule", 1))
+            else:
+                summary.append(("guarded", len(step[2])))
+        return summary
+
+    def __call__(self, text):
+        for step in self.steps:
+            kind = step[0]
+            if kind == "translate":
+                text = text.translate(step[1])
+            elif kind == "alternation":
+                table = step[2]
+                text = step[1].sub(lambda match: table[match.group()], text)
+            elif step[1] is None or step[1] in text:
+                for regexp, substitution in step[2]:
+                    text = regexp.sub(substitution, text)
+        return text
+
+    def apply_sequentially(self, text):
+        """Applies the rules one by one, the reference for the program."""
+        for regexp, substitution in self.rules:
+            text = regexp.sub(substitution, text)
+        return text
+
+    def verify(self, texts):
+        """
+        Returns the (text, expected, output) triples for which the program
+        output differs from the sequential application of the rules.
+        """
+        mismatches = []
+        for text in texts:
+            expected, output = self.apply_sequentially(text), self(text)
+            if expected != output:
+                mismatches.append((text, expected, output))
+        return mismatches
+
+
+__all__ = ["RegexProgram", "concurrent_regex"]
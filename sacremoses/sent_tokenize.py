@@ -3,7 +3,7 @@
 
 import re
 
-from sacremoses.corpus import Perluniprops
+from sacremoses.corpus import Perluniprops, charclasses
 from sacremoses.corpus import NonbreakingPrefixes
 
 perluniprops = Perluniprops()
@@ -20,13 +20,13 @@ class MosesSentTokenizer(object):
 
     r"""
     # Perl Unicode Properties character sets.
-    IsPi = str("".join(perluniprops.chars("IsPi")))
-    IsUpper = str("".join(perluniprops.chars("IsUpper")))
-    IsPf = str("".join(perluniprops.chars("IsPf")))
-    Punctuation = str("".join(perluniprops.chars("Punctuation")))
-    CJK = str("".join(perluniprops.chars("CJK")))
-    CJKSymbols = str("".join(perluniprops.chars("CJKSymbols")))
-    IsAlnum = str("".join(perluniprops.chars("IsAlnum")))
+    IsPi = charclasses.string("IsPi")
+    IsUpper = charclasses.string("IsUpper")
+    IsPf = charclasses.string("IsPf")
+    Punctuation = charclasses.string("Punctuation")
+    CJK = charclasses.string("CJK")
+    CJKSymbols = charclasses.string("CJKSymbols")
+    IsAlnum = charclasses.string("IsAlnum")
 
     # Remove ASCII junk.
     DEDUPLICATE_SPACE = r"\s+", r" "
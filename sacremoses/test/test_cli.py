@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests for cli.py
+"""
+
+import gzip
+import itertools
+import os
+import tempfile
+import unittest
+from functools import partial
+
+from click.testing import CliRunner
+
+from sacremoses.cli import LineStage, cli, read_checkpoint, run_fused, run_sharded
+from sacremoses.normalize import MosesPunctNormalizer
+from sacremoses.tokenize import MosesDetokenizer, MosesTokenizer
+from sacremoses.truecase import MosesTruecaser
+from sacremoses.util import newline_ranges, open_file
+
+LINES = ["Hello, world!", "Mr. Smith's 5,300 dots...", "", "«Bonjour» — a-b ¿Qué?"]
+
+# The global options of the pipeline, as the commands receive them.
+OPTIONS = dict(
+    language="en",
+    processes=1,
+    quiet=True,
+    start_method=None,
+    backend="processes",
+)
+
+
+def stage(name, *args):
+    """Returns the processor of the command *name* with the options *args*."""
+    return cli.commands[name].main(list(args), name, standalone_mode=False)
+
+
+def endless_lines():
+    for i in itertools.count():
+        yield "{} {}\n".format(LINES[i % len(LINES)], i)
+
+
+class CliTest(unittest.TestCase):
+    def run_cli(self, args, lines):
+        result = CliRunner().invoke(cli, ["-q"] + args, input="\n".join(lines) + "\n")
+        if result.exception:
+            raise result.exception
+        return result.output.splitlines()
+
+    def test_pipeline(self):
+        moses = MosesTokenizer()
+        normalizer = MosesPunctNormalizer()
+        expected = [
+            moses.tokenize(normalizer.normalize(line), return_str=True)
+            for line in LINES
+        ]
+        self.assertEqual(self.run_cli(["normalize", "tokenize"], LINES), expected)
+        self.assertEqual(
+            self.run_cli(["-j", "2", "normalize", "tokenize"], LINES), expected
+        )
+
+    def test_detokenize(self):
+        detokenizer = MosesDetokenizer()
+        expected = [detokenizer.detokenize(line.split()) for line in LINES]
+        self.assertEqual(self.run_cli(["detokenize"], LINES), expected)
+
+    def test_streaming(self):
+        # The stages pull the lines one by one, an endless input is fine.
+        names = ["normalize", "tokenize", "detokenize", "detruecase"]
+        stages = [stage(name)(**OPTIONS) for name in names]
+        self.assertTrue(all(isinstance(s, LineStage) for s in stages))
+        outputs = run_fused(endless_lines(), stages, None, **OPTIONS)
+        self.assertEqual(len(list(itertools.islice(outputs, 10))), 10)
+
+    def test_fused(self):
+        # The per-line commands run as a single Pipeline, with a single slow
+        # line log entry per line for all of them.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            log = os.path.join(tmpdir, "slow.tsv")
+            args = ["--line-timeout", "1e-9", "--slow-line-log", log]
+            self.run_cli(args + ["normalize", "tokenize"], LINES)
+            with open(log) as fin:
+                stages = [line.split("\t")[1] for line in fin]
+        self.assertEqual(stages, ["normalize+tokenize"] * len(LINES))
+
+    def test_truecase_train(self):
+        # Without the model file, the input is read to train and read again.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            modelfile = os.path.join(tmpdir, "model")
+            outputs = self.run_cli(["truecase", "-m", modelfile], LINES)
+            truecaser = MosesTruecaser(load_from=modelfile)
+            expected = [truecaser.truecase(line, return_str=True) for line in LINES]
+            self.assertEqual(outputs, expected)
+
+    def test_encoding(self):
+        # The input and the output are in --encoding, in blocks of any size.
+        detokenizer = MosesDetokenizer()
+        expected = [detokenizer.detokenize(line.split()) for line in LINES]
+        text = "\r\n".join(LINES) + "\r\n"
+        for args in [["-e", "utf-16"], ["-e", "utf-16", "--buffer-size", "3"]]:
+            result = CliRunner().invoke(
+                cli, ["-q"] + args + ["detokenize"], input=text.encode("utf-16")
+            )
+            with self.subTest(args=args):
+                self.assertEqual(result.exit_code, 0, result.output)
+                output = result.stdout_bytes.decode("utf-16")
+                self.assertEqual(output.split("\n"), expected + [""])
+
+    def test_input_output(self):
+        moses = MosesTokenizer()
+        text = "\n".join(LINES * 50) + "\r\nno newline at the end"
+        expected = [
+            moses.tokenize(line, return_str=True) for line in text.splitlines()
+        ]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_file = os.path.join(tmpdir, "input.txt")
+            output_file = os.path.join(tmpdir, "output.txt")
+            with open(input_file, "w", encoding="utf8", newline="") as fout:
+                fout.write(text)
+            for args in [[], ["-j", "2"], ["-j", "2", "--backend", "threads"]]:
+                args += ["--input", input_file, "--output", output_file, "tokenize"]
+                with self.subTest(args=args):
+                    self.assertEqual(self.run_cli(args, []), [])
+                    with open(output_file, encoding="utf8") as fin:
+                        self.assertEqual(fin.read().split("\n"), expected + [""])
+
+    def test_sharded(self):
+        # Every worker reads and writes a part of the file on its own.
+        moses = MosesTokenizer()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_file = os.path.join(tmpdir, "input.txt")
+            output_file = os.path.join(tmpdir, "output.txt")
+            for lines in [[], ["a.b"], LINES * 50]:
+                with open(input_file, "w", encoding="utf8") as fout:
+                    fout.writelines(line + "\n" for line in lines)
+                options = dict(OPTIONS, processes=3)
+                stages = [stage("tokenize")(**options)]
+                ranges = newline_ranges(input_file, 12)
+                run_sharded(
+                    input_file, ranges, output_file, stages, "utf8", 16, **options
+                )
+                expected = [moses.tokenize(line, return_str=True) for line in lines]
+                with self.subTest(lines=len(lines)):
+                    with open(output_file, encoding="utf8") as fin:
+                        self.assertEqual(fin.read().split("\n"), expected + [""])
+
+    def test_compressed(self):
+        # The multi-stream inputs are decompressed in parallel, the outputs are
+        # compressed as their extension says.
+        moses = MosesTokenizer()
+        lines = LINES * 50
+        expected = [moses.tokenize(line, return_str=True) for line in lines]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_file = os.path.join(tmpdir, "input.txt.gz")
+            with open(input_file, "wb") as fout:
+                for i in range(0, len(lines), 7):
+                    part = "".join(line + "\n" for line in lines[i : i + 7])
+                    fout.write(gzip.compress(part.encode("utf8")))
+            for output in ["output.txt", "output.txt.bz2", "output.txt.xz"]:
+                for args in [[], ["-j", "2"]]:
+                    output_file = os.path.join(tmpdir, output)
+                    args += ["--input", input_file, "--output", output_file]
+                    with self.subTest(args=args):
+                        self.assertEqual(self.run_cli(args + ["tokenize"], []), [])
+                        with open_file(output_file, encoding="utf8") as fin:
+                            self.assertEqual(fin.read().split("\n"), expected + [""])
+
+    def test_batch(self):
+        # The files are processed one by one into the same names under the
+        # --output-dir, and the files in the checkpoint manifest are skipped.
+        moses = MosesTokenizer()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            inputs = {}
+            for name in ["a.txt", "b.txt.gz", os.path.join("sub", "c.txt")]:
+                lines = [line + name for line in LINES]
+                inputs[name] = lines
+                filename = os.path.join(tmpdir, "in", name)
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                with open_file(filename, "w", encoding="utf8") as fout:
+                    fout.writelines(line + "\n" for line in lines)
+            output_dir = os.path.join(tmpdir, "out")
+            checkpoint = os.path.join(output_dir, ".sacremoses-checkpoint")
+            pattern = os.path.join(tmpdir, "in", "**", "*")
+            for args in [[], ["-j", "2"], ["-j", "2", "--backend", "threads"]]:
+                with self.subTest(args=args):
+                    if os.path.exists(checkpoint):
+                        os.remove(checkpoint)
+                    args += ["--input-glob", pattern, "--output-dir", output_dir]
+                    self.assertEqual(self.run_cli(args + ["tokenize"], []), [])
+                    for name, lines in inputs.items():
+                        filename = os.path.join(output_dir, name)
+                        with open_file(filename, encoding="utf8") as fin:
+                            outputs = fin.read().split("\n")
+                        tokenize = partial(moses.tokenize, return_str=True)
+                        self.assertEqual(outputs, list(map(tokenize, lines)) + [""])
+                    self.assertEqual(len(read_checkpoint(checkpoint)), 3)
+            # A resumed run only processes the files that are not done.
+            done = os.path.join(output_dir, "a.txt")
+            with open(done, "w") as fout:
+                fout.write("done\n")
+            with open(checkpoint, "w") as fout:
+                fout.write(os.path.join(tmpdir, "in", "a.txt") + "\npartial")
+            args = ["--input-glob", pattern, "--output-dir", output_dir, "tokenize"]
+            self.run_cli(args, [])
+            with open(done) as fin:
+                self.assertEqual(fin.read(), "done\n")
+            expected = {os.path.join(tmpdir, "in", name) for name in inputs}
+            self.assertEqual(read_checkpoint(checkpoint), expected)
+            # The training commands don't map a line to a line.
+            result = CliRunner().invoke(cli, args[:-1] + ["train-truecase", "-m", "x"])
+            self.assertEqual(result.exit_code, 2)
+
+    def test_batch_inputs(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # A glob that matches no files is an error, not an empty run.
+            args = ["--input-glob", os.path.join(tmpdir, "*.txt")]
+            args += ["--output-dir", os.path.join(tmpdir, "out"), "tokenize"]
+            result = CliRunner().invoke(cli, args)
+            self.assertEqual(result.exit_code, 2)
+            self.assertIn("matches no files", result.output)
+            # The outputs under the --output-dir are not inputs of a resumed
+            # run, when the glob matches them too.
+            with open(os.path.join(tmpdir, "a.txt"), "w") as fout:
+                fout.write("Hello, world!\n")
+            args = ["--input-glob", os.path.join(tmpdir, "**", "*.txt")]
+            args += ["--output-dir", os.path.join(tmpdir, "out"), "tokenize"]
+            for _ in range(2):
+                self.run_cli(args, [])
+                outputs = sorted(os.listdir(os.path.join(tmpdir, "out")))
+                self.assertEqual(outputs, [".sacremoses-checkpoint", "a.txt"])
+            checkpoint = os.path.join(tmpdir, "out", ".sacremoses-checkpoint")
+            expected = {os.path.join(tmpdir, "a.txt")}
+            self.assertEqual(read_checkpoint(checkpoint), expected)
@@ -4,8 +4,12 @@
 Tests for corpus.py
 """
 
+import os
+import re
 import sys
 import doctest
+import shutil
+import tempfile
 import unittest
 
 from sacremoses import corpus
@@ -72,6 +76,91 @@ class CorpusTest(unittest.TestCase):
             ["\u0bb0", "\u0bc2", "\u0ba4\u0bbf\u0bb0\u0bc1", "\u0b8f", "\u0baa\u0bc0"],
         )
 
+    def test_charclasses(self):
+        charclasses = corpus.CharClasses()
+        perluniprops = corpus.Perluniprops()
+        for category in ["IsAlpha", "IsLower", "IsSc"]:
+            with self.subTest(category=category):
+                chars = set(perluniprops.chars(category))
+                self.assertEqual(charclasses.charset(category), chars)
+                # The charsets are built once.
+                self.assertIs(charclasses.charset(category), charclasses.charset(category))
+                for char in list(chars)[:100] + ["\x00", "\U0010ffff"]:
+                    self.assertEqual(charclasses.contains(category, char), char in chars)
+        self.assertIn("(", charclasses.charset("IsSc", extra="("))
+
+
+    def test_charclasses_ranges(self):
+        charclasses = corpus.CharClasses()
+        classes = [(category,) for category in charclasses.perluniprops.available_categories]
+        classes += [
+            ("IsAlnum", "Hangul", "Han", "Hiragana", "Katakana", "Han"),
+            ("IsSc", "IsSo"),
+        ]
+        for categories in classes:
+            with self.subTest(categories=categories):
+                chars = charclasses.charset(*categories, extra="\t-]^\\")
+                ranges = corpus.merge_ranges(
+                    r for c in categories for r in charclasses.perluniprops.ranges(c)
+                )
+                ranges = corpus.merge_ranges(ranges + [(ord(c), ord(c)) for c in "\t-]^\\"])
+                codepoints = [cp for first, last in ranges for cp in range(first, last + 1)]
+                self.assertEqual(codepoints, sorted(map(ord, chars)))
+                # Spot-check the regex on the bounds of every range and their
+                # neighbours.
+                regex = re.compile("[{}]".format(charclasses.ranges(*categories, extra="\t-]^\\")))
+                for first, last in ranges:
+                    for cp in [first - 1, first, last, last + 1]:
+                        char = chr(max(cp, 0))
+                        self.assertEqual(bool(regex.match(char)), char in chars)
+
+    def test_data_bundle(self):
+        bundle = corpus.DataBundle(corpus.DataBundle.build())
+        self.assertFalse(bundle.is_stale())
+        perluniprops = corpus.Perluniprops()
+        for category in perluniprops.available_categories:
+            with self.subTest(category=category):
+                relative_path = os.path.join("data", "perluniprops", category + ".txt")
+                text = corpus.get_data(relative_path).decode("utf-8")
+                self.assertEqual(bundle.text(category), text)
+                codepoints = [
+                    cp for first, last in bundle.ranges(category)
+                    for cp in range(first, last + 1)
+                ]
+                self.assertEqual(codepoints, sorted(set(map(ord, text))))
+        nonbreaking_prefixes = corpus.NonbreakingPrefixes()
+        for language in set(nonbreaking_prefixes.available_langs.values()):
+            with self.subTest(language=language):
+                filename = "nonbreaking_prefix." + language
+                relative_path = os.path.join("data", "nonbreaking_prefixes", filename)
+                lines = corpus.get_data(relative_path).decode("utf-8").splitlines()
+                lines = [line.strip() for line in lines if line.strip()]
+                self.assertEqual(bundle.prefix_lines(filename), lines)
+
+    def test_data_bundle_rebuild(self):
+        datadir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, datadir)
+        for subdir in ["perluniprops", "nonbreaking_prefixes"]:
+            shutil.copytree(
+                os.path.join(corpus.DATADIR, subdir), os.path.join(datadir, subdir)
+            )
+        path = corpus.write_data_bundle(datadir)
+        self.assertEqual(path, os.path.join(datadir, corpus.DataBundle.FILENAME))
+        for use_mmap in [False, True]:
+            bundle = corpus.DataBundle.load(path, use_mmap=use_mmap)
+            self.assertFalse(bundle.is_stale(datadir))
+            self.assertEqual(bundle.text("IsSc"), corpus.Perluniprops().text("IsSc"))
+        # A changed source file makes the bundle stale, the modification time
+        # alone doesn't, as it changes when the package is installed.
+        os.utime(os.path.join(datadir, "perluniprops", "IsSc.txt"), (0, 0))
+        self.assertFalse(bundle.is_stale(datadir))
+        with open(os.path.join(datadir, "perluniprops", "IsSc.txt"), "a") as fout:
+            fout.write("(")
+        self.assertTrue(bundle.is_stale(datadir))
+        bundle = corpus.DataBundle(corpus.DataBundle.build(datadir))
+        self.assertFalse(bundle.is_stale(datadir))
+        self.assertTrue(bundle.text("IsSc").endswith("("))
+
 
 def load_tests(loader, tests, ignore):
     tests.addTests(doctest.DocTestSuite(corpus))
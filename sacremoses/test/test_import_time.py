@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks the cold start, `import sacremoses` and MosesTokenizer('en'), in a
+fresh interpreter.
+
+Shared CI runners are too noisy for a hard time limit, the cold start is
+compared to the start of a bare interpreter on the same machine instead. The
+published budget is checked with SACREMOSES_BENCHMARK=1 in the environment.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+from sacremoses import corpus
+
+# The published budget in seconds, see README.md.
+COLD_START_BUDGET = 0.25
+# The cold start takes about 4 times the start of a bare interpreter, and took
+# about 20 times before the deferred imports and the data bundle.
+COLD_START_RATIO = 10
+
+COLD_START = """
+import json, os, sys, time
+opened = []
+sys.addaudithook(
+    lambda event, args: opened.append(args[0])
+    if event == "open" and isinstance(args[0], str) else None
+)
+start_time = time.perf_counter()
+import sacremoses
+imported = time.perf_counter()
+sacremoses.MosesTokenizer("en")
+constructed = time.perf_counter()
+print(json.dumps({
+    "import": imported - start_time,
+    "constructor": constructed - imported,
+    "modules": sorted(sys.modules),
+    "data_files": [
+        os.path.relpath(path, sacremoses.corpus.DATADIR)
+        for path in opened
+        if path.startswith(sacremoses.corpus.DATADIR)
+    ],
+}))
+"""
+
+
+def cold_start():
+    output = subprocess.check_output([sys.executable, "-c", COLD_START])
+    return json.loads(output)
+
+
+def bare_start():
+    start_time = time.perf_counter()
+    subprocess.check_call([sys.executable, "-c", "pass"])
+    return time.perf_counter() - start_time
+
+
+class ImportTimeTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # The bundle is built with the package, but not in a source checkout.
+        path = os.path.join(corpus.DATADIR, corpus.DataBundle.FILENAME)
+        if not os.path.exists(path):
+            try:
+                corpus.write_data_bundle()
+            except OSError:
+                pass
+
+    def test_cold_start_ratio(self):
+        # The best of a few runs, the first one may write the bytecode caches.
+        timings = [cold_start() for _ in range(3)]
+        elapsed = min(timing["import"] + timing["constructor"] for timing in timings)
+        bare = min(bare_start() for _ in range(3))
+        self.assertLess(elapsed, bare * COLD_START_RATIO)
+
+    @unittest.skipUnless(
+        os.environ.get("SACREMOSES_BENCHMARK"), "set SACREMOSES_BENCHMARK=1 to run"
+    )
+    def test_cold_start_budget(self):
+        timings = [cold_start() for _ in range(3)]
+        elapsed = min(timing["import"] + timing["constructor"] for timing in timings)
+        self.assertLess(elapsed, COLD_START_BUDGET)
+
+    def test_data_files(self):
+        # A single read of the bundle, instead of the data files one by one.
+        data_files = cold_start()["data_files"]
+        path = os.path.join(corpus.DATADIR, corpus.DataBundle.FILENAME)
+        if not os.path.exists(path):
+            self.skipTest("the data bundle isn't built")
+        self.assertEqual(data_files, [corpus.DataBundle.FILENAME])
+
+    def test_deferred_imports(self):
+        modules = cold_start()["modules"]
+        for module in ["joblib", "tqdm", "regex", "xml.sax.saxutils", "pkgutil"]:
+            with self.subTest(module=module):
+                self.assertNotIn(module, modules)
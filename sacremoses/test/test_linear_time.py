@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""
+Adversarial benchmarks, the tokenizer and truecaser run in linear time in
+the length of the input.
+"""
+
+import os
+import tempfile
+import time
+import unittest
+
+from sacremoses.tokenize import MosesTokenizer
+from sacremoses.truecase import MosesTruecaser
+
+
+def timed(func, text):
+    # The CPU time of the process, the time that other processes on the
+    # machine take from it doesn't count.
+    start_time = time.process_time()
+    func(text)
+    return time.process_time() - start_time
+
+
+class LinearTimeTest(unittest.TestCase):
+    # The inputs are scaled up by FACTOR, a quadratic stage would take about
+    # FACTOR ** 2 times longer, a linear one FACTOR times, the threshold is
+    # about their geometric mean.
+    FACTOR = 8
+    # The smallest input is grown until it takes this many seconds, so that
+    # the timer resolution, about 16ms on Windows, and the noise of shared CI
+    # runners are small next to the timings.
+    MIN_TIME = 0.01
+
+    def assert_linear(self, func, payload, n=250, repeat=3):
+        while timed(func, payload(n)) < self.MIN_TIME and n < 10 ** 6:
+            n *= 2
+        small, large = payload(n), payload(n * self.FACTOR)
+        # The best of a few runs, the small and the large inputs alternate so
+        # that a change of the load of the machine affects both.
+        timings = [(timed(func, small), timed(func, large)) for _ in range(repeat)]
+        small_time = max(min(t for t, _ in timings), self.MIN_TIME)
+        ratio = min(t for _, t in timings) / small_time
+        self.assertLess(ratio, self.FACTOR * 3, "{:.1f}x slower".format(ratio))
+
+    def test_tokenize(self):
+        moses = MosesTokenizer()
+        tokenize = lambda text: moses.tokenize(text, aggressive_dash_splits=True)
+        payloads = {
+            "dots": lambda n: "a" + "." * n + "b",
+            "spaced dots": lambda n: ".. " * n,
+            "dotmulti": lambda n: "DOTMULTI." * n,
+            "dotdot": lambda n: "DOT" * n + "MULTI",
+            "apostrophes": lambda n: "'" * n,
+            "contractions": lambda n: "a'b'" * n,
+            "commas": lambda n: "1,a," * n,
+            "prefixes": lambda n: "Mr. No. " * n,
+            "dashes": lambda n: "a-" * n,
+            "junk": lambda n: "\x01 \t" * n,
+            "huge line": lambda n: "This, is a sentence with Mr. Smith's 5,300 dots... " * (n // 10),
+        }
+        for name, payload in payloads.items():
+            with self.subTest(payload=name):
+                self.assert_linear(tokenize, payload)
+
+    def test_split_xml(self):
+        payloads = {
+            "words": lambda n: "a " * n,
+            "tags": lambda n: "<a> " * n,
+            "open tags": lambda n: "<a " * n,
+            "brackets": lambda n: "<" * n,
+            "factors": lambda n: "a|" + "<b>|" * n,
+        }
+        for name, payload in payloads.items():
+            with self.subTest(payload=name):
+                self.assert_linear(MosesTruecaser.split_xml, payload)
+
+    def test_custom_nonbreaking_prefixes(self):
+        filename = os.path.join(tempfile.mkdtemp(), "nonbreaking_prefix.custom")
+        self.addCleanup(os.rmdir, os.path.dirname(filename))
+        self.addCleanup(os.remove, filename)
+
+        def payload(n):
+            with open(filename, "w") as fout:
+                fout.write("\n".join("Abbr{}".format(i) for i in range(n * 10)))
+            return filename
+
+        tokenizer = lambda filename: MosesTokenizer(custom_nonbreaking_prefixes_file=filename)
+        self.assert_linear(tokenizer, payload)
@@ -76,3 +76,18 @@ class TestNormalizer(unittest.TestCase):
         text = 'from the ‘bad bank’, Northern, wala\u00A0«\u00A0dox ci jawwu Les «\u00A0wagonways\u00A0»\u00A0étaient construits'
         expected = '''from the 'bad bank," Northern, wala "dox ci jawwu Les "wagonways" étaient construits'''
         assert moses_perl_parity.normalize(text) == expected
+
+    def test_moses_normalize_cache(self):
+        moses = MosesPunctNormalizer(cache_size=10)
+        text = "«Hello»,  world…"
+        assert moses.normalize(text) == MosesPunctNormalizer().normalize(text)
+        assert moses.normalize(text) == MosesPunctNormalizer().normalize(text)
+        assert moses.cache.info().hits == 1
+
+    def test_moses_normalize_shared_instances(self):
+        MosesPunctNormalizer.clear_resident()
+        self.addCleanup(MosesPunctNormalizer.clear_resident)
+        moses = MosesPunctNormalizer.get("fr", norm_numbers=False)
+        assert MosesPunctNormalizer.get(lang="fr", norm_numbers=False) is moses
+        assert MosesPunctNormalizer.get("fr") is not moses
+        assert MosesPunctNormalizer.resident_configurations() == 2
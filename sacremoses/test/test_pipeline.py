@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests for pipeline.py
+"""
+
+import pickle
+import unittest
+from functools import partial
+
+from sacremoses.normalize import MosesPunctNormalizer
+from sacremoses.pipeline import Pipeline
+from sacremoses.tokenize import MosesDetokenizer, MosesTokenizer
+
+
+class PipelineTest(unittest.TestCase):
+    lines = ["Hello,  world!", "Mr. Smith's 5,300 dots...", "", "«Bonjour» a-b"] * 25
+
+    def setUp(self):
+        self.normalizer = MosesPunctNormalizer()
+        self.tokenizer = MosesTokenizer()
+        self.pipeline = Pipeline(
+            [
+                self.normalizer.normalize,
+                partial(self.tokenizer.tokenize, return_str=True),
+            ]
+        )
+        self.expected = [
+            self.tokenizer.tokenize(self.normalizer.normalize(line), return_str=True)
+            for line in self.lines
+        ]
+
+    def test_call(self):
+        self.assertEqual([self.pipeline(line) for line in self.lines], self.expected)
+        self.assertEqual(Pipeline([])("a  b"), "a  b")
+
+    def test_process_batch(self):
+        self.assertEqual(self.pipeline.process_batch(self.lines), self.expected)
+        outputs = self.pipeline.process_batch(self.lines, processes=2, chunksize=7)
+        self.assertEqual(outputs, self.expected)
+        outputs = self.pipeline.process_batch(
+            self.lines, processes=2, chunksize=7, backend="threads"
+        )
+        self.assertEqual(outputs, self.expected)
+
+    def test_process_stream(self):
+        outputs = self.pipeline.process_stream(iter(self.lines), processes=2)
+        self.assertEqual(next(outputs), self.expected[0])
+        self.assertEqual(list(outputs), self.expected[1:])
+
+    def test_pickle(self):
+        pipeline = pickle.loads(pickle.dumps(self.pipeline))
+        self.assertEqual([pipeline(line) for line in self.lines], self.expected)
+
+    def test_steps(self):
+        with self.assertRaises(TypeError):
+            Pipeline([str.split, "detokenize"])
+        detokenize = MosesDetokenizer().detokenize
+        pipeline = Pipeline([str.split, detokenize])
+        self.assertEqual(pipeline("Hello , world !"), "Hello, world!")
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests for RegexProgram
+"""
+
+import random
+import re
+import unittest
+
+from sacremoses.program import RegexProgram, linewise
+from sacremoses.tokenize import MosesTokenizer
+
+
+def random_texts(n=500, seed=0):
+    rng = random.Random(seed)
+    alphabet = list("ab Z9 0,.'\"`-()[]{}<>&|@#$%!?;:/\t…日") + [
+        "...",
+        "n't ",
+        "'s ",
+        "'ll ",
+        "'re ",
+        "Mr.",
+        " cannot ",
+        "--",
+        "''",
+        "``",
+        "&amp;",
+        "l'",
+    ]
+    return [
+        "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+        for _ in range(n)
+    ]
+
+
+class TestRegexProgram(unittest.TestCase):
+    def test_merge_literals(self):
+        moses = MosesTokenizer()
+        program = RegexProgram.compile(moses.MOSES_ESCAPE_XML_REGEXES)
+        assert program.plan() == [("translate", 8)]
+        assert program("a & <b> | 'c'") == "a &amp; &lt;b&gt; &#124; &apos;c&apos;"
+
+        # Overlapping literals are not merged, only guarded by a common char.
+        rules = [(re.compile(r"ab"), "x"), (re.compile(r"bc"), "y")]
+        assert RegexProgram(rules).plan() == [("guarded", 2)]
+        assert RegexProgram(rules)("abc") == "xc"
+        # Nor are literals that a previous substitution creates.
+        rules = [(re.compile(r"a"), "bb"), (re.compile(r"b"), "c")]
+        assert RegexProgram(rules)("ab") == "ccc"
+
+    def test_tokenizer_chains(self):
+        texts = random_texts()
+        for lang in ["en", "fr", "de"]:
+            moses = MosesTokenizer(lang)
+            chains = [
+                moses.MOSES_PENN_REGEXES_1,
+                moses.MOSES_PENN_REGEXES_2,
+                moses.MOSES_ESCAPE_XML_REGEXES,
+            ]
+            for block in [False, True]:
+                plan = moses.execution_plan(aggressive_dash_splits=True, block=block)
+                for program in plan.values():
+                    assert program.verify(texts) == []
+                for rules in chains:
+                    assert RegexProgram.compile(rules, block).verify(texts) == []
+
+    def test_concurrent_chains(self):
+        # The regex module variants of the rules give the same output as the
+        # re patterns of the sequential reference.
+        texts = random_texts() + [
+            text.replace("a", "é").replace("Z", "İ").replace("b", "\u00a0")
+            for text in random_texts(seed=1)
+        ]
+        for lang in ["en", "fr", "zh"]:
+            moses = MosesTokenizer(lang, concurrent=True)
+            chains = [
+                moses.MOSES_PENN_REGEXES_1,
+                moses.MOSES_PENN_REGEXES_2,
+                moses.MOSES_ESCAPE_XML_REGEXES,
+            ]
+            for block in [False, True]:
+                plan = moses.execution_plan(aggressive_dash_splits=True, block=block)
+                programs = list(plan.values()) + [
+                    RegexProgram.compile(rules, block, concurrent=True)
+                    for rules in chains
+                ]
+                for program in programs:
+                    assert program.concurrent
+                    assert program.verify(texts) == []
+                    # None of the regexes is left to the re module.
+                    for step in program.steps:
+                        if step[0] == "guarded":
+                            for regexp, _ in step[2]:
+                                assert not isinstance(regexp, re.Pattern)
+
+    def test_linewise(self):
+        moses = MosesTokenizer()
+        regexp, substitution = moses.COMMA_SEPARATE_2
+        lines = ["a,", "5,", "x ,"]
+        expected = [regexp.sub(substitution, line) for line in lines]
+        block = linewise(regexp).sub(substitution, "\n".join(lines))
+        assert block.split("\n") == expected
@@ -4,9 +4,16 @@
 Tests for MosesTokenizer
 """
 
+import os
+import pickle
+import tempfile
+import threading
 import unittest
+from functools import partial
 
-from sacremoses.tokenize import MosesTokenizer, MosesDetokenizer
+from sacremoses.tokenize import MosesTokenizer, MosesDetokenizer, ProtectedPatternSet
+from sacremoses.tokenize import _PROTECTED_PATTERN_SETS
+from sacremoses.util import ThreadedExecutor, TimeBudget
 
 
 class TestTokenzier(unittest.TestCase):
@@ -208,6 +215,180 @@ class TestTokenzier(unittest.TestCase):
         self.assertEqual(moses.tokenize(text, protected_patterns=patterns), expected)
         self.assertEqual(moses.tokenize(text, protected_patterns=reversed(patterns)), expected)
 
+    def test_protected_pattern_set(self):
+        moses = MosesTokenizer()
+        protected = ProtectedPatternSet(moses.WEB_PROTECTED_PATTERNS)
+        # More than the 1000 tokens of the old zfill(3) placeholders.
+        handles = ["@user{}".format(i) for i in range(1200)]
+        text = "Hi " + ", ".join(handles) + "!"
+        expected = ["Hi"] + [t for h in handles for t in (h, ",")][:-1] + ["!"]
+        assert moses.tokenize(text, protected_patterns=protected) == expected
+        # A placeholder followed by a digit is restored unambiguously.
+        masked, tokens = protected.mask("#nlp1 @a 7")
+        assert protected.restore(masked, tokens) == "#nlp1 @a 7"
+        # Repeated strings are protected at their own positions.
+        assert protected.spans("@a @a") == [(0, 2), (3, 5)]
+
+    def test_protected_pattern_set_cache(self):
+        # The pattern sets of the callers are cached, up to a bound.
+        patterns = [r"@[a-z]+"]
+        protected = ProtectedPatternSet.compile(patterns)
+        assert ProtectedPatternSet.compile(patterns) is protected
+        for i in range(1000):
+            ProtectedPatternSet.compile([r"@[a-z]+{}".format(i)])
+        assert len(_PROTECTED_PATTERN_SETS) <= _PROTECTED_PATTERN_SETS.maxsize
+
+    def test_tokenize_cache(self):
+        moses = MosesTokenizer(cache_size=2)
+        lines = ["Hello, world!", "Cookie banner!", "Hello, world!", "Another line?"]
+        expected = [MosesTokenizer().tokenize(line) for line in lines]
+        assert [moses.tokenize(line) for line in lines] == expected
+        assert moses.cache.info() == (1, 3, 1, 2, 2)
+        # The call options are part of the key.
+        assert moses.tokenize("Hello, world!", escape=False, return_str=True) == "Hello , world !"
+        assert moses.tokenize_batch(lines) == expected
+        moses.cache.clear()
+        assert len(moses.cache) == 0 and moses.cache.info().hits == 0
+
+    def test_tokenize_word_cache(self):
+        moses, words = MosesTokenizer(), MosesTokenizer(word_cache_size=100)
+        lines = [
+            "The cat sat on the mat.",
+            "The cat isn't on the mat, it's on the 5,300 mats...",
+            "Mr. Smith met Mr. jones and No. 5 and No. Five.",
+            "'quoted' 'words' and ,commas, and 'A.'",
+            "the U.S. cat said: 'The mat.'",
+        ]
+        for line in lines:
+            for escape in [True, False]:
+                expected = moses.tokenize(line, escape=escape, return_str=True)
+                assert words.tokenize(line, escape=escape, return_str=True) == expected
+        # The chunks "The", "cat", "on" and "the" are tokenized once.
+        assert words.word_cache.info().hits > 0
+        assert words.tokenize(lines[0]) == ["The", "cat", "sat", "on", "the", "mat", "."]
+
+    def test_plain_ascii_fast_path(self):
+        moses = MosesTokenizer()
+        lines = ["The cat sat on 2 mats.", "See Mr.", "See No.", "I saw DOTMULTI", "No 5 \t."]
+        for line in lines:
+            assert moses.tokenize(line) == moses._tokenize(line, False, True, None).split()
+        assert moses.fast_path_count == len(lines) - 1
+        moses.tokenize("The cat sat on 2 mats, or 1.")
+        assert moses.fast_path_count == len(lines) - 1
+
+    def test_tokenize_spans(self):
+        moses = MosesTokenizer()
+        text = "Don't  split sugar-free\x01 R&D http://x.org/a-b ...DOTMULTI"
+        tokens = moses.tokenize(text, aggressive_dash_splits=True)
+        spans = moses.tokenize(text, aggressive_dash_splits=True, return_spans=True)
+        assert [text[start:end] for start, end, _ in spans] == [
+            "Don", "'t", "split", "sugar", "-", "free", "R", "&", "D",
+            "http", ":", "/", "/", "x.org", "/", "a", "-", "b", "...", "DOTMULTI",
+        ]
+        assert [token for token, span in zip(tokens, spans) if span.synthesized] == [
+            "&apos;t", "@-@", "&amp;", "@-@", ".",
+        ]
+        patterns = moses.WEB_PROTECTED_PATTERNS
+        spans = moses.tokenize(text, protected_patterns=patterns, return_spans=True)
+        assert text[spans[-3].start : spans[-3].end] == "http://x.org/a-b"
+
+    def test_tokenize_spans_resync(self):
+        # The junk inside of a "DOTMULTI", and the tokens that are not in the
+        # input, don't shift the spans of the next tokens.
+        moses = MosesTokenizer()
+        text = "a\x01DOT\x01MULTI b THISISPROTECTED000 c, d"
+        tokens = moses.tokenize(text, protected_patterns=[r"c,"])
+        spans = moses.tokenize(text, protected_patterns=[r"c,"], return_spans=True)
+        assert tokens == ["a.", "b", "c,", "c,", "d"]
+        assert [text[start:end] for start, end, _ in spans] == [
+            "a\x01DOT\x01MULTI", "b", "THISISPROTECTED000", "c,", "d",
+        ]
+        assert [span.synthesized for span in spans] == [True, False, True, False, False]
+        with self.assertRaises(ValueError):
+            moses.tokenize(text, return_str=True, return_spans=True)
+
+    def test_tokenize_time_budget(self):
+        moses = MosesTokenizer()
+        # A catastrophically backtracking pattern.
+        patterns = ProtectedPatternSet([r"(a+)+c"])
+        tokenize = partial(moses.tokenize, return_str=True, protected_patterns=patterns)
+        budget = TimeBudget(tokenize, timeout=0.1)
+        output, elapsed, timed_out = budget.run("Hello, world!")
+        assert (output, timed_out) == ("Hello , world !", False)
+        output, elapsed, timed_out = budget.run("Hello,  " + "a" * 40 + "!c")
+        assert (output, timed_out) == ("Hello, " + "a" * 40 + "!c", True)
+        assert 0.1 <= elapsed < 1
+        # The tokenizer is still usable after the interrupt.
+        assert budget("Hello, world!") == "Hello , world !"
+
+    def test_shared_instances(self):
+        MosesTokenizer.clear_resident()
+        self.addCleanup(MosesTokenizer.clear_resident)
+        moses = MosesTokenizer.get("zh")
+        assert MosesTokenizer.get(lang="zh") is moses
+        assert MosesTokenizer.get("en") is not moses
+        assert MosesTokenizer.resident_configurations() == 2
+        assert moses.tokenize("日本語, a-b") == MosesTokenizer("zh").tokenize("日本語, a-b")
+        # Concurrent calls share a single instance.
+        shared = []
+        threads = [
+            threading.Thread(target=lambda: shared.append(MosesTokenizer.get("ko")))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(set(map(id, shared))) == 1
+        assert MosesTokenizer.resident_configurations() == 3
+
+    def test_shared_instances_custom_nonbreaking_prefixes(self):
+        MosesTokenizer.clear_resident()
+        self.addCleanup(MosesTokenizer.clear_resident)
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as fout:
+            fout.write("Zzz\n")
+        self.addCleanup(os.remove, fout.name)
+        moses = MosesTokenizer.get(custom_nonbreaking_prefixes_file=fout.name)
+        assert MosesTokenizer.get("en", fout.name) is moses
+        assert moses.tokenize("Zzz. Xyz.") == ["Zzz.", "Xyz", "."]
+        # An edited file is loaded into a new instance.
+        with open(fout.name, "a") as fout:
+            fout.write("Xyz\n")
+        os.utime(fout.name, ns=(0, 10 ** 9))
+        moses = MosesTokenizer.get(custom_nonbreaking_prefixes_file=fout.name)
+        assert moses.tokenize("Zzz. Xyz.") == ["Zzz.", "Xyz."]
+        assert MosesTokenizer.resident_configurations() == 2
+
+    def test_pickle(self):
+        moses = MosesTokenizer("zh", word_cache_size=10)
+        text = "日本語, a-b Mr. Smith."
+        expected = moses.tokenize(text)
+        # The configuration is pickled, not the prefixes and character sets.
+        pickled = pickle.dumps(moses)
+        assert len(pickled) < 1000
+        copy = pickle.loads(pickled)
+        assert copy.tokenize(text) == expected
+        assert copy.word_cache.maxsize == 10
+        detokenizer = MosesDetokenizer("fr")
+        assert pickle.loads(pickle.dumps(detokenizer)).lang == "fr"
+
+    def test_large_custom_nonbreaking_prefixes(self):
+        # Tens of thousands of domain abbreviations, with duplicates.
+        prefixes = ["Abbr{}".format(i) for i in range(50000)]
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as fout:
+            fout.write("# Comment\n")
+            fout.write("\n".join(prefixes + prefixes[:100] + ["No #NUMERIC_ONLY#"]))
+        self.addCleanup(os.remove, fout.name)
+        moses = MosesTokenizer(custom_nonbreaking_prefixes_file=fout.name)
+        assert moses.NONBREAKING_PREFIXES == prefixes + ["No #NUMERIC_ONLY#"]
+        assert moses.NUMERIC_ONLY_PREFIXES == ["No"]
+        text = "See Abbr49999. Mr. Smith, No. 5 and Abbr7. Abbr123x. No. Abbr0."
+        expected = "See Abbr49999. Mr . Smith , No. 5 and Abbr7. Abbr123x . No . Abbr0."
+        assert moses.tokenize(text, return_str=True) == expected
+        assert moses.handles_nonbreaking_prefixes("Abbr7. Abbr123x. Abbr0.") == (
+            "Abbr7. Abbr123x . Abbr0."
+        )
+
     def test_final_comma_split_after_number(self):
         moses = MosesTokenizer()
         text = "Sie sollten vor dem Upgrade eine Sicherung dieser Daten erstellen (wie unter Abschnitt 4.1.1, „Sichern aller Daten und Konfigurationsinformationen“ beschrieben). "
@@ -241,8 +422,97 @@ class TestTokenzier(unittest.TestCase):
         ]
         self.assertEqual(moses.tokenize(text), expected_tokens)
 
+    def test_tokenize_batch(self):
+        lines = [
+            "This, is a sentence with weird\xbb symbols\u2026 appearing everywhere\xbf",
+            "This ain't funny. It's actually hillarious, yet double Ls. | [] < > [ ] & You're gonna shake it off? Don't?",
+            "",
+            "  abc def.  ",
+            "2016, pp.",
+            "1,\n2 .. 3... foo-bar 'Hello.'",
+            ",leading comma and trailing number 5,",
+            "The meeting will take place at 11:00 a.m. Tuesday.",
+            "\"Quoted\" `text` with (parens) and/or {braces} cannot gonna",
+            "this is a webpage https://stackoverflow.com/questions/6181381 that kicks ass",
+        ]
+        for lang in ["en", "fr", "de"]:
+            moses = MosesTokenizer(lang=lang)
+            for kwargs in [
+                {},
+                {"return_str": True},
+                {"aggressive_dash_splits": True, "escape": False},
+                {"protected_patterns": moses.WEB_PROTECTED_PATTERNS},
+            ]:
+                with self.subTest(lang=lang, **kwargs):
+                    expected = [moses.tokenize(line, **kwargs) for line in lines]
+                    self.assertEqual(
+                        moses.tokenize_batch(lines, batch_size=3, **kwargs), expected
+                    )
+            with self.subTest(lang=lang, penn=True):
+                expected = [moses.penn_tokenize(line) for line in lines]
+                self.assertEqual(moses.penn_tokenize_batch(lines), expected)
+
+    def test_tokenize_batch_processes(self):
+        moses = MosesTokenizer()
+        lines = ["Hello, world!", "Mr. Smith's 5,300 dots...", "", "a-b c/d"] * 50
+        expected = moses.tokenize_batch(lines, aggressive_dash_splits=True)
+        tokenized = moses.tokenize_batch(
+            lines, aggressive_dash_splits=True, batch_size=30, processes=2
+        )
+        assert tokenized == expected
+        expected = moses.penn_tokenize_batch(lines, return_str=True)
+        assert moses.penn_tokenize_batch(lines, return_str=True, processes=2) == expected
+
+    def test_tokenize_threads(self):
+        # A fresh instance, its regex programs and caches are built while the
+        # threads tokenize with it.
+        moses = MosesTokenizer(cache_size=64)
+        lines = ["Hello, world!", "Mr. Smith's 5,300 dots...", "", "a-b c/d"] * 50
+        expected = [MosesTokenizer().tokenize(line, return_str=True) for line in lines]
+        tokenize = partial(moses.tokenize, return_str=True)
+        executor = ThreadedExecutor(tokenize, threads=4, chunksize=3)
+        assert list(executor.map(lines)) == expected
+        tokenize_batch = partial(moses.tokenize_batch, return_str=True)
+        executor = ThreadedExecutor(tokenize_batch, threads=4, chunksize=7, batched=True)
+        assert list(executor.map(lines)) == expected
+        # The same with the rules matched by the regex module, off the GIL.
+        moses = MosesTokenizer(cache_size=64, concurrent=True)
+        tokenize = partial(moses.tokenize, return_str=True)
+        executor = ThreadedExecutor(tokenize, threads=4, chunksize=3)
+        assert list(executor.map(lines)) == expected
+        penn = [MosesTokenizer().penn_tokenize(line, return_str=True) for line in lines]
+        assert moses.penn_tokenize_batch(lines, return_str=True) == penn
+
+    def test_tokenize_batch_charclass_newline(self):
+        # IsN, IsSc and IsSo contain a newline, the regexes applied on
+        # newline-joined blocks must not match across the line separator.
+        lines = ["5", ",5,", "a 5", ",b", "$", "'s", "9", ",", "©", ",x"]
+        for lang in ["en", "fr"]:
+            moses = MosesTokenizer(lang=lang)
+            with self.subTest(lang=lang):
+                expected = [moses.tokenize(line) for line in lines]
+                self.assertEqual(moses.tokenize_batch(lines), expected)
+                expected = [moses.penn_tokenize(line) for line in lines]
+                self.assertEqual(moses.penn_tokenize_batch(lines), expected)
+
+    def test_penn_tokenize(self):
+        moses = MosesTokenizer()
+        text = "Hello (world), and/or I cannot... \"ok\""
+        expected_tokens = "Hello -LRB- world -RRB- , and @/@ or I can not ... `` ok &apos; &apos;".split()
+        self.assertEqual(moses.penn_tokenize(text), expected_tokens)
+
 
 class TestDetokenizer(unittest.TestCase):
+    def test_shared_instances(self):
+        MosesDetokenizer.clear_resident()
+        self.addCleanup(MosesDetokenizer.clear_resident)
+        detokenizer = MosesDetokenizer.get("fr")
+        assert MosesDetokenizer.get(lang="fr") is detokenizer
+        assert MosesDetokenizer.resident_configurations() == 1
+        # The configurations of the classes are counted separately.
+        assert MosesTokenizer.get("fr") is not detokenizer
+        assert MosesDetokenizer.resident_configurations() == 1
+
     def test_moses_detokenize(self):
         mt = MosesTokenizer()
         md = MosesDetokenizer()
@@ -294,6 +564,14 @@ class TestDetokenizer(unittest.TestCase):
         assert mt.tokenize(text) == expected_tokens
         assert md.detokenize(expected_tokens) == expected_detokens
 
+    def test_plain_ascii_fast_path(self):
+        moses = MosesDetokenizer()
+        tokens = ["The", "cat", "sat", "on", "2", "mats", "..", "Then", "it", "left", "."]
+        assert moses.detokenize(tokens) == "The cat sat on 2 mats.. Then it left."
+        assert moses.fast_path_count == 1
+        assert moses.detokenize(["The", "cat", "sat", "on", "2", "mats", "!"]) == "The cat sat on 2 mats!"
+        assert moses.fast_path_count == 1
+
     def test_detokenize_with_aggressive_split(self):
         mt = MosesTokenizer()
         md = MosesDetokenizer()
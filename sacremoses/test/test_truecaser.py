@@ -5,10 +5,13 @@ Tests for MosesTokenizer
 """
 
 import os
+import pickle
+import tempfile
 import unittest
 import urllib.request
 
 from sacremoses.truecase import MosesTruecaser, MosesDetruecaser
+from sacremoses.util import open_file
 
 
 def get_content(url):
@@ -108,6 +111,24 @@ class TestTruecaser(unittest.TestCase):
         self.assertEqual(moses.truecase('" start start', use_known=True), ['"', 'Start', 'start'])
 
 
+class TestTruecaserFile(unittest.TestCase):
+    def test_compressed_file(self):
+        lines = ["Start the the The .", "Start of it .", "The end ."]
+        expected = MosesTruecaser().train([line.split() for line in lines])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for extension in [".gz", ".bz2", ".xz"]:
+                filename = os.path.join(tmpdir, "train.txt" + extension)
+                with open_file(filename, "w", encoding="utf8") as fout:
+                    fout.writelines(line + "\n" for line in lines)
+                moses = MosesTruecaser()
+                with self.subTest(extension=extension):
+                    self.assertEqual(moses.train_from_file(filename), expected)
+                    self.assertEqual(
+                        list(moses.truecase_file(filename)),
+                        [moses.truecase(line, return_str=True) for line in lines],
+                    )
+
+
 class TestDetruecaser(unittest.TestCase):
     def test_moses_detruecase_str(self):
         moses = MosesDetruecaser()
@@ -132,3 +153,50 @@ class TestDetruecaser(unittest.TestCase):
         expected_str = "MLB Baseball standings"
         assert moses.detruecase(text) == expected
         assert moses.detruecase(text, return_str=True) == expected_str
+
+
+class TestTruecaserCache(unittest.TestCase):
+    def test_moses_truecase_cache(self):
+        docs = [["I", "read", "the", "adventures", "of", "Sherlock", "Holmes"]]
+        moses, uncached = MosesTruecaser(cache_size=10), MosesTruecaser()
+        moses.train(docs)
+        uncached.train(docs)
+        text = "THE ADVENTURES OF SHERLOCK HOLMES"
+        expected = uncached.truecase(text)
+        assert moses.truecase(text) == expected
+        # The cached tokens are not shared with the caller.
+        moses.truecase(text).append("!")
+        assert moses.truecase(text) == expected
+        assert moses.cache.info().hits == 2
+        # Training a new model clears the cache.
+        moses.train([["I", "read", "The", "Adventures"]])
+        assert len(moses.cache) == 0
+        assert moses.truecase("the adventures", return_str=True) == "The Adventures"
+
+
+class TestTruecaserPickle(unittest.TestCase):
+    docs = [["I", "read", "the", "adventures", "of", "Sherlock", "Holmes"]] * 3
+
+    def test_pickle_trained_model(self):
+        moses = MosesTruecaser(is_asr=True)
+        moses.train(self.docs)
+        copy = pickle.loads(pickle.dumps(moses))
+        assert copy.is_asr and copy.model == moses.model
+        text = "THE ADVENTURES OF SHERLOCK HOLMES"
+        assert copy.truecase(text) == moses.truecase(text)
+
+    def test_pickle_model_file(self):
+        moses = MosesTruecaser()
+        moses.train(self.docs)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            modelfile = os.path.join(tmpdir, "model.truecasemodel")
+            moses.save_model(modelfile)
+            moses = MosesTruecaser(load_from=modelfile)
+            # Only the path of the model file is pickled.
+            pickled = pickle.dumps(moses)
+            assert b"Sherlock" not in pickled
+            assert pickle.loads(pickled).model == moses.model
+            # A model trained after loading has no file to reload from.
+            moses.train([["The", "Adventures"]])
+            copy = pickle.loads(pickle.dumps(moses))
+        assert copy.model == moses.model
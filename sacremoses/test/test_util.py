@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests for util.py
+"""
+
+import bz2
+import gzip
+import io
+import itertools
+import lzma
+import multiprocessing
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from sacremoses.util import (
+    ChunkedExecutor,
+    ThreadedExecutor,
+    atomic_open,
+    atomic_temp_files,
+    newline_ranges,
+    open_file,
+    parallelize_preprocess,
+    read_compressed_range_lines,
+    read_lines,
+    read_range_lines,
+    read_shared_block,
+    stream_ranges,
+    write_lines,
+    write_shared_block,
+)
+
+
+def count_lines(lines):
+    return [len(lines)] * len(lines)
+
+
+def reverse_lines(lines):
+    return [line[::-1] for line in lines]
+
+
+class ChunkedExecutorTest(unittest.TestCase):
+    def test_map(self):
+        lines = [str(i) for i in range(1000)]
+        executor = ChunkedExecutor(str.upper, processes=2, chunksize=7)
+        self.assertEqual(list(executor.map(lines)), lines)
+        self.assertEqual(list(executor.map([])), [])
+
+    def test_map_batched(self):
+        executor = ChunkedExecutor(count_lines, processes=2, chunksize=4, batched=True)
+        self.assertEqual(list(executor.map("abcdefghij")), [4] * 8 + [2] * 2)
+
+    def test_map_streams(self):
+        # An endless input is consumed chunk by chunk, not all at once.
+        executor = ChunkedExecutor(str, processes=2, chunksize=10)
+        outputs = itertools.islice(executor.map(itertools.count()), 25)
+        self.assertEqual(list(outputs), [str(i) for i in range(25)])
+
+    def test_map_errors(self):
+        executor = ChunkedExecutor(int, processes=2, chunksize=2)
+        with self.assertRaises(ValueError):
+            list(executor.map(["1", "2", "x"]))
+
+    @unittest.skipUnless(
+        "fork" in multiprocessing.get_all_start_methods(), "fork is not available"
+    )
+    def test_map_fork(self):
+        # The forked workers inherit the processor, it is never pickled.
+        model = {"a": "A", "b": "B"}
+        executor = ChunkedExecutor(
+            lambda line: model.get(line, line), processes=2, chunksize=2, start_method="fork"
+        )
+        self.assertEqual(list(executor.map("abcab")), list("ABcAB"))
+
+
+class ThreadedExecutorTest(unittest.TestCase):
+    def test_map(self):
+        lines = [str(i) for i in range(1000)]
+        executor = ThreadedExecutor(str.upper, threads=4, chunksize=7)
+        self.assertEqual(list(executor.map(lines)), lines)
+        self.assertEqual(list(executor.map([])), [])
+
+    def test_map_batched(self):
+        executor = ThreadedExecutor(count_lines, threads=2, chunksize=4, batched=True)
+        self.assertEqual(list(executor.map("abcdefghij")), [4] * 8 + [2] * 2)
+
+    def test_map_streams(self):
+        executor = ThreadedExecutor(str, threads=2, chunksize=10)
+        outputs = itertools.islice(executor.map(itertools.count()), 25)
+        self.assertEqual(list(outputs), [str(i) for i in range(25)])
+
+    def test_map_errors(self):
+        executor = ThreadedExecutor(int, threads=2, chunksize=2)
+        with self.assertRaises(ValueError):
+            list(executor.map(["1", "2", "x"]))
+
+    def test_parallelize_preprocess(self):
+        outputs = parallelize_preprocess(str.upper, "abc", 2, backend="threads")
+        self.assertEqual(list(outputs), ["A", "B", "C"])
+        with self.assertRaises(ValueError):
+            parallelize_preprocess(str.upper, "abc", 2, backend="fibers")
+
+
+def shared_memory_segments():
+    # The POSIX shared memory segments of this user, where they are listed.
+    if not os.path.isdir("/dev/shm"):
+        return set()
+    return {name for name in os.listdir("/dev/shm") if name.startswith("psm_")}
+
+
+class SharedMemoryTest(unittest.TestCase):
+    lines = ["Hello, world!", "", "\xbfQu\xe9?", "\u4f60\u597d \U0001f600", " "] * 50
+
+    def test_block(self):
+        block = write_shared_block(self.lines)
+        try:
+            self.assertEqual(read_shared_block(block), self.lines)
+        finally:
+            block.close()
+            block.unlink()
+        block = write_shared_block([])
+        try:
+            self.assertEqual(read_shared_block(block), [])
+        finally:
+            block.close()
+            block.unlink()
+
+    def test_map(self):
+        before = shared_memory_segments()
+        executor = ChunkedExecutor(
+            str.upper, processes=2, chunksize=7, shared_memory=True
+        )
+        outputs = list(executor.map(self.lines))
+        self.assertEqual(outputs, [line.upper() for line in self.lines])
+        self.assertEqual(shared_memory_segments(), before)
+
+    def test_map_batched(self):
+        executor = ChunkedExecutor(
+            count_lines, processes=2, chunksize=4, batched=True, shared_memory=True
+        )
+        with self.assertRaises(TypeError):
+            list(executor.map(self.lines))
+        executor = ChunkedExecutor(
+            reverse_lines, processes=2, chunksize=4, batched=True, shared_memory=True
+        )
+        self.assertEqual(
+            list(executor.map(self.lines)), [line[::-1] for line in self.lines]
+        )
+
+    def test_map_abandoned(self):
+        # The segments of the chunks in flight are released as well.
+        before = shared_memory_segments()
+        executor = ChunkedExecutor(str, processes=2, chunksize=3, shared_memory=True)
+        outputs = executor.map(str(i) for i in range(100))
+        self.assertEqual(list(itertools.islice(outputs, 5)), list("01234"))
+        outputs.close()
+        self.assertEqual(shared_memory_segments(), before)
+
+    def test_map_errors(self):
+        before = shared_memory_segments()
+        executor = ChunkedExecutor(len, processes=2, chunksize=2, shared_memory=True)
+        with self.assertRaises(TypeError):
+            list(executor.map(self.lines))
+        self.assertEqual(shared_memory_segments(), before)
+
+
+class BufferedIOTest(unittest.TestCase):
+    text = "Hello,\r\nworld!\r\xbfQu\xe9?\n\n\u4f60\u597d\r\n\U0001f600 x"
+
+    def test_read_lines(self):
+        # The same lines as a text file, whatever the blocks split.
+        for encoding in ["utf8", "utf-16", "latin-1"]:
+            data = self.text.encode(encoding, "replace")
+            expected = list(io.TextIOWrapper(io.BytesIO(data), encoding=encoding))
+            for buffer_size in [1, 2, 3, 5, 1 << 20]:
+                with self.subTest(encoding=encoding, buffer_size=buffer_size):
+                    lines = read_lines(io.BytesIO(data), encoding, buffer_size)
+                    self.assertEqual(list(lines), expected)
+        self.assertEqual(list(read_lines(io.BytesIO(b""))), [])
+        with self.assertRaises(UnicodeDecodeError):
+            list(read_lines(io.BytesIO(b"\xff\n")))
+
+    def test_write_lines(self):
+        lines = self.text.splitlines()
+        for buffer_size in [1, 3, 1 << 20]:
+            fout = io.BytesIO()
+            write_lines(iter(lines), fout, "utf-16", buffer_size)
+            with self.subTest(buffer_size=buffer_size):
+                self.assertEqual(
+                    fout.getvalue().decode("utf-16").split("\n"), lines + [""]
+                )
+        fout = io.BytesIO()
+        write_lines([], fout)
+        self.assertEqual(fout.getvalue(), b"")
+
+    def test_newline_ranges(self):
+        data = self.text.encode("utf8")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "lines.txt")
+            with open(filename, "wb") as fout:
+                fout.write(data)
+            expected = list(read_lines(io.BytesIO(data)))
+            for count in [1, 2, 3, 7, 100]:
+                ranges = newline_ranges(filename, count)
+                with self.subTest(count=count):
+                    self.assertLessEqual(len(ranges), count)
+                    self.assertEqual(ranges[0][0], 0)
+                    self.assertEqual(ranges[-1][1], len(data))
+                    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                        self.assertEqual(end, start)
+                        self.assertEqual(data[end - 1 : end], b"\n")
+                    lines = [
+                        line
+                        for start, end in ranges
+                        for line in read_range_lines(filename, start, end, "utf8", 3)
+                    ]
+                    self.assertEqual(lines, expected)
+            open(filename, "wb").close()
+            self.assertEqual(newline_ranges(filename, 4), [])
+
+    def test_open_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for extension in ["", ".gz", ".bz2", ".xz"]:
+                filename = os.path.join(tmpdir, "lines.txt" + extension)
+                with open_file(filename, "w", encoding="utf8") as fout:
+                    fout.write(self.text)
+                with open_file(filename, encoding="utf8", newline="") as fin:
+                    with self.subTest(extension=extension):
+                        self.assertEqual(fin.read(), self.text)
+
+    def test_atomic_open(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "lines.txt.gz")
+            with atomic_open(filename, "w", encoding="utf8") as fout:
+                fout.write(self.text)
+            # The file keeps its previous content if the writing fails.
+            with self.assertRaises(ValueError):
+                with atomic_open(filename, "wb") as fout:
+                    fout.write(b"partial")
+                    raise ValueError
+            with open_file(filename, encoding="utf8", newline="") as fin:
+                self.assertEqual(fin.read(), self.text)
+            self.assertEqual(os.listdir(tmpdir), ["lines.txt.gz"])
+            # The temporary files of a killed process.
+            leftover = os.path.join(tmpdir, ".0123abcd.lines.txt.gz")
+            open(leftover, "w").close()
+            self.assertEqual(list(atomic_temp_files([filename])), [leftover])
+            self.assertEqual(list(atomic_temp_files([leftover])), [])
+
+    def test_atomic_open_sync(self):
+        # The whole file is synced through the handle that wrote it, before it
+        # replaces the previous one.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for name in ["lines.txt", "lines.txt.gz", "lines.txt.xz"]:
+                filename = os.path.join(tmpdir, name)
+                synced = []
+
+                def fsync(fd):
+                    # Windows can't fsync a read-only handle, nor write to it.
+                    os.write(fd, b"")
+                    synced.append(os.fstat(fd).st_size)
+
+                with self.subTest(name=name), mock.patch("os.fsync", fsync):
+                    with atomic_open(filename, "w", encoding="utf8") as fout:
+                        fout.write(self.text)
+                    self.assertEqual(synced, [os.path.getsize(filename)])
+
+    def test_stream_ranges(self):
+        # Concatenated streams that end in the middle of the lines, as in
+        # `split -b` and compressed parts.
+        data = (self.text * 50).encode("utf8")
+        expected = list(read_lines(io.BytesIO(data)))
+        parts = [data[i : i + 97] for i in range(0, len(data), 97)]
+        compressors = {
+            ".gz": gzip.compress,
+            ".bz2": bz2.compress,
+            ".xz": lzma.compress,
+        }
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for extension, compress in compressors.items():
+                filename = os.path.join(tmpdir, "lines.txt" + extension)
+                with open(filename, "wb") as fout:
+                    fout.writelines(compress(part) for part in parts)
+                for count in [1, 2, 5, 100]:
+                    ranges = stream_ranges(filename, count)
+                    with self.subTest(extension=extension, count=count):
+                        self.assertEqual(len(ranges), min(count, len(parts)))
+                        lines = [
+                            line
+                            for start, end in ranges
+                            for line in read_compressed_range_lines(
+                                filename, start, end, "utf8", 5
+                            )
+                        ]
+                        self.assertEqual(lines, expected)
+                # A truncated stream is an error, as for gzip.open().
+                with open(filename, "r+b") as fout:
+                    fout.truncate(os.path.getsize(filename) - 10)
+                size = os.path.getsize(filename)
+                with self.assertRaises(EOFError):
+                    list(read_compressed_range_lines(filename, 0, size))
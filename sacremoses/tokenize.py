@@ -1,34 +1,268 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import bisect
+import os
 import re
+import string
+from collections import namedtuple
+from functools import partial
 
 from sacremoses.corpus import Perluniprops
 from sacremoses.corpus import NonbreakingPrefixes
-from sacremoses.util import is_cjk
+from sacremoses.corpus import charclasses
+from sacremoses.util import (
+    ChunkedExecutor,
+    LazyPattern,
+    LRUCache,
+    SharedInstances,
+    chunked,
+    is_cjk,
+    rebuild,
+)
 from sacremoses.indic import VIRAMAS, NUKTAS
+from sacremoses.program import RegexProgram, linewise, literal, required_chars
 
 perluniprops = Perluniprops()
 nonbreaking_prefixes = NonbreakingPrefixes()
 
+# Cache of the compiled pattern sets, see ProtectedPatternSet.compile(). It is
+# bounded, as the re module's own cache, since the callers may pass different
+# patterns for every request of a long-running service.
+_PROTECTED_PATTERN_SETS = LRUCache(maxsize=256)
 
-class MosesTokenizer(object):
+# The character offsets of a token in the input of MosesTokenizer.tokenize(),
+# *synthesized* is True if the token differs from text[start:end], e.g. the
+# "@-@" of an aggressive dash split or an XML escaped symbol.
+TokenSpan = namedtuple("TokenSpan", ["start", "end", "synthesized"])
+
+
+class ProtectedPatternSet(object):
+    """
+    A set of regexes whose matches are kept as single tokens by the tokenizer,
+    compiled once and reused on every line.
+
+        >>> protected = ProtectedPatternSet([r"@[a-z]+", r"#[a-z]+"])
+        >>> masked, tokens = protected.mask("Hi @moses, #mt!")
+        >>> masked
+        'Hi THISISPROTECTED000, THISISPROTECTED001!'
+        >>> protected.restore(masked, tokens)
+        'Hi @moses, #mt!'
+    """
+
+    PLACEHOLDER = "THISISPROTECTED"
+
+    def __init__(self, patterns, flags=re.IGNORECASE):
+        """
+        :param patterns: The regexes to protect, strings or compiled regexes.
+        :type patterns: iter(str)
+        :param flags: The flags to compile the string patterns with.
+        :type flags: int
+        """
+        self.patterns = [
+            pattern if isinstance(pattern, re.Pattern) else re.compile(pattern, flags)
+            for pattern in patterns
+        ]
+        # The characters that all matches of a pattern contain, the pattern
+        # is not searched in texts without them.
+        self._guards = [required_chars(pattern) for pattern in self.patterns]
+
+    @classmethod
+    def from_file(cls, filename, flags=re.IGNORECASE):
+        """Reads the patterns from a file with one regex per line."""
+        with open(filename, encoding="utf8") as fin:
+            patterns = [line.strip() for line in fin]
+        return cls([pattern for pattern in patterns if pattern], flags)
+
+    @classmethod
+    def compile(cls, patterns):
+        """
+        Returns the (cached) pattern set of the *patterns*, a
+        ProtectedPatternSet is returned as it is.
+        """
+        if isinstance(patterns, cls):
+            return patterns
+        patterns = tuple(patterns)
+        protected = _PROTECTED_PATTERN_SETS.get(patterns)
+        if protected is None:
+            protected = cls(patterns)
+            _PROTECTED_PATTERN_SETS.put(patterns, protected)
+        return protected
+
+    def spans(self, text):
+        """
+        Returns the sorted, non-overlapping (start, end) spans of the protected
+        tokens. Longest matches are always protected first, so the order of
+        the patterns does not matter.
+
+            >>> ProtectedPatternSet([r"\\w+(,\\w+)+,of", r"\\w+(-\\w+)+"]).spans("a this,type,of-s-thingy")
+            [(2, 14), (15, 23)]
+        """
+        matches = [
+            match.span()
+            for pattern, guard in zip(self.patterns, self._guards)
+            if all(char in text for char in guard)
+            for match in pattern.finditer(text)
+            if match.end() > match.start()
+        ]
+        if len(matches) < 2:
+            return matches
+        # Keep the longest matches that do not overlap a longer one.
+        starts, ends = [], []
+        for start, end in sorted(matches, key=lambda span: span[1] - span[0], reverse=True):
+            i = bisect.bisect_right(starts, start)
+            if (i and ends[i - 1] > start) or (i < len(starts) and starts[i] < end):
+                continue
+            starts.insert(i, start)
+            ends.insert(i, end)
+        return list(zip(starts, ends))
+
+    def mask(self, text):
+        """
+        Replaces the protected tokens with numbered placeholders, returns the
+        masked text and the protected tokens.
+        """
+        spans = self.spans(text)
+        if not spans:
+            return text, []
+        # Fixed width numbers, so that a placeholder followed by a digit is
+        # not ambiguous.
+        width = max(3, len(str(len(spans) - 1)))
+        pieces, tokens, pos = [], [], 0
+        for i, (start, end) in enumerate(spans):
+            pieces.append(text[pos:start])
+            pieces.append(self.PLACEHOLDER + str(i).zfill(width))
+            tokens.append(text[start:end])
+            pos = end
+        pieces.append(text[pos:])
+        return "".join(pieces), tokens
+
+    def restore(self, text, tokens):
+        """Replaces the placeholders with the *tokens* from mask()."""
+        if not tokens:
+            return text
+        width = max(3, len(str(len(tokens) - 1)))
+        pieces = text.split(self.PLACEHOLDER)
+        restored = [pieces[0]]
+        for piece in pieces[1:]:
+            index = piece[:width]
+            if len(index) == width and index.isdecimal() and int(index) < len(tokens):
+                restored.append(tokens[int(index)] + piece[width:])
+            else:
+                restored.append(self.PLACEHOLDER + piece)
+        return "".join(restored)
+
+
+class NonbreakingPrefixResolver(object):
+    """
+    Decides which tokens ending with a period keep it, for the nonbreaking
+    prefixes of a language or a custom file. The prefixes are held in hashed
+    sets, so a lookup costs the same for a few hundred prefixes as for tens
+    of thousands of domain abbreviations, and a sentence is resolved in one
+    pass over its tokens.
+
+        >>> resolver = NonbreakingPrefixResolver(["Mr", "No #NUMERIC_ONLY#"])
+        >>> resolver("Mr. Smith has No. 5 and no No. more.")
+        'Mr. Smith has No. 5 and no No . more .'
+    """
+
+    NUMERIC_ONLY = re.compile(r"[\s]+(\#NUMERIC_ONLY\#)")
+
+    def __init__(self, prefixes, alpha_chars=None, lower_chars=None):
+        """
+        :param prefixes: The lines of a nonbreaking prefix file, the prefixes
+            marked with #NUMERIC_ONLY# only keep their period before a number.
+        :type prefixes: iter(str)
+        :param alpha_chars: The IsAlpha characters, a prefix with a period and
+            any of them keeps its final period, e.g. "U.S."
+        :type alpha_chars: frozenset(str)
+        :param lower_chars: The IsLower characters, a token followed by a
+            lowercased one keeps its final period.
+        :type lower_chars: frozenset(str)
+        """
+        self.prefixes = list(prefixes)
+        self.numeric_only = [
+            w.rpartition(" ")[0] for w in self.prefixes if self.NUMERIC_ONLY.search(w)
+        ]
+        self._numeric_only = frozenset(self.numeric_only)
+        self._nonbreaking = frozenset(self.prefixes) - self._numeric_only
+        self.alpha_chars = alpha_chars or charclasses.charset("IsAlpha")
+        self.lower_chars = lower_chars or charclasses.charset("IsLower")
+
+    def is_nonbreaking(self, prefix):
+        """Checks if the *prefix* always keeps its final period."""
+        return prefix in self._nonbreaking
+
+    def is_numeric_only(self, prefix):
+        """Checks if the *prefix* keeps its final period before numbers."""
+        return prefix in self._numeric_only
+
+    def __call__(self, text):
+        """
+        Splits the final period off the tokens of the *text* that are not
+        nonbreaking prefixes, returns the single-space joined tokens.
+        """
+        tokens = text.split()
+        if "." not in text:
+            return " ".join(tokens)
+        last = len(tokens) - 1
+        for i, token in enumerate(tokens):
+            if len(token) < 2 or token[-1] != ".":
+                continue
+            prefix = token[:-1]
+            # Keeps the final period if
+            # i.   the prefix contains a fullstop and
+            #      any char in the prefix is within the IsAlpha charset,
+            # ii.  the prefix is a nonbreaking prefix without #NUMERIC_ONLY#,
+            # iii. the token is not the last token and the next token starts
+            #      with a lowercase char, or
+            # iv.  the prefix is a #NUMERIC_ONLY# prefix and the next token
+            #      starts with a digit.
+            if (
+                ("." in prefix and not self.alpha_chars.isdisjoint(prefix))
+                or prefix in self._nonbreaking
+                or (i != last and tokens[i + 1][0] in self.lower_chars)
+                or (
+                    i != last
+                    and prefix in self._numeric_only
+                    and "0" <= tokens[i + 1][0] <= "9"
+                )
+            ):
+                continue
+            tokens[i] = prefix + " ."
+        return " ".join(tokens)
+
+
+class MosesTokenizer(SharedInstances):
     """
     This is a Python port of the Moses Tokenizer from
     https://github.com/moses-smt/mosesdecoder/blob/master/scripts/tokenizer/tokenizer.perl
+
+    Thread safety: an instance can be shared by threads, e.g. the one of
+    MosesTokenizer.get(), and its tokenize(), penn_tokenize() and batch
+    methods called concurrently. They only read the rules, the prefixes and
+    the regexes, the line caches are locked and a regex program that two
+    threads compile at once is compiled twice alike. The fast_path_count
+    statistic may miss the lines counted concurrently. With concurrent=True
+    the rule chains release the GIL while matching, the prefixes and the
+    multidots are still handled under the GIL.
     """
 
     # Perl Unicode Properties character sets.
-    IsN = str("".join(perluniprops.chars("IsN")))
-    IsAlnum = str(
-        "".join(perluniprops.chars("IsAlnum")) + "".join(VIRAMAS) + "".join(NUKTAS)
-    )
-    IsSc = str("".join(perluniprops.chars("IsSc")))
-    IsSo = str("".join(perluniprops.chars("IsSo")))
-    IsAlpha = str(
-        "".join(perluniprops.chars("IsAlpha")) + "".join(VIRAMAS) + "".join(NUKTAS)
-    )
-    IsLower = str("".join(perluniprops.chars("IsLower")))
+    IsN = charclasses.string("IsN")
+    IsAlnum = charclasses.string("IsAlnum", extra="".join(VIRAMAS) + "".join(NUKTAS))
+    IsSc = charclasses.string("IsSc")
+    IsSo = charclasses.string("IsSo")
+    IsAlpha = charclasses.string("IsAlpha", extra="".join(VIRAMAS) + "".join(NUKTAS))
+    IsLower = charclasses.string("IsLower")
+
+    # The same character sets as the codepoint ranges of regex character
+    # classes, used to build the regexes below.
+    IsN_RANGES = charclasses.ranges("IsN")
+    IsAlnum_RANGES = charclasses.ranges("IsAlnum", extra="".join(VIRAMAS) + "".join(NUKTAS))
+    IsSc_RANGES = charclasses.ranges("IsSc")
+    IsSo_RANGES = charclasses.ranges("IsSo")
+    IsAlpha_RANGES = charclasses.ranges("IsAlpha", extra="".join(VIRAMAS) + "".join(NUKTAS))
 
     # Remove ASCII junk.
     DEDUPLICATE_SPACE = re.compile(r"\s+"), r" "
@@ -41,28 +275,30 @@ class MosesTokenizer(object):
     RIGHT_STRIP = r" $", r""  # Uses text.rstrip() instead.
 
     # Pad all "other" special characters not in IsAlnum.
-    PAD_NOT_ISALNUM = re.compile(r"([^{}\s\.'\`\,\-])".format(IsAlnum)), r" \1 "
+    PAD_NOT_ISALNUM = LazyPattern(r"([^{}\s\.'\`\,\-])".format(IsAlnum_RANGES)), r" \1 "
 
     # Splits all hyphens (regardless of circumstances), e.g.
     # 'foo-bar' -> 'foo @-@ bar'
     AGGRESSIVE_HYPHEN_SPLIT = (
-        re.compile(r"([{alphanum}])\-(?=[{alphanum}])".format(alphanum=IsAlnum)),
+        LazyPattern(r"([{alphanum}])\-(?=[{alphanum}])".format(alphanum=IsAlnum_RANGES)),
         r"\1 @-@ ",
     )
 
     # Make multi-dots stay together.
-    REPLACE_DOT_WITH_LITERALSTRING_1 = re.compile(r"\.([\.]+)"), " DOTMULTI\1"
-    REPLACE_DOT_WITH_LITERALSTRING_2 = re.compile(r"DOTMULTI\.([^\.])"), "DOTDOTMULTI \1"
-    REPLACE_DOT_WITH_LITERALSTRING_3 = re.compile(r"DOTMULTI\."), "DOTDOTMULTI"
+    REPLACE_DOT_WITH_LITERALSTRING_1 = re.compile(r"\.([\.]+)"), r" DOTMULTI\1"
+    REPLACE_DOT_WITH_LITERALSTRING_2 = re.compile(r"DOTMULTI\.([^\.])"), r"DOTDOTMULTI \1"
+    REPLACE_DOT_WITH_LITERALSTRING_3 = re.compile(r"DOTMULTI\."), r"DOTDOTMULTI"
+    # A "DOTMULTI" literal string and the periods left to replace.
+    DOTMULTI_PERIODS = re.compile(r"DOTMULTI\.+")
 
     # Separate out "," except if within numbers (5,300)
     # e.g.  A,B,C,D,E > A , B,C , D,E
     # First application uses up B so rule can't see B,C
     # two-step version here may create extra spaces but these are removed later
     # will also space digit,letter or letter,digit forms (redundant with next section)
-    COMMA_SEPARATE_1 = re.compile(r"([^{}])[,]".format(IsN)), r"\1 , "
-    COMMA_SEPARATE_2 = re.compile(r"[,]([^{}])".format(IsN)), r" , \1"
-    COMMA_SEPARATE_3 = re.compile(r"([{}])[,]$".format(IsN)), r"\1 , "
+    COMMA_SEPARATE_1 = LazyPattern(r"([^{}])[,]".format(IsN_RANGES)), r"\1 , "
+    COMMA_SEPARATE_2 = LazyPattern(r"[,]([^{}])".format(IsN_RANGES)), r" , \1"
+    COMMA_SEPARATE_3 = LazyPattern(r"([{}])[,]$".format(IsN_RANGES)), r"\1 , "
 
     # Attempt to get correct directional quotes.
     DIRECTIONAL_QUOTE_1 = re.compile(r"^``"), r"`` "
@@ -77,22 +313,22 @@ class MosesTokenizer(object):
     # Replace ... with _ELLIPSIS_
     REPLACE_ELLIPSIS = re.compile(r"\.\.\."), r" _ELLIPSIS_ "
     # Restore _ELLIPSIS_ with ...
-    RESTORE_ELLIPSIS = re.compile(r"_ELLIPSIS_"), r"\.\.\."
+    RESTORE_ELLIPSIS = re.compile(r"_ELLIPSIS_"), r"..."
 
     # Pad , with tailing space except if within numbers, e.g. 5,300
-    COMMA_1 = re.compile(r"([^{numbers}])[,]([^{numbers}])".format(numbers=IsN)), r"\1 , \2"
-    COMMA_2 = re.compile(r"([{numbers}])[,]([^{numbers}])".format(numbers=IsN)), r"\1 , \2"
-    COMMA_3 = re.compile(r"([^{numbers}])[,]([{numbers}])".format(numbers=IsN)), r"\1 , \2"
+    COMMA_1 = LazyPattern(r"([^{numbers}])[,]([^{numbers}])".format(numbers=IsN_RANGES)), r"\1 , \2"
+    COMMA_2 = LazyPattern(r"([{numbers}])[,]([^{numbers}])".format(numbers=IsN_RANGES)), r"\1 , \2"
+    COMMA_3 = LazyPattern(r"([^{numbers}])[,]([{numbers}])".format(numbers=IsN_RANGES)), r"\1 , \2"
 
     # Pad unicode symbols with spaces.
-    SYMBOLS = re.compile(r"([;:@#\$%&{}{}])".format(IsSc, IsSo)), r" \1 "
+    SYMBOLS = LazyPattern(r"([;:@#\$%&{}{}])".format(IsSc_RANGES, IsSo_RANGES)), r" \1 "
 
     # Separate out intra-token slashes.  PTB tokenization doesn't do this, so
     # the tokens should be merged prior to parsing with a PTB-trained parser.
     # e.g. "and/or" -> "and @/@ or"
     INTRATOKEN_SLASHES = (
-        r"([{alphanum}])\/([{alphanum}])".format(alphanum=IsAlnum),
-        r"$1 \@\/\@ $2",
+        LazyPattern(r"([{alphanum}])\/([{alphanum}])".format(alphanum=IsAlnum_RANGES)),
+        r"\1 @/@ \2",
     )
 
     # Splits final period at end of string.
@@ -162,14 +398,14 @@ class MosesTokenizer(object):
     ESCAPE_LEFT_SQUARE_BRACKET = re.compile(r"\["), r"&#91;"
     ESCAPE_RIGHT_SQUARE_BRACKET = re.compile(r"]"), r"&#93;"
 
-    EN_SPECIFIC_1 = re.compile(r"([^{alpha}])[']([^{alpha}])".format(alpha=IsAlpha)), r"\1 ' \2"
+    EN_SPECIFIC_1 = LazyPattern(r"([^{alpha}])[']([^{alpha}])".format(alpha=IsAlpha_RANGES)), r"\1 ' \2"
     EN_SPECIFIC_2 = (
-        re.compile(r"([^{alpha}{isn}])[']([{alpha}])".format(alpha=IsAlpha, isn=IsN)),
+        LazyPattern(r"([^{alpha}{isn}])[']([{alpha}])".format(alpha=IsAlpha_RANGES, isn=IsN_RANGES)),
         r"\1 ' \2",
     )
-    EN_SPECIFIC_3 = re.compile(r"([{alpha}])[']([^{alpha}])".format(alpha=IsAlpha)), r"\1 ' \2"
-    EN_SPECIFIC_4 = re.compile(r"([{alpha}])[']([{alpha}])".format(alpha=IsAlpha)), r"\1 '\2"
-    EN_SPECIFIC_5 = re.compile(r"([{isn}])[']([s])".format(isn=IsN)), r"\1 '\2"
+    EN_SPECIFIC_3 = LazyPattern(r"([{alpha}])[']([^{alpha}])".format(alpha=IsAlpha_RANGES)), r"\1 ' \2"
+    EN_SPECIFIC_4 = LazyPattern(r"([{alpha}])[']([{alpha}])".format(alpha=IsAlpha_RANGES)), r"\1 '\2"
+    EN_SPECIFIC_5 = LazyPattern(r"([{isn}])[']([s])".format(isn=IsN_RANGES)), r"\1 '\2"
 
     ENGLISH_SPECIFIC_APOSTROPHE = [
         EN_SPECIFIC_1,
@@ -179,10 +415,10 @@ class MosesTokenizer(object):
         EN_SPECIFIC_5,
     ]
 
-    FR_IT_SPECIFIC_1 = re.compile(r"([^{alpha}])[']([^{alpha}])".format(alpha=IsAlpha)), r"\1 ' \2"
-    FR_IT_SPECIFIC_2 = re.compile(r"([^{alpha}])[']([{alpha}])".format(alpha=IsAlpha)), r"\1 ' \2"
-    FR_IT_SPECIFIC_3 = re.compile(r"([{alpha}])[']([^{alpha}])".format(alpha=IsAlpha)), r"\1 ' \2"
-    FR_IT_SPECIFIC_4 = re.compile(r"([{alpha}])[']([{alpha}])".format(alpha=IsAlpha)), r"\1' \2"
+    FR_IT_SPECIFIC_1 = LazyPattern(r"([^{alpha}])[']([^{alpha}])".format(alpha=IsAlpha_RANGES)), r"\1 ' \2"
+    FR_IT_SPECIFIC_2 = LazyPattern(r"([^{alpha}])[']([{alpha}])".format(alpha=IsAlpha_RANGES)), r"\1 ' \2"
+    FR_IT_SPECIFIC_3 = LazyPattern(r"([{alpha}])[']([^{alpha}])".format(alpha=IsAlpha_RANGES)), r"\1 ' \2"
+    FR_IT_SPECIFIC_4 = LazyPattern(r"([{alpha}])[']([{alpha}])".format(alpha=IsAlpha_RANGES)), r"\1' \2"
 
     FR_IT_SPECIFIC_APOSTROPHE = [
         FR_IT_SPECIFIC_1,
@@ -278,6 +514,19 @@ class MosesTokenizer(object):
         ESCAPE_RIGHT_SQUARE_BRACKET,
     ]
 
+    # Maps the XML escaped symbols back to the input characters.
+    XML_UNESCAPES = {
+        substitution: literal(regexp.pattern)
+        for regexp, substitution in MOSES_ESCAPE_XML_REGEXES
+    }
+    XML_UNESCAPE = re.compile("|".join(XML_UNESCAPES))
+
+    # The whitespaces between the tokens, and the ASCII junk that the
+    # tokenizer removes, the control characters that are not whitespaces.
+    SKIPPED_CHARS = re.compile(r"\s*")
+    JUNK_CHARS = re.compile(r"[\000-\010\016-\033]+")
+    DOTMULTI = re.compile(r"(?:DOT)+MULTI")
+
     BASIC_PROTECTED_PATTERNS = [
         BASIC_PROTECTED_PATTERN_1,
         BASIC_PROTECTED_PATTERN_2,
@@ -293,123 +542,235 @@ class MosesTokenizer(object):
         # TODO: emojis especially the multi codepoints
     ]
 
-    def __init__(self, lang="en", custom_nonbreaking_prefixes_file=None):
+    # The characters of the whitespace-delimited chunks whose tokenization
+    # depends on the neighbouring chunks: the nonbreaking prefixes and
+    # multidots, the commas and the apostrophes.
+    CONTEXT_CHARS = frozenset(".,'")
+
+    # Lines of these characters, with an optional final period, need none of
+    # the tokenizer regexes, see _tokenize_plain().
+    PLAIN_ASCII_CHARS = frozenset(string.ascii_letters + string.digits + string.whitespace)
+
+    def __init__(
+        self,
+        lang="en",
+        custom_nonbreaking_prefixes_file=None,
+        cache_size=None,
+        word_cache_size=None,
+        concurrent=False,
+    ):
+        """
+        :param lang: The language code, selects the nonbreaking prefixes and
+            the language specific rules.
+        :type lang: str
+        :param custom_nonbreaking_prefixes_file: A file of nonbreaking prefixes
+            to use instead of the language ones.
+        :type custom_nonbreaking_prefixes_file: str
+        :param cache_size: If set, memoize the tokenize() results of up to
+            *cache_size* distinct lines, see sacremoses.util.LRUCache.
+        :type cache_size: int
+        :param word_cache_size: If set, tokenize() memoizes the tokens of up
+            to *word_cache_size* distinct context-free chunks and only runs
+            the regexes over the rest of the sentence, see _tokenize_words().
+        :type word_cache_size: int
+        :param concurrent: Match the rule chains with the ``regex`` module,
+            which releases the GIL, for the threads that share the instance,
+            see sacremoses.program.RegexProgram.
+        :type concurrent: bool
+        """
         # Initialize the object.
         super(MosesTokenizer, self).__init__()
         self.lang = lang
+        self.concurrent = concurrent
+        # The constructor arguments, see __reduce__().
+        self._config = dict(
+            lang=lang,
+            custom_nonbreaking_prefixes_file=custom_nonbreaking_prefixes_file,
+            cache_size=cache_size,
+            word_cache_size=word_cache_size,
+            concurrent=concurrent,
+        )
+        self.cache = LRUCache(cache_size) if cache_size else None
+        self.word_cache = LRUCache(word_cache_size) if word_cache_size else None
+        # No. of lines tokenized by the plain ASCII fast path.
+        self.fast_path_count = 0
+        # The compiled regex programs of each tokenize() configuration.
+        self._plans = {}
 
         # Initialize the language specific nonbreaking prefixes.
-        self.NONBREAKING_PREFIXES = [
-            _nbp.strip() for _nbp in nonbreaking_prefixes.words(lang)
-        ]
+        prefixes = [_nbp.strip() for _nbp in nonbreaking_prefixes.words(lang)]
 
         # Load custom nonbreaking prefixes file.
         if custom_nonbreaking_prefixes_file:
-            self.NONBREAKING_PREFIXES = []
             with open(custom_nonbreaking_prefixes_file, "r") as fin:
-                for line in fin:
-                    line = line.strip()
-                    if line and not line.startswith("#"):
-                        if line not in self.NONBREAKING_PREFIXES:
-                            self.NONBREAKING_PREFIXES.append(line)
-
-        self.NUMERIC_ONLY_PREFIXES = [
-            w.rpartition(" ")[0]
-            for w in self.NONBREAKING_PREFIXES
-            if self.has_numeric_only(w)
-        ]
+                lines = (line.strip() for line in fin)
+                # De-duplicated in file order.
+                prefixes = list(
+                    dict.fromkeys(
+                        line for line in lines if line and not line.startswith("#")
+                    )
+                )
+
         # Add CJK characters to alpha and alnum.
+        cjk_categories = ()
         if self.lang in ["zh", "ja", "ko", "cjk"]:
-            cjk_chars = ""
             if self.lang in ["ko", "cjk"]:
-                cjk_chars += str("".join(perluniprops.chars("Hangul")))
+                cjk_categories += ("Hangul",)
             if self.lang in ["zh", "cjk"]:
-                cjk_chars += str("".join(perluniprops.chars("Han")))
+                cjk_categories += ("Han",)
             if self.lang in ["ja", "cjk"]:
-                cjk_chars += str("".join(perluniprops.chars("Hiragana")))
-                cjk_chars += str("".join(perluniprops.chars("Katakana")))
-                cjk_chars += str("".join(perluniprops.chars("Han")))
+                cjk_categories += ("Hiragana", "Katakana", "Han")
+            cjk_chars = charclasses.string(*cjk_categories)
             self.IsAlpha += cjk_chars
             self.IsAlnum += cjk_chars
+            extra = "".join(VIRAMAS) + "".join(NUKTAS)
+            self.IsAlpha_RANGES = charclasses.ranges("IsAlpha", *cjk_categories, extra=extra)
+            self.IsAlnum_RANGES = charclasses.ranges("IsAlnum", *cjk_categories, extra=extra)
             # Overwrite the alnum regexes.
-            self.PAD_NOT_ISALNUM = re.compile(r"([^{}\s\.'\`\,\-])".format(self.IsAlnum)), r" \1 "
+            self.PAD_NOT_ISALNUM = LazyPattern(r"([^{}\s\.'\`\,\-])".format(self.IsAlnum_RANGES)), r" \1 "
             self.AGGRESSIVE_HYPHEN_SPLIT = (
-                re.compile(r"([{alphanum}])\-(?=[{alphanum}])".format(alphanum=self.IsAlnum)),
+                LazyPattern(r"([{alphanum}])\-(?=[{alphanum}])".format(alphanum=self.IsAlnum_RANGES)),
                 r"\1 @-@ ",
             )
             self.INTRATOKEN_SLASHES = (
-                re.compile(r"([{alphanum}])\/([{alphanum}])".format(alphanum=self.IsAlnum)),
-                r"$1 \@\/\@ $2",
+                LazyPattern(r"([{alphanum}])\/([{alphanum}])".format(alphanum=self.IsAlnum_RANGES)),
+                r"\1 @/@ \2",
             )
+        # Prebuilt character sets for islower() and isanyalpha().
+        self.LOWER_CHARS = charclasses.charset("IsLower")
+        self.ALPHA_CHARS = charclasses.charset(
+            "IsAlpha", *cjk_categories, extra="".join(VIRAMAS) + "".join(NUKTAS)
+        )
+        self.prefix_resolver = NonbreakingPrefixResolver(
+            prefixes, self.ALPHA_CHARS, self.LOWER_CHARS
+        )
+        self.NONBREAKING_PREFIXES = self.prefix_resolver.prefixes
+        self.NUMERIC_ONLY_PREFIXES = self.prefix_resolver.numeric_only
+
+    def __reduce__(self):
+        # Pickles the configuration, not the prefixes and character sets, the
+        # copy is rebuilt from the data files, with empty caches.
+        return rebuild, (self.__class__, self._config)
+
+    @classmethod
+    def shared_key(cls, arguments):
+        # An edited custom nonbreaking prefixes file is a new configuration.
+        key = super(MosesTokenizer, cls).shared_key(arguments)
+        filename = arguments["custom_nonbreaking_prefixes_file"]
+        if filename:
+            stat = os.stat(filename)
+            key += ((stat.st_size, stat.st_mtime_ns),)
+        return key
+
+    def execution_plan(self, aggressive_dash_splits=False, escape=True, block=False):
+        """
+        Returns the regex chains of tokenize() for the given configuration,
+        compiled into RegexProgram objects (see sacremoses.program), that
+        produce the same output as applying the rules one by one.
 
-    def replace_multidots(self, text):
-        text = re.sub(r"\.([\.]+)", r" DOTMULTI\1", text)
-        dotmulti = re.compile(r"DOTMULTI\.")
-        while dotmulti.search(text):
-            text = re.sub(r"DOTMULTI\.([^\.])", r"DOTDOTMULTI \1", text)
-            text = dotmulti.sub("DOTDOTMULTI", text)
-        return text
+        :param block: Compile the programs to apply on newline-joined lines.
+        :type block: bool
+        :rtype: dict(str, RegexProgram)
+        """
+        key = (aggressive_dash_splits, escape, block)
+        if key not in self._plans:
+            # Separate special characters outside of IsAlnum character set
+            # and aggressively splits dashes.
+            pad = [self.PAD_NOT_ISALNUM]
+            if aggressive_dash_splits:
+                pad.append(self.AGGRESSIVE_HYPHEN_SPLIT)
+            # Separate out "," except if within numbers e.g. 5,300
+            split = [self.COMMA_SEPARATE_1, self.COMMA_SEPARATE_2, self.COMMA_SEPARATE_3]
+            # (Language-specific) apostrophe tokenization.
+            if self.lang == "en":
+                split += self.ENGLISH_SPECIFIC_APOSTROPHE
+            elif self.lang in ["fr", "it"]:
+                split += self.FR_IT_SPECIFIC_APOSTROPHE
+            # FIXME!!!
+            ##elif self.lang == "so":
+            ##    split += self.SO_SPECIFIC_APOSTROPHE
+            else:
+                split.append(self.NON_SPECIFIC_APOSTROPHE)
+            compile_program = partial(RegexProgram.compile, concurrent=self.concurrent)
+            self._plans[key] = {
+                # De-duplicate spaces and clean ASCII junk, always per line.
+                "clean": compile_program([self.DEDUPLICATE_SPACE, self.ASCII_JUNK]),
+                "pad": compile_program(pad, block),
+                "split": compile_program(split, block),
+                "trailing": compile_program([self.TRAILING_DOT_APOSTROPHE], block),
+                "escape": compile_program(self.MOSES_ESCAPE_XML_REGEXES, block)
+                if escape
+                else None,
+            }
+        return self._plans[key]
+
+    def replace_multidots(self, text, block=False):
+        """
+        Replaces the multidots with "DOTDOTMULTI" literal strings.
+
+        The Moses loop of substitutions turns a "DOTMULTI" followed by *k*
+        periods into k "DOT"s before the "DOTMULTI" and a space before the
+        next character, one period per pass over the text. The result of the
+        loop is computed here in a single pass instead, as the loop is
+        quadratic on long runs of periods.
+        """
+        regexp, substitution = self.REPLACE_DOT_WITH_LITERALSTRING_1
+        if block:
+            regexp = linewise(regexp)
+        text = regexp.sub(substitution, text)
+        pieces, last, consumed = [], 0, -1
+        for match in self.DOTMULTI_PERIODS.finditer(text):
+            start, end = match.span()
+            periods = end - start - len("DOTMULTI")
+            # The space is inserted by REPLACE_DOT_WITH_LITERALSTRING_2 in the
+            # last pass, but not after the end of the line nor on the first
+            # pass after another single period "DOTMULTI" that the regex
+            # matched up to the "D".
+            space = end < len(text) and not (block and text[end] == "\n")
+            if periods == 1 and start == consumed:
+                space = False
+            consumed = end if periods == 1 and space else -1
+            pieces.append(text[last:start])
+            pieces.append("DOT" * periods + "DOTMULTI" + (" " if space else ""))
+            last = end
+        pieces.append(text[last:])
+        return "".join(pieces)
 
     def restore_multidots(self, text):
-        dotmulti = re.compile(r"DOTDOTMULTI")
-        while dotmulti.search(text):
-            text = dotmulti.sub(r"DOTMULTI.", text)
-        return re.sub(r"DOTMULTI", r".", text)
+        """
+        Restores every "DOT" of the "DOTDOTMULTI" literal strings to a period,
+        in a single pass over the text.
+        """
+        pieces, last = [], 0
+        end = text.find("DOTMULTI")
+        while end != -1:
+            start = end
+            while start - 3 >= last and text.startswith("DOT", start - 3):
+                start -= 3
+            pieces.append(text[last:start])
+            pieces.append("." * ((end - start) // 3 + 1))
+            last = end + len("DOTMULTI")
+            end = text.find("DOTMULTI", last)
+        pieces.append(text[last:])
+        return "".join(pieces)
 
     def islower(self, text):
-        return not set(text).difference(set(self.IsLower))
+        return self.LOWER_CHARS.issuperset(text)
 
     def isanyalpha(self, text):
-        return any(set(text).intersection(set(self.IsAlpha)))
+        return not self.ALPHA_CHARS.isdisjoint(text)
 
     def has_numeric_only(self, text):
         return bool(re.search(r"[\s]+(\#NUMERIC_ONLY\#)", text))
 
     def handles_nonbreaking_prefixes(self, text):
-        # Splits the text into tokens to check for nonbreaking prefixes.
-        tokens = text.split()
-        num_tokens = len(tokens)
-        for i, token in enumerate(tokens):
-            # Checks if token ends with a fullstop.
-            token_ends_with_period = re.search(r"^(\S+)\.$", token)
-            if token_ends_with_period:
-                prefix = token_ends_with_period.group(1)
-                # Checks for 3 conditions if
-                # i.   the prefix contains a fullstop and
-                #      any char in the prefix is within the IsAlpha charset
-                # ii.  the prefix is in the list of nonbreaking prefixes and
-                #      does not contain #NUMERIC_ONLY#
-                # iii. the token is not the last token and that the
-                #      next token contains all lowercase.
-                if (
-                    ("." in prefix and self.isanyalpha(prefix))
-                    or (
-                        prefix in self.NONBREAKING_PREFIXES
-                        and prefix not in self.NUMERIC_ONLY_PREFIXES
-                    )
-                    or (
-                        i != num_tokens - 1
-                        and tokens[i + 1]
-                        and self.islower(tokens[i + 1][0])
-                    )
-                ):
-                    pass  # No change to the token.
-                # Checks if the prefix is in NUMERIC_ONLY_PREFIXES
-                # and ensures that the next word is a digit.
-                elif (
-                    prefix in self.NUMERIC_ONLY_PREFIXES
-                    and (i + 1) < num_tokens
-                    and re.search(r"^[0-9]+", tokens[i + 1])
-                ):
-                    pass  # No change to the token.
-                else:  # Otherwise, adds a space after the tokens before a dot.
-                    tokens[i] = prefix + " ."
-        return " ".join(tokens)  # Stitch the tokens back.
+        return self.prefix_resolver(text)
 
     def escape_xml(self, text):
-        for regexp, substitution in self.MOSES_ESCAPE_XML_REGEXES:
-            text = regexp.sub(substitution, text)
-        return text
+        program = RegexProgram.compile(
+            self.MOSES_ESCAPE_XML_REGEXES, concurrent=self.concurrent
+        )
+        return program(text)
 
     def penn_tokenize(self, text, return_str=False):
         """
@@ -419,13 +780,12 @@ class MosesTokenizer(object):
         # Converts input string into unicode.
         text = str(text)
         # Perform a chain of regex substituitions using MOSES_PENN_REGEXES_1
-        for regexp, substitution in self.MOSES_PENN_REGEXES_1:
-            text = regexp.sub(substitution, text)
+        compile_program = partial(RegexProgram.compile, concurrent=self.concurrent)
+        text = compile_program(self.MOSES_PENN_REGEXES_1)(text)
         # Handles nonbreaking prefixes.
         text = self.handles_nonbreaking_prefixes(text)
         # Restore ellipsis, clean extra spaces, escape XML symbols.
-        for regexp, substitution in self.MOSES_PENN_REGEXES_2:
-            text = regexp.sub(substitution, text)
+        text = compile_program(self.MOSES_PENN_REGEXES_2)(text)
         return text if return_str else text.split()
 
     def tokenize(
@@ -435,6 +795,7 @@ class MosesTokenizer(object):
         return_str=False,
         escape=True,
         protected_patterns=None,
+        return_spans=False,
     ):
         """
         Python port of the Moses tokenizer.
@@ -443,27 +804,268 @@ class MosesTokenizer(object):
             :type tokens: str
             :param aggressive_dash_splits: Option to trigger dash split rules .
             :type aggressive_dash_splits: bool
+            :param return_spans: Return the character offsets of the tokens in
+                the input text instead of the tokens, see TokenSpan. The
+                tokens are aligned to the input after they are tokenized, see
+                token_spans(), which adds about half of the tokenization time.
+            :type return_spans: bool
+        """
+        if return_spans:
+            if return_str:
+                raise ValueError("return_str and return_spans are exclusive")
+            tokens = self.tokenize(
+                text, aggressive_dash_splits, False, escape, protected_patterns
+            )
+            return self.token_spans(text, tokens, escape)
+        if not protected_patterns:
+            tokenized = self._tokenize_plain(text)
+            if tokenized is not None:
+                return tokenized if return_str else tokenized.split()
+        else:
+            protected_patterns = ProtectedPatternSet.compile(protected_patterns)
+        # Protected patterns may span several chunks, tokenize such sentences
+        # as a whole.
+        if self.word_cache is None or protected_patterns:
+            tokenize = self._tokenize
+        else:
+            tokenize = self._tokenize_words
+        if self.cache is None:
+            text = tokenize(text, aggressive_dash_splits, escape, protected_patterns)
+        else:
+            key = (text, aggressive_dash_splits, escape, protected_patterns)
+            tokenized = self.cache.get(key)
+            if tokenized is None:
+                tokenized = tokenize(text, aggressive_dash_splits, escape, protected_patterns)
+                self.cache.put(key, tokenized)
+            text = tokenized
+        return text if return_str else text.split()
+
+    def token_spans(self, text, tokens, escape=True):
         """
+        Returns the TokenSpan of every token of *tokens* in *text* it is
+        tokenized from. The tokens are aligned in a single left to right scan
+        as they keep the order and, but for the XML escapes and the "@-@" of
+        the dash splits, the characters of the input less the whitespaces and
+        the ASCII junk.
+
+            >>> moses = MosesTokenizer()
+            >>> text = "A sugar-free R&D lab."
+            >>> tokens = moses.tokenize(text, aggressive_dash_splits=True)
+            >>> for span, token in zip(moses.token_spans(text, tokens), tokens):
+            ...     print(span, token)
+            TokenSpan(start=0, end=1, synthesized=False) A
+            TokenSpan(start=2, end=7, synthesized=False) sugar
+            TokenSpan(start=7, end=8, synthesized=True) @-@
+            TokenSpan(start=8, end=12, synthesized=False) free
+            TokenSpan(start=13, end=14, synthesized=False) R
+            TokenSpan(start=14, end=15, synthesized=True) &amp;
+            TokenSpan(start=15, end=16, synthesized=False) D
+            TokenSpan(start=17, end=20, synthesized=False) lab
+            TokenSpan(start=20, end=21, synthesized=False) .
+
+        A token that is not in the input, e.g. when the input contains the
+        "THISISPROTECTED" placeholders of the protected patterns, is
+        synthesized and spans the input between its neighbours, as do the
+        consecutive ones, and the next tokens are aligned from the first one
+        that is found again.
+
+        :param tokens: The output of tokenize() on *text*.
+        :type tokens: list(str)
+        :param escape: Whether the tokens are XML escaped.
+        :type escape: bool
+        :rtype: list(TokenSpan)
+        """
+        text = str(text)
+        # The tokens are aligned to the input less the ASCII junk, which may
+        # be in the middle of a token, and the offsets are mapped back below.
+        clean = self.JUNK_CHARS.sub("", text) if self.JUNK_CHARS.search(text) else text
+        find, skip, new = clean.find, self.SKIPPED_CHARS.match, tuple.__new__
+        spans, lost, start = [], [], 0
+        for token in tokens:
+            source = token
+            if escape and "&" in token:
+                source = self.XML_UNESCAPE.sub(
+                    lambda match: self.XML_UNESCAPES[match.group()], token
+                )
+            if not lost:
+                # A token is usually right after a few spaces. The search is
+                # bounded so that the tokens that are not found, e.g. "@-@",
+                # don't cost a scan of the rest of the text.
+                size = len(source)
+                position = find(source, start, start + size + 8)
+                if position == start or (
+                    position != -1 and clean[start:position].isspace()
+                ):
+                    end = position + size
+                    # Only the XML escaped tokens differ from the input.
+                    spans.append(new(TokenSpan, (position, end, source is not token)))
+                    start = end
+                    continue
+                position = skip(clean, start).end()
+                end = self._align_token(clean, source, position)
+            else:
+                # Resynchronizes on the first token that is found again.
+                position = find(source, start)
+                end = None if position == -1 else position + len(source)
+                if end is not None:
+                    self._fill_lost(clean, spans, lost, start, position)
+            if end is None:
+                lost.append(len(spans))
+                spans.append(None)
+                continue
+            spans.append(new(TokenSpan, (position, end, clean[position:end] != token)))
+            start = end
+        if lost:
+            self._fill_lost(clean, spans, lost, start, len(clean))
+        if clean is not text:
+            junk = self.JUNK_CHARS.match
+            offsets = [i for i, char in enumerate(text) if not junk(char)]
+            offsets.append(len(text))
+            for i, (token, (start, end, _)) in enumerate(zip(tokens, spans)):
+                end = offsets[end - 1] + 1 if end > start else offsets[start]
+                start = offsets[start]
+                spans[i] = TokenSpan(start, end, text[start:end] != token)
+        return spans
+
+    def _fill_lost(self, text, spans, lost, start, end):
+        """
+        Gives the tokens at the indices *lost* of *spans*, that are not found
+        in the input, the span of the text between *start* and *end* less the
+        surrounding whitespaces.
+        """
+        start = self.SKIPPED_CHARS.match(text, start, end).end()
+        end = start + len(text[start:end].rstrip())
+        for index in lost:
+            spans[index] = TokenSpan(start, end, True)
+        del lost[:]
+
+    def _align_token(self, text, source, start):
+        """
+        Matches a token with the "DOTMULTI" literal strings restored to
+        periods, or the "@-@" of a dash split, at the offset *start* and
+        returns the offset of its end, or None if it doesn't match.
+        """
+        if text.startswith(source, start):
+            return start + len(source)
+        if source == "@-@" and text.startswith("-", start):
+            return start + 1
+        i, end = 0, start
+        while i < len(source):
+            char = source[i]
+            dotmulti = self.DOTMULTI.match(text, end) if char == "." else None
+            if dotmulti and source.startswith("." * (len(dotmulti.group()) // 3 - 1), i):
+                # (DOT)+MULTI is restored to one period per "DOT".
+                i += len(dotmulti.group()) // 3 - 1
+                end = dotmulti.end()
+            elif text.startswith(char, end):
+                i += 1
+                end += 1
+            else:
+                return None
+        return end
+
+    def _tokenize_plain(self, text):
+        """
+        Tokenizes the lines made of ASCII letters, digits and whitespaces with
+        an optional final period without any regex, the output is identical
+        to _tokenize(). Returns None for the other lines.
+
+            >>> moses = MosesTokenizer()
+            >>> moses._tokenize_plain("I saw  2 cats at 10am.")
+            'I saw 2 cats at 10am .'
+            >>> moses._tokenize_plain("I saw Mr.")
+            'I saw Mr.'
+            >>> moses._tokenize_plain("I saw 2 cats, 1 dog.") is None
+            True
+        """
+        text = str(text)
+        body = text.rstrip()
+        if body.endswith("."):
+            body = body[:-1]
+        # The multidots are restored from the "DOTMULTI" literal strings.
+        if not self.PLAIN_ASCII_CHARS.issuperset(body) or "DOTMULTI" in body:
+            return None
+        self.fast_path_count += 1
+        tokens = text.split()
+        if tokens and len(tokens[-1]) > 1 and tokens[-1].endswith("."):
+            # Only nonbreaking prefixes keep the final period, the numeric
+            # only ones need a following number.
+            prefix = tokens[-1][:-1]
+            if not self.prefix_resolver.is_nonbreaking(prefix):
+                tokens[-1:] = [prefix, "."]
+        return " ".join(tokens)
+
+    def _tokenize_words(self, text, aggressive_dash_splits, escape, protected_patterns=None):
+        """
+        Tokenizes the text chunk by chunk, the output is identical to
+        _tokenize(). The whitespace-delimited chunks without any of the
+        CONTEXT_CHARS tokenize the same regardless of their neighbours, a run
+        of the other chunks only depends on whether it starts the sentence
+        and on the first character of the next chunk: the rules that look
+        across a space see nothing beyond it and the nonbreaking prefixes only
+        check if the next token is lowercased or numeric. The tokenized
+        chunks and runs are memoized in the word cache with that context.
+        """
+        chunks = self.execution_plan(aggressive_dash_splits, escape)["clean"](
+            str(text)
+        ).split()
+        context_free, cache = self.CONTEXT_CHARS.isdisjoint, self.word_cache
+        pieces, i, n = [], 0, len(chunks)
+        while i < n:
+            if context_free(chunks[i]):
+                key = (chunks[i], aggressive_dash_splits, escape)
+                i += 1
+            else:
+                j = i + 1
+                while j < n and not context_free(chunks[j]):
+                    j += 1
+                # The next chunk is represented by a word of the same class.
+                if j == n:
+                    following = None
+                elif self.islower(chunks[j][0]):
+                    following = "a"
+                elif chunks[j][0] in "0123456789":
+                    following = "0"
+                else:
+                    following = "A"
+                key = (" ".join(chunks[i:j]), aggressive_dash_splits, escape, i > 0, following)
+                i = j
+            piece = cache.get(key)
+            if piece is None:
+                piece = self._tokenize_chunk(*key)
+                cache.put(key, piece)
+            pieces.append(piece)
+        return " ".join(pieces)
+
+    def _tokenize_chunk(
+        self, chunk, aggressive_dash_splits, escape, preceded=False, following=None
+    ):
+        """
+        Tokenizes a chunk as if it is preceded by a word and followed by the
+        *following* word, see _tokenize_words().
+        """
+        if preceded:
+            chunk = "a " + chunk
+        if following:
+            chunk = chunk + " " + following
+        text = self._tokenize(chunk, aggressive_dash_splits, escape, None)
+        # The trailing ".'" split may leave extra spaces at the end of the
+        # sentence, so the context words are cut off the string.
+        if preceded:
+            text = text.split(" ", 1)[1]
+        if following:
+            text = text.rsplit(" ", 1)[0]
+        return text
+
+    def _tokenize(self, text, aggressive_dash_splits, escape, protected_patterns):
+        plan = self.execution_plan(aggressive_dash_splits, escape)
         # Converts input string into unicode.
         text = str(text)
         # De-duplicate spaces and clean ASCII junk
-        for regexp, substitution in [self.DEDUPLICATE_SPACE, self.ASCII_JUNK]:
-            text = regexp.sub(substitution, text)
+        text = plan["clean"](text)
 
         if protected_patterns:
-            protected_patterns = [re.compile(p, re.IGNORECASE) for p in protected_patterns]
-            # Find the tokens that needs to be protected.
-            protected_tokens = [
-                match.group()
-                for protected_pattern in protected_patterns
-                for match in protected_pattern.finditer(text)
-            ]
-            assert len(protected_tokens) <= 1000 # so we don't run out of the zfill(3) space.
-
-            # Apply the protected_patterns, longest match first.
-            for i, token in sorted(enumerate(protected_tokens), key=lambda pair:len(pair[1]), reverse=True):
-                substituition = "THISISPROTECTED" + str(i).zfill(3)
-                text = text.replace(token, substituition)
+            text, protected_tokens = protected_patterns.mask(text)
 
         # Strips heading and trailing spaces.
         text = text.strip()
@@ -482,39 +1084,16 @@ class MosesTokenizer(object):
             text = regexp.sub(substitution, text)
         else:
         """
-        # Separate special characters outside of IsAlnum character set.
-        regexp, substitution = self.PAD_NOT_ISALNUM
-        text = regexp.sub(substitution, text)
-        # Aggressively splits dashes
-        if aggressive_dash_splits:
-            regexp, substitution = self.AGGRESSIVE_HYPHEN_SPLIT
-            text = regexp.sub(substitution, text)
+        # Separate special characters outside of IsAlnum character set and
+        # aggressively splits dashes.
+        text = plan["pad"](text)
 
         # Replaces multidots with "DOTDOTMULTI" literal strings.
         text = self.replace_multidots(text)
 
-        # Separate out "," except if within numbers e.g. 5,300
-        for regexp, substitution in [
-            self.COMMA_SEPARATE_1,
-            self.COMMA_SEPARATE_2,
-            self.COMMA_SEPARATE_3,
-        ]:
-            text = regexp.sub(substitution, text)
-
-        # (Language-specific) apostrophe tokenization.
-        if self.lang == "en":
-            for regexp, substitution in self.ENGLISH_SPECIFIC_APOSTROPHE:
-                text = regexp.sub(substitution, text)
-        elif self.lang in ["fr", "it"]:
-            for regexp, substitution in self.FR_IT_SPECIFIC_APOSTROPHE:
-                text = regexp.sub(substitution, text)
-        # FIXME!!!
-        ##elif self.lang == "so":
-        ##    for regexp, substitution in self.SO_SPECIFIC_APOSTROPHE:
-        ##        text = re.sub(regexp, substitution, text)
-        else:
-            regexp, substitution = self.NON_SPECIFIC_APOSTROPHE
-            text = regexp.sub(substitution, text)
+        # Separate out "," except if within numbers e.g. 5,300 and
+        # (language-specific) apostrophe tokenization.
+        text = plan["split"](text)
 
         # Handles nonbreaking prefixes.
         text = self.handles_nonbreaking_prefixes(text)
@@ -522,35 +1101,182 @@ class MosesTokenizer(object):
         regexp, substitution = self.DEDUPLICATE_SPACE
         text = regexp.sub(substitution, text).strip()
         # Split trailing ".'".
-        regexp, substituition = self.TRAILING_DOT_APOSTROPHE
-        text = regexp.sub(substituition, text)
+        text = plan["trailing"](text)
 
         # Restore the protected tokens.
         if protected_patterns:
-            for i, token in enumerate(protected_tokens):
-                substituition = "THISISPROTECTED" + str(i).zfill(3)
-                text = text.replace(substituition, token)
+            text = protected_patterns.restore(text, protected_tokens)
 
         # Restore multidots.
         text = self.restore_multidots(text)
         if escape:
             # Escape XML symbols.
-            text = self.escape_xml(text)
+            text = plan["escape"](text)
+        return text
 
-        return text if return_str else text.split()
+    def penn_tokenize_batch(self, lines, return_str=False, batch_size=1000, processes=1):
+        """
+        Penn treebank tokenizes many lines at once, the output is identical to
+        calling penn_tokenize() on every line. See tokenize_batch().
+        """
+        if processes > 1:
+            penn_tokenize_batch = partial(
+                self.penn_tokenize_batch, return_str=return_str, batch_size=batch_size
+            )
+            executor = ChunkedExecutor(
+                penn_tokenize_batch, processes, chunksize=batch_size, batched=True
+            )
+            return list(executor.map(lines))
+        compile_program = partial(RegexProgram.compile, concurrent=self.concurrent)
+        clean = compile_program([self.DEDUPLICATE_SPACE, self.ASCII_JUNK])
+        # The whitespace regexes would join the lines, apply them per line.
+        penn_1 = compile_program(
+            [rule for rule in self.MOSES_PENN_REGEXES_1 if rule not in (self.DEDUPLICATE_SPACE, self.ASCII_JUNK)],
+            block=True,
+        )
+        penn_2 = compile_program(self.MOSES_PENN_REGEXES_2, block=True)
+        results = []
+        for chunk in chunked(lines, batch_size):
+            text = penn_1("\n".join(clean(str(text)) for text in chunk))
+            # Handles nonbreaking prefixes.
+            text = "\n".join(
+                self.handles_nonbreaking_prefixes(line) for line in text.split("\n")
+            )
+            # Restore ellipsis, clean extra spaces, escape XML symbols.
+            text = penn_2(text)
+            results.extend(text.split("\n"))
+        return results if return_str else [text.split() for text in results]
+
+    def tokenize_batch(
+        self,
+        lines,
+        aggressive_dash_splits=False,
+        return_str=False,
+        escape=True,
+        protected_patterns=None,
+        batch_size=1000,
+        processes=1,
+    ):
+        """
+        Tokenizes many lines at once, the output is identical to calling
+        tokenize() on every line. The lines are joined into blocks of
+        *batch_size* lines and every regex substitution is applied once per
+        block instead of once per line, saving the per-call overhead on
+        short sentences.
+
+            :param lines: An iterable of strings, i.e. sentence texts.
+            :type lines: iter(str)
+            :param batch_size: No. of lines joined into a single block.
+            :type batch_size: int
+            :param processes: No. of processes, the blocks are tokenized by a
+                sacremoses.util.ChunkedExecutor if it is more than one.
+            :type processes: int
+            :return: list(str) if *return_str* else list(list(str))
+        """
+        if processes > 1:
+            tokenize_batch = partial(
+                self.tokenize_batch,
+                aggressive_dash_splits=aggressive_dash_splits,
+                return_str=return_str,
+                escape=escape,
+                protected_patterns=protected_patterns,
+                batch_size=batch_size,
+            )
+            executor = ChunkedExecutor(
+                tokenize_batch, processes, chunksize=batch_size, batched=True
+            )
+            return list(executor.map(lines))
+        if protected_patterns:
+            protected_patterns = ProtectedPatternSet.compile(protected_patterns)
+        plan = self.execution_plan(aggressive_dash_splits, escape, block=True)
+        results = []
+        for chunk in chunked(lines, batch_size):
+            if self.cache is None:
+                results.extend(self._tokenize_block(chunk, plan, protected_patterns))
+                continue
+            # Only tokenize the lines that are not in the cache.
+            keys = [
+                (text, aggressive_dash_splits, escape, protected_patterns)
+                for text in chunk
+            ]
+            tokenized = [self.cache.get(key) for key in keys]
+            missed = [i for i, text in enumerate(tokenized) if text is None]
+            block = self._tokenize_block([chunk[i] for i in missed], plan, protected_patterns)
+            for i, text in zip(missed, block):
+                tokenized[i] = text
+                self.cache.put(keys[i], text)
+            results.extend(tokenized)
+        return results if return_str else [text.split() for text in results]
+
+    def _tokenize_block(self, lines, plan, protected_patterns):
+        """
+        Tokenizes a list of lines as a single newline-joined block with the
+        programs from execution_plan(block=True), see tokenize_batch().
+        """
+        if not lines:
+            return []
+        texts, protected_tokens = [], []
+        for text in lines:
+            # De-duplicate spaces and clean ASCII junk, this also removes
+            # any newline from the line.
+            text = plan["clean"](str(text))
+            if protected_patterns:
+                text, tokens = protected_patterns.mask(text)
+                protected_tokens.append(tokens)
+            texts.append(text.strip())
+
+        # Separate special characters outside of IsAlnum character set and
+        # aggressively splits dashes.
+        text = plan["pad"]("\n".join(texts))
+        # Replaces multidots with "DOTDOTMULTI" literal strings.
+        text = self.replace_multidots(text, block=True)
+        # Separate out "," except if within numbers and (language-specific)
+        # apostrophe tokenization.
+        text = plan["split"](text)
 
+        # Handles nonbreaking prefixes and cleans up extraneous spaces.
+        regexp, substitution = self.DEDUPLICATE_SPACE
+        texts = [
+            regexp.sub(substitution, self.handles_nonbreaking_prefixes(line)).strip()
+            for line in text.split("\n")
+        ]
+        # Split trailing ".'".
+        text = plan["trailing"]("\n".join(texts))
 
-class MosesDetokenizer(object):
+        # Restore the protected tokens.
+        if protected_patterns:
+            text = "\n".join(
+                protected_patterns.restore(line, tokens)
+                for line, tokens in zip(text.split("\n"), protected_tokens)
+            )
+
+        # Restore multidots.
+        text = self.restore_multidots(text)
+        if plan["escape"]:
+            # Escape XML symbols.
+            text = plan["escape"](text)
+        return text.split("\n")
+
+
+class MosesDetokenizer(SharedInstances):
     """
     This is a Python port of the Moses Detokenizer from
     https://github.com/moses-smt/mosesdecoder/blob/master/scripts/tokenizer/detokenizer.perl
 
+    Thread safety: as for MosesTokenizer, detokenize() can be called
+    concurrently on a shared instance.
     """
 
     # Currency Symbols.
-    IsAlnum = str("".join(perluniprops.chars("IsAlnum")))
-    IsAlpha = str("".join(perluniprops.chars("IsAlpha")))
-    IsSc = str("".join(perluniprops.chars("IsSc")))
+    IsAlnum = charclasses.string("IsAlnum")
+    IsAlpha = charclasses.string("IsAlpha")
+    IsSc = charclasses.string("IsSc")
+
+    # The same character sets as the codepoint ranges of regex character
+    # classes, used to build the regexes below.
+    IsAlnum_RANGES = charclasses.ranges("IsAlnum")
+    IsAlpha_RANGES = charclasses.ranges("IsAlpha")
+    IsSc_RANGES = charclasses.ranges("IsSc")
 
     AGGRESSIVE_HYPHEN_SPLIT = re.compile(r" \@\-\@ "), r"-"
 
@@ -656,27 +1382,41 @@ class MosesDetokenizer(object):
         "kin",
     ]
 
-    FINNISH_REGEX = re.compile(r"^({})({})?({})$".format(
+    FINNISH_REGEX = LazyPattern(r"^({})({})?({})$".format(
         "|".join(FINNISH_MORPHSET_1),
         "|".join(FINNISH_MORPHSET_2),
         "|".join(FINNISH_MORPHSET_3),
     ))
 
-    IS_CURRENCY_SYMBOL = re.compile(r"^[{}\(\[\{{\¿\¡]+$".format(IsSc))
+    IS_CURRENCY_SYMBOL = LazyPattern(r"^[{}\(\[\{{\¿\¡]+$".format(IsSc_RANGES))
 
-    IS_ENGLISH_CONTRACTION = re.compile(r"^['][{}]".format(IsAlpha))
+    IS_ENGLISH_CONTRACTION = LazyPattern(r"^['][{}]".format(IsAlpha_RANGES))
 
-    IS_FRENCH_CONRTACTION = re.compile(r"[{}][']$".format(IsAlpha))
+    IS_FRENCH_CONRTACTION = LazyPattern(r"[{}][']$".format(IsAlpha_RANGES))
 
-    STARTS_WITH_ALPHA = re.compile(r"^[{}]".format(IsAlpha))
+    STARTS_WITH_ALPHA = LazyPattern(r"^[{}]".format(IsAlpha_RANGES))
 
     IS_PUNCT = re.compile(r"^[\,\.\?\!\:\;\\\%\}\]\)]+$")
 
     IS_OPEN_QUOTE = re.compile(r"""^[\'\"„“`]+$""")
 
+    # Prebuilt character sets for the token checks of tokenize(), these
+    # replace the IsSc and IsAlpha regexes above.
+    CURRENCY_CHARS = charclasses.charset("IsSc", extra="([{¿¡")
+    ALPHA_CHARS = charclasses.charset("IsAlpha")
+
+    # Tokens of these characters are detokenized by left-shifting the periods,
+    # see _detokenize_plain().
+    PLAIN_ASCII_CHARS = frozenset(string.ascii_letters + string.digits + string.whitespace + ".")
+
     def __init__(self, lang="en"):
         super(MosesDetokenizer, self).__init__()
         self.lang = lang
+        # No. of lines detokenized by the plain ASCII fast path.
+        self.fast_path_count = 0
+
+    def __reduce__(self):
+        return rebuild, (self.__class__, {"lang": self.lang})
 
     def unescape_xml(self, text):
         for regexp, substitution in self.MOSES_UNESCAPE_XML_REGEXES:
@@ -690,6 +1430,9 @@ class MosesDetokenizer(object):
         :type tokens: list(str)
         :return: str
         """
+        detokenized_text = self._detokenize_plain(tokens)
+        if detokenized_text is not None:
+            return detokenized_text if return_str else detokenized_text.split()
         # Convert the list of tokens into a string and pad it with spaces.
         text = r" {} ".format(" ".join(tokens))
         # Converts input string into unicode.
@@ -722,7 +1465,7 @@ class MosesDetokenizer(object):
                     detokenized_text += prepend_space + token
                 prepend_space = " "
             # If it's a currency symbol.
-            elif self.IS_CURRENCY_SYMBOL.search(token):
+            elif self.CURRENCY_CHARS.issuperset(token):
                 # Perform right shift on currency and other random punctuation items
                 detokenized_text += prepend_space + token
                 prepend_space = ""
@@ -738,7 +1481,8 @@ class MosesDetokenizer(object):
             elif (
                 self.lang == "en"
                 and i > 0
-                and self.IS_ENGLISH_CONTRACTION.search(token)
+                and token[0] == "'"
+                and token[1:2] in self.ALPHA_CHARS
             ):
                 # and re.search('[{}]$'.format(self.IsAlnum), tokens[i-1])):
                 # For English, left-shift the contraction.
@@ -761,8 +1505,9 @@ class MosesDetokenizer(object):
             elif (
                 self.lang in ["fr", "it", "ga"]
                 and i <= len(tokens) - 2
-                and self.IS_FRENCH_CONRTACTION.search(token)
-                and self.STARTS_WITH_ALPHA.search(tokens[i + 1])
+                and token[-1] == "'"
+                and token[-2:-1] in self.ALPHA_CHARS
+                and tokens[i + 1][0] in self.ALPHA_CHARS
             ):  # If the next token is alpha.
                 # For French and Italian, right-shift the contraction.
                 detokenized_text += prepend_space + token
@@ -771,7 +1516,8 @@ class MosesDetokenizer(object):
             elif (
                 self.lang == "cs"
                 and i <= len(tokens) - 3
-                and self.IS_FRENCH_CONRTACTION.search(token)
+                and token[-1] == "'"
+                and token[-2:-1] in self.ALPHA_CHARS
                 and re.search(r"^[-–]$", tokens[i + 1])
                 and re.search(r"^li$|^mail.*", tokens[i + 2], re.IGNORECASE)
             ):  # In Perl, ($words[$i+2] =~ /^li$|^mail.*/i)
@@ -836,9 +1582,40 @@ class MosesDetokenizer(object):
 
         return detokenized_text if return_str else detokenized_text.split()
 
+    def _detokenize_plain(self, tokens):
+        """
+        Detokenizes the tokens made of ASCII letters, digits and periods
+        without any regex, the output is identical to tokenize(). Returns
+        None for the other token lists.
+
+            >>> MosesDetokenizer()._detokenize_plain(["I", "saw", "2", "cats", "."])
+            'I saw 2 cats.'
+            >>> MosesDetokenizer()._detokenize_plain(["I", "saw", "2", "cats", "!"]) is None
+            True
+        """
+        text = " ".join(tokens)
+        # The Czech decimal numbers rule looks at the last tokens.
+        if self.lang == "cs" or not self.PLAIN_ASCII_CHARS.issuperset(text):
+            return None
+        self.fast_path_count += 1
+        detokenized_text = ""
+        for token in text.split():
+            # The punctuations are left-shifted.
+            if token.strip("."):
+                detokenized_text += " " + token
+            else:
+                detokenized_text += token
+        return detokenized_text.strip()
+
     def detokenize(self, tokens, return_str=True, unescape=True):
         """Duck-typing the abstract *tokenize()*."""
         return self.tokenize(tokens, return_str, unescape)
 
 
-__all__ = ["MosesTokenizer", "MosesDetokenizer"]
+__all__ = [
+    "MosesTokenizer",
+    "MosesDetokenizer",
+    "NonbreakingPrefixResolver",
+    "ProtectedPatternSet",
+    "TokenSpan",
+]
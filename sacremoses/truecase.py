@@ -2,13 +2,21 @@
 
 from __future__ import print_function
 
+import os
 import re
 from collections import defaultdict, Counter
 from functools import partial
 from itertools import chain
 
-from sacremoses.corpus import Perluniprops
-from sacremoses.util import parallelize_preprocess, grouper
+from sacremoses.corpus import Perluniprops, charclasses
+from sacremoses.util import (
+    LazyPattern,
+    LRUCache,
+    grouper,
+    open_file,
+    parallelize_preprocess,
+    rebuild,
+)
 
 
 perluniprops = Perluniprops()
@@ -19,14 +27,20 @@ class MosesTruecaser(object):
     This is a Python port of the Moses Truecaser from
     https://github.com/moses-smt/mosesdecoder/blob/master/scripts/recaser/train-truecaser.perl
     https://github.com/moses-smt/mosesdecoder/blob/master/scripts/recaser/truecase.perl
+
+    Thread safety: once the model is loaded or trained, truecase() can be
+    called concurrently on a shared instance, it only reads the model and the
+    line cache is locked. The train methods replace the model and must not
+    run while other threads truecase with the same instance. Truecasing holds
+    the GIL, threads only save the copies of the model.
     """
 
     # Perl Unicode Properties character sets.
-    Lowercase_Letter = str("".join(perluniprops.chars("Lowercase_Letter")))
-    Uppercase_Letter = str("".join(perluniprops.chars("Uppercase_Letter")))
-    Titlecase_Letter = str("".join(perluniprops.chars("Uppercase_Letter")))
+    Lowercase_Letter = charclasses.string("Lowercase_Letter")
+    Uppercase_Letter = charclasses.string("Uppercase_Letter")
+    Titlecase_Letter = charclasses.string("Uppercase_Letter")
 
-    def __init__(self, load_from=None, is_asr=None, encoding="utf8"):
+    def __init__(self, load_from=None, is_asr=None, encoding="utf8", cache_size=None):
         """
         :param load_from:
         :type load_from:
@@ -35,15 +49,30 @@ class MosesTruecaser(object):
             no case, make sure it is lowercase, and make sure known are cased
             eg. 'i' to be uppercased even if i is known.
         :type is_asr: bool
+
+        :param cache_size: If set, memoize the truecase() results of up to
+            *cache_size* distinct lines, see sacremoses.util.LRUCache. The
+            cache is cleared whenever a model is trained.
+        :type cache_size: int
         """
         # Initialize the object.
         super(MosesTruecaser, self).__init__()
+        # The constructor arguments, see __reduce__(), the model file is
+        # dropped when a model is trained.
+        self._config = dict(
+            load_from=os.path.abspath(load_from) if load_from else None,
+            is_asr=is_asr,
+            encoding=encoding,
+            cache_size=cache_size,
+        )
         # Initialize the language specific nonbreaking prefixes.
-        self.SKIP_LETTERS_REGEX = re.compile(
+        self.SKIP_LETTERS_REGEX = LazyPattern(
             "[{}{}{}]".format(
                 self.Lowercase_Letter, self.Uppercase_Letter, self.Titlecase_Letter
             )
         )
+        # The prebuilt set of the letters above, for the per-token checks.
+        self.SKIP_LETTERS = charclasses.charset("Lowercase_Letter", "Uppercase_Letter")
 
         self.XML_SPLIT_REGX = re.compile("(<.*(?<=>))(.*)((?=</)[^>]*>)")
 
@@ -62,9 +91,21 @@ class MosesTruecaser(object):
         self.encoding = encoding
 
         self.is_asr = is_asr
+        self.cache = LRUCache(cache_size) if cache_size else None
         if load_from:
             self.model = self._load_model(load_from)
 
+    def __reduce__(self):
+        # Pickles the configuration, a model loaded from a file is reloaded
+        # from it. Only the counts of a trained model are pickled, the best
+        # and known cases are recomputed from them by __setstate__().
+        if self._config["load_from"] or getattr(self, "model", None) is None:
+            return rebuild, (self.__class__, self._config)
+        return rebuild, (self.__class__, self._config), {"casing": self.model["casing"]}
+
+    def __setstate__(self, state):
+        self.model = self._casing_to_model(state["casing"])
+
     def learn_truecase_weights(self, tokens, possibly_use_first_token=False):
         """
         This function checks through each tokens in a sentence and returns the
@@ -86,7 +127,7 @@ class MosesTruecaser(object):
                 is_first_word = True
                 continue
             # Skips tokens with nothing to case.
-            if not self.SKIP_LETTERS_REGEX.search(token):
+            if self.SKIP_LETTERS.isdisjoint(token):
                 is_first_word = False
                 continue
 
@@ -134,6 +175,9 @@ class MosesTruecaser(object):
         :returns: A dictionary of the best, known objects as values from `_casing_to_model()`
         :rtype: {'best': dict, 'known': Counter}
         """
+        # The cached results are from the previous model.
+        if self.cache is not None:
+            self.cache.clear()
         casing = defaultdict(Counter)
         train_truecaser = partial(
             self.learn_truecase_weights,
@@ -165,6 +209,7 @@ class MosesTruecaser(object):
         Default duck-type of _train(), accepts list(list(str)) as input documents.
         """
         self.model = None  # Clear the model first.
+        self._config["load_from"] = None
         self.model = self._train(
             documents,
             save_to,
@@ -184,14 +229,15 @@ class MosesTruecaser(object):
     ):
         """
         Duck-type of _train(), accepts a filename to read as a `iter(list(str))`
-        object.
+        object, decompressed if it ends with .gz, .bz2 or .xz.
         """
-        with open(filename, encoding=self.encoding) as fin:
+        with open_file(filename, encoding=self.encoding) as fin:
             # document_iterator = map(str.split, fin.readlines())
             document_iterator = (
                 line.split() for line in fin.readlines()
             )  # Lets try a generator comprehension for Python2...
         self.model = None  # Clear the model first.
+        self._config["load_from"] = None
         self.model = self._train(
             document_iterator,
             save_to,
@@ -218,6 +264,7 @@ class MosesTruecaser(object):
             line.split() for line in file_object.readlines()
         )  # Lets try a generator comprehension for Python2...
         self.model = None  # Clear the model first.
+        self._config["load_from"] = None
         self.model = self._train(
             document_iterator,
             save_to,
@@ -242,6 +289,18 @@ class MosesTruecaser(object):
             "Or use Truecaser('modefile') to load a model."
         )
         assert hasattr(self, "model"), check_model_message
+        if self.cache is None:
+            truecased_tokens = self._truecase(text, use_known)
+        else:
+            key = (text, use_known)
+            truecased_tokens = self.cache.get(key)
+            if truecased_tokens is None:
+                truecased_tokens = tuple(self._truecase(text, use_known))
+                self.cache.put(key, truecased_tokens)
+            truecased_tokens = list(truecased_tokens)
+        return " ".join(truecased_tokens) if return_str else truecased_tokens
+
+    def _truecase(self, text, use_known):
         # Keep track of first tokens in the sentence(s) of the line.
         is_first_word = True
         truecased_tokens = []
@@ -292,66 +351,75 @@ class MosesTruecaser(object):
             elif token not in self.DELAYED_SENT_START:
                 is_first_word = False
 
-        # return ' '.join(tokens)
-        return " ".join(truecased_tokens) if return_str else truecased_tokens
+        return truecased_tokens
 
     def truecase_file(self, filename, return_str=True):
-        with open(filename, encoding=self.encoding) as fin:
+        with open_file(filename, encoding=self.encoding) as fin:
             for line in fin:
                 truecased_tokens = self.truecase(line.strip())
                 # Yield the truecased line.
                 yield " ".join(truecased_tokens) if return_str else truecased_tokens
 
+    # The regexes of split_xml(), matched at the current position of the line.
+    XML_TAG = re.compile(r"\s*(<\S[^>]*>)")
+    NON_XML = re.compile(r"\s*([^\s<>]+)")
+    XML_COGNATE = re.compile(r"\s*(\S+)")
+    XML_FACTOR = re.compile(r"\|+")
+
     @staticmethod
     def split_xml(line):
         """
         Python port of split_xml function in Moses' truecaser:
         https://github.com/moses-smt/mosesdecoder/blob/master/scripts/recaser/truecaser.perl
 
+        The line is scanned once from left to right, in linear time, instead
+        of matching the rest of the line with (.*)$ after every token.
+
+            >>> MosesTruecaser.split_xml("a <b>  c|<d>|| e")
+            ['a', '<b>', 'c|<d>||', 'e']
+
         :param line: Input string, should be tokenized, separated by space.
         :type line: str
         """
         line = line.strip()
-        tokens = []
-        while line:
-            # Assumes that xml tag is always separated by space.
-            has_xml = re.search(r"^\s*(<\S[^>]*>)(.*)$", line)
-            # non-XML test.
-            is_non_xml = re.search(r"^\s*([^\s<>]+)(.*)$", line)
-            # '<' or '>' occurs in word, but it's not an XML tag
-            xml_cognates = re.search(r"^\s*(\S+)(.*)$", line)
-            if has_xml:
-                potential_xml, line_next = has_xml.groups()
-                # exception for factor that is an XML tag
-                if (
-                    re.search(r"^\S", line)
-                    and len(tokens) > 0
-                    and re.search(r"\|$", tokens[-1])
-                ):
-                    tokens[-1] += potential_xml
-                    # If it's a token with factors, join with the previous token.
-                    is_factor = re.search(r"^(\|+)(.*)$", line_next)
-                    if is_factor:
-                        tokens[-1] += is_factor.group(1)
-                        line_next = is_factor.group(2)
-                else:
-                    tokens.append(
-                        potential_xml + " "
-                    )  # Token hack, unique to sacremoses.
-                line = line_next
-
-            elif is_non_xml:
-                tokens.append(is_non_xml.group(1))  # Token hack, unique to sacremoses.
-                line = is_non_xml.group(2)
-            elif xml_cognates:
-                tokens.append(
-                    xml_cognates.group(1)
-                )  # Token hack, unique to sacremoses.
-                line = xml_cognates.group(2)
+        # The Moses regexes end with (.*)$ that fails while a newline is left
+        # in the rest of the line.
+        newline = line.rfind("\n")
+        # Only look for a tag while a '>' is left to close it, otherwise
+        # every unclosed '<' rescans the rest of the line.
+        closing = line.rfind(">")
+        # The parts of every token, XML tags are joined to factored tokens.
+        tokens, pos = [], 0
+        while pos < len(line):
+            for regexp in (
+                MosesTruecaser.XML_TAG,  # Assumes that xml tag is always separated by space.
+                MosesTruecaser.NON_XML,  # non-XML test.
+                MosesTruecaser.XML_COGNATE,  # '<' or '>' occurs in word, but it's not an XML tag
+            ):
+                if regexp is MosesTruecaser.XML_TAG and closing < max(pos, newline):
+                    continue
+                match = regexp.match(line, pos)
+                if match and match.end() > newline:
+                    break
             else:
-                raise Exception("ERROR: huh? {}".format(line))
-            tokens[-1] = tokens[-1].strip()  # Token hack, unique to sacremoses.
-        return tokens
+                raise Exception("ERROR: huh? {}".format(line[pos:]))
+            # exception for factor that is an XML tag
+            if (
+                regexp is MosesTruecaser.XML_TAG
+                and not line[pos].isspace()
+                and tokens
+                and tokens[-1][-1].endswith("|")
+            ):
+                tokens[-1].append(match.group(1))
+                # If it's a token with factors, join with the previous token.
+                is_factor = MosesTruecaser.XML_FACTOR.match(line, match.end())
+                if is_factor:
+                    tokens[-1].append(is_factor.group())
+                    match = is_factor
+            else:
+                tokens.append([match.group(1)])
+            pos = match.end()
+        return ["".join(parts) for parts in tokens]
 
     def _casing_to_model(self, casing):
         """
@@ -471,6 +539,9 @@ class MosesDetruecaser(object):
             "with",
         }
 
+    def __reduce__(self):
+        return self.__class__, ()
+
     def detruecase(self, text, is_headline=False, return_str=False):
         """
         Detruecase the translated files from a model that learnt from truecased
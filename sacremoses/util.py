@@ -1,11 +1,41 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from itertools import tee, zip_longest
-from xml.sax.saxutils import escape, unescape
+import codecs
+import io
+import mmap
+import os
+import re
+import signal
+import struct
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque, namedtuple
+from contextlib import contextmanager
+from importlib import import_module
+from functools import partial
+from itertools import chain, islice, tee, zip_longest
 
-from joblib import Parallel, delayed
-from tqdm import tqdm
+# The names imported on first use, they cost more than the rest of the
+# package to import and most users never need them.
+_DEFERRED_IMPORTS = {
+    "escape": "xml.sax.saxutils",
+    "unescape": "xml.sax.saxutils",
+    "Parallel": "joblib",
+    "delayed": "joblib",
+    "tqdm": "tqdm",
+}
+
+
+def __getattr__(name):
+    try:
+        module = _DEFERRED_IMPORTS[name]
+    except KeyError:
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name)
+        ) from None
+    return getattr(import_module(module), name)
 
 
 class CJKChars(object):
@@ -124,6 +154,7 @@ def xml_escape(text):
     some characters that Moses does so we have to manually add them to the
     entities dictionary.
 
+        >>> from xml.sax.saxutils import escape
         >>> input_str = ''')| & < > ' " ] ['''
         >>> expected_output =  ''')| &amp; &lt; &gt; ' " ] ['''
         >>> escape(input_str) == expected_output
@@ -135,6 +166,8 @@ def xml_escape(text):
     :type text: str
     :rtype: str
     """
+    from xml.sax.saxutils import escape
+
     return escape(
         text,
         entities={
@@ -165,6 +198,8 @@ def xml_unescape(text):
     :type text: str
     :rtype: str
     """
+    from xml.sax.saxutils import unescape
+
     return unescape(
         text,
         entities={
@@ -196,8 +231,1008 @@ def grouper(iterable, n, fillvalue=None):
     return zip_longest(*args, fillvalue=fillvalue)
 
 
-def parallelize_preprocess(func, iterator, processes, progress_bar=False):
-    iterator = tqdm(iterator) if progress_bar else iterator
+def chunked(iterable, n):
+    """Collect data into lists of at most n items, without padding the last one.
+
+        >>> list(chunked('ABCDEFG', 3))
+        [['A', 'B', 'C'], ['D', 'E', 'F'], ['G']]
+    """
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, n))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, n))
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "evictions", "maxsize", "currsize"])
+
+
+class LRUCache(object):
+    """
+    A bounded, thread-safe least-recently-used cache with hit, miss and
+    eviction counters, used to memoize the results of repeated lines.
+
+        >>> cache = LRUCache(maxsize=2)
+        >>> cache.put("a", 1); cache.put("b", 2); cache.get("a")
+        1
+        >>> cache.put("c", 3)  # Evicts "b", the least recently used.
+        >>> cache.get("b") is None
+        True
+        >>> cache.info()
+        CacheInfo(hits=1, misses=1, evictions=1, maxsize=2, currsize=2)
+    """
+
+    def __init__(self, maxsize=100000):
+        """
+        :param maxsize: The maximum no. of entries in the cache.
+        :type maxsize: int
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize must be a positive integer, got {}".format(maxsize))
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Empties the cache and resets the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(
+                self.hits, self.misses, self.evictions, self.maxsize, len(self._entries)
+            )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __reduce__(self):
+        # Pickles an empty cache, e.g. for the worker processes.
+        return self.__class__, (self.maxsize,)
+
+
+class LazyPattern(object):
+    """
+    A stand-in for ``re.compile(pattern, flags)`` that compiles the regex on
+    first use. The regexes of the Perluniprops character classes take most
+    of the time to import the tokenizer, and each user needs only some.
+
+        >>> regexp = LazyPattern(r"([^0-9])[,]")
+        >>> regexp.pattern
+        '([^0-9])[,]'
+        >>> regexp.sub(r"\\1 , ", "a,1")
+        'a , 1'
+    """
+
+    def __init__(self, pattern, flags=0):
+        self.pattern = pattern
+        self.flags = flags
+
+    def __getattr__(self, name):
+        # Only called until the compiled regex's attributes are copied over.
+        if name.startswith("__"):
+            raise AttributeError(name)
+        compiled = re.compile(self.pattern, self.flags)
+        for attr in dir(compiled):
+            if not attr.startswith("_") and attr not in ("pattern", "flags"):
+                setattr(self, attr, getattr(compiled, attr))
+        return getattr(compiled, name)
+
+    def __eq__(self, other):
+        if not isinstance(other, LazyPattern):
+            return NotImplemented
+        return (self.pattern, self.flags) == (other.pattern, other.flags)
+
+    def __hash__(self):
+        return hash((self.pattern, self.flags))
+
+    def __reduce__(self):
+        return self.__class__, (self.pattern, self.flags)
+
+    def __repr__(self):
+        return "LazyPattern({!r})".format(self.pattern[:40])
+
+
+class SharedInstances(object):
+    """
+    A mixin that gives a class a process-wide, thread-safe cache of its
+    instances, one per configuration, e.g. for services that would otherwise
+    build a tokenizer, its nonbreaking prefixes and its regexes per request.
+
+        >>> class Greeter(SharedInstances):
+        ...     def __init__(self, lang="en"):
+        ...         self.lang = lang
+        >>> Greeter.get("en") is Greeter.get(lang="en")
+        True
+        >>> Greeter.get("fr") is Greeter.get("en")
+        False
+        >>> Greeter.resident_configurations()
+        2
+
+    The instances are shared by all the callers of get(), they must be used
+    without changing their attributes.
+    """
+
+    _shared_instances = {}
+    _shared_instances_lock = threading.Lock()
+
+    @classmethod
+    def shared_key(cls, arguments):
+        """
+        Returns the cache key of the configuration, the *arguments* of the
+        constructor by name, with their defaults applied.
+        """
+        return tuple(sorted(arguments.items()))
+
+    @classmethod
+    def get(cls, *args, **kwargs):
+        """
+        Returns the shared instance constructed with the *args* and *kwargs*,
+        constructing it on the first call with this configuration.
+        """
+        from inspect import signature
+
+        arguments = signature(cls).bind(*args, **kwargs)
+        arguments.apply_defaults()
+        key = cls, cls.shared_key(arguments.arguments)
+        with cls._shared_instances_lock:
+            try:
+                return cls._shared_instances[key]
+            except KeyError:
+                instance = cls(*args, **kwargs)
+                cls._shared_instances[key] = instance
+                return instance
+
+    @classmethod
+    def resident_configurations(cls):
+        """Returns the no. of shared instances of the class."""
+        with cls._shared_instances_lock:
+            return sum(1 for key_cls, _ in cls._shared_instances if key_cls is cls)
+
+    @classmethod
+    def clear_resident(cls):
+        """Drops the shared instances of the class."""
+        with cls._shared_instances_lock:
+            for key in [key for key in cls._shared_instances if key[0] is cls]:
+                del cls._shared_instances[key]
+
+
+def rebuild(cls, config):
+    """
+    Constructs a *cls* object from its constructor arguments, the *config*,
+    used by the __reduce__() of the classes that are pickled as their
+    configuration instead of their prebuilt state.
+    """
+    return cls(**config)
+
+
+class LineTimeout(Exception):
+    """Raised when a line runs out of its TimeBudget."""
+
+
+def whitespace_split(line):
+    """
+    The cheap fallback of TimeBudget, joins the whitespace separated tokens of
+    a line, or a list of tokens, with single spaces.
+
+        >>> whitespace_split(" Hello,  world! ")
+        'Hello, world!'
+    """
+    if isinstance(line, str):
+        line = line.split()
+    return " ".join(line)
+
+
+class TimeBudget(object):
+    """
+    Wraps a per-line function, e.g. MosesTokenizer.tokenize, so that a line
+    that takes longer than *timeout* seconds is interrupted and passed through
+    a cheap fallback instead.
+
+        >>> budget = TimeBudget(lambda line: time.sleep(10), timeout=0.01)
+        >>> budget("Hello,  world!")
+        'Hello, world!'
+        >>> output, elapsed, timed_out = budget.run("Hello,  world!")
+        >>> timed_out
+        True
+
+    The line is interrupted with SIGALRM, so only in the main thread of a
+    process and on platforms that have it. Elsewhere the line runs to the end
+    and run() only reports the elapsed time.
+    """
+
+    def __init__(self, func, timeout, fallback=whitespace_split):
+        """
+        :param func: The function that processes a line.
+        :type func: callable
+
+        :param timeout: The no. of seconds per line.
+        :type timeout: float
+
+        :param fallback: The function that processes a line that timed out.
+        :type fallback: callable
+        """
+        if timeout <= 0:
+            raise ValueError("timeout must be positive, got {}".format(timeout))
+        self.func = func
+        self.timeout = timeout
+        self.fallback = fallback
+        self._running = False
+
+    def _interrupt(self, signum, frame):
+        # The alarm can go off just after the line is done.
+        if self._running:
+            raise LineTimeout()
+
+    def run(self, line):
+        """
+        :return: The output, the elapsed seconds and whether the line timed out.
+        :rtype: tuple(object, float, bool)
+        """
+        interruptible = (
+            hasattr(signal, "setitimer")
+            and threading.current_thread() is threading.main_thread()
+        )
+        start_time = time.perf_counter()
+        if not interruptible:
+            output = self.func(line)
+            return output, time.perf_counter() - start_time, False
+        handler = signal.signal(signal.SIGALRM, self._interrupt)
+        try:
+            self._running = True
+            signal.setitimer(signal.ITIMER_REAL, self.timeout)
+            output = self.func(line)
+            self._running = False
+            timed_out = False
+        except LineTimeout:
+            output = self.fallback(line)
+            timed_out = True
+        finally:
+            self._running = False
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, handler)
+        return output, time.perf_counter() - start_time, timed_out
+
+    def __call__(self, line):
+        return self.run(line)[0]
+
+
+# The processor of a ChunkedExecutor worker process, set up once per worker.
+_worker_func = None
+
+
+def _init_worker(func):
+    global _worker_func
+    _worker_func = func
+
+
+def _process_lines(chunk):
+    return [_worker_func(line) for line in chunk]
+
+
+def _process_chunk(chunk):
+    return _worker_func(chunk)
+
+
+# The layout of a shared memory block of lines: the no. of lines and the
+# byte offsets of the lines as little-endian unsigned 64-bit integers, then
+# the UTF-8 encoded lines.
+_BLOCK_COUNT = struct.Struct("<Q")
+
+
+def write_shared_block(lines):
+    """
+    Writes the *lines* into a new shared memory segment, see
+    read_shared_block(). The caller owns the segment and has to close() and
+    unlink() it.
+
+    :type lines: list(str)
+    :rtype: multiprocessing.shared_memory.SharedMemory
+    """
+    from multiprocessing import shared_memory
+
+    encoded = [line.encode("utf-8") for line in lines]
+    offsets = [0]
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+    start = _BLOCK_COUNT.size * (len(lines) + 2)
+    block = shared_memory.SharedMemory(create=True, size=start + offsets[-1] or 1)
+    struct.pack_into("<{}Q".format(len(lines) + 2), block.buf, 0, len(lines), *offsets)
+    for data, offset in zip(encoded, offsets):
+        block.buf[start + offset : start + offset + len(data)] = data
+    return block
+
+
+def read_shared_block(block):
+    """
+    Decodes the lines of a shared memory segment written by
+    write_shared_block(), straight from the shared buffer.
+
+        >>> block = write_shared_block(["Hello, world!", "", "\xbfQu\xe9?"])
+        >>> read_shared_block(block)
+        ['Hello, world!', '', '¿Qué?']
+        >>> block.close(); block.unlink()
+
+    :type block: multiprocessing.shared_memory.SharedMemory
+    :rtype: list(str)
+    """
+    (count,) = _BLOCK_COUNT.unpack_from(block.buf, 0)
+    offsets = struct.unpack_from("<{}Q".format(count + 1), block.buf, _BLOCK_COUNT.size)
+    start = _BLOCK_COUNT.size * (count + 2)
+    lines = []
+    for begin, end in zip(offsets, offsets[1:]):
+        # The views have to be released before the segment is closed.
+        with block.buf[start + begin : start + end] as data:
+            lines.append(str(data, "utf-8"))
+    return lines
+
+
+def _attach_shared_block(name):
+    from multiprocessing import shared_memory
+
+    return shared_memory.SharedMemory(name)
+
+
+def _process_shared_block(name, batched):
+    block = _attach_shared_block(name)
+    try:
+        lines = read_shared_block(block)
+    finally:
+        block.close()
+    results = _worker_func(lines) if batched else [_worker_func(line) for line in lines]
+    if not all(isinstance(result, str) for result in results):
+        raise TypeError("shared_memory requires a processor that returns strings")
+    # The segment of the results is unlinked by the parent.
+    block = write_shared_block(results)
+    block.close()
+    return block.name
+
+
+def _release_shared_block(block, unlink=True):
+    block.close()
+    if unlink:
+        block.unlink()
+
+
+def _collect_shared_block(name):
+    block = _attach_shared_block(name)
+    try:
+        return read_shared_block(block)
+    finally:
+        _release_shared_block(block)
+
+
+class ChunkedExecutor(object):
+    """
+    A process pool that maps a processor, e.g. a tokenizer's tokenize(), over
+    an iterable of lines. The processor is sent once to every worker instead
+    of with every line, the lines are sent in chunks, and the results are
+    yielded in order while at most *prefetch* chunks per worker are in
+    flight, so the memory use doesn't grow with the input.
+
+        >>> executor = ChunkedExecutor(str.upper, processes=2, chunksize=2)
+        >>> list(executor.map(["a", "b", "c"]))
+        ['A', 'B', 'C']
+    """
+
+    def __init__(
+        self,
+        func,
+        processes,
+        chunksize=1000,
+        prefetch=2,
+        batched=False,
+        start_method=None,
+        shared_memory=False,
+    ):
+        """
+        :param func: The processor, it has to be picklable.
+        :type func: callable
+        :param processes: No. of worker processes.
+        :type processes: int
+        :param chunksize: No. of lines sent to a worker at once.
+        :type chunksize: int
+        :param prefetch: No. of chunks per worker that are queued ahead of the
+            results that are yielded.
+        :type prefetch: int
+        :param batched: The *func* takes a list of lines and returns the list
+            of their results, e.g. MosesTokenizer.tokenize_batch().
+        :type batched: bool
+        :param start_method: The multiprocessing start method of the workers,
+            the platform default if None. With "fork" the workers inherit the
+            processor, e.g. a truecaser and its model, copy-on-write instead
+            of unpickling a copy each.
+        :type start_method: str
+        :param shared_memory: Send the chunks of lines to the workers, and
+            their results back, in multiprocessing.shared_memory segments
+            instead of pickling them, only the names of the segments go
+            through the pool's queues. The lines and the results of the
+            processor have to be strings.
+        :type shared_memory: bool
+        """
+        if processes < 1 or chunksize < 1 or prefetch < 1:
+            raise ValueError("processes, chunksize and prefetch must be positive")
+        self.func = func
+        self.processes = processes
+        self.chunksize = chunksize
+        self.prefetch = prefetch
+        self.batched = batched
+        self.start_method = start_method
+        self.shared_memory = shared_memory
+
+    def map(self, iterable):
+        """Yields the results of the processor on every line, in order."""
+        import gc
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        context = multiprocessing.get_context(self.start_method)
+        fork = context.get_start_method() == "fork"
+        if fork:
+            # Keeps the garbage collector of the workers from writing to, and
+            # so copying, the pages of the inherited objects.
+            gc.freeze()
+        try:
+            with ProcessPoolExecutor(
+                self.processes,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(self.func,),
+            ) as pool:
+                yield from self._map(pool, iterable)
+        finally:
+            if fork:
+                gc.unfreeze()
+
+    def _map(self, pool, iterable):
+        max_pending = self.processes * self.prefetch
+        pending = deque()
+        try:
+            for chunk in chunked(iterable, self.chunksize):
+                pending.append(self._submit(pool, chunk))
+                if len(pending) >= max_pending:
+                    yield from self._collect(*pending.popleft())
+            while pending:
+                yield from self._collect(*pending.popleft())
+        finally:
+            # The segments of the chunks that were not collected.
+            for future, block in pending:
+                self._discard(future, block)
+
+    def _submit(self, pool, chunk):
+        """Returns the future of the results of the *chunk* and its segment."""
+        if not self.shared_memory:
+            process = _process_chunk if self.batched else _process_lines
+            return pool.submit(process, chunk), None
+        block = write_shared_block(chunk)
+        try:
+            return pool.submit(_process_shared_block, block.name, self.batched), block
+        except BaseException:
+            _release_shared_block(block)
+            raise
+
+    def _collect(self, future, block):
+        if block is None:
+            return future.result()
+        try:
+            name = future.result()
+        finally:
+            _release_shared_block(block)
+        return _collect_shared_block(name)
+
+    def _discard(self, future, block):
+        if block is None:
+            return
+        # A worker may still be reading the segment of the chunk.
+        future.cancel()
+        try:
+            name = future.result()
+        except BaseException:
+            return
+        finally:
+            _release_shared_block(block)
+        _release_shared_block(_attach_shared_block(name))
+
+
+def _map_lines(func, lines):
+    return [func(line) for line in lines]
+
+
+class ThreadedExecutor(ChunkedExecutor):
+    """
+    A thread pool with the interface of a ChunkedExecutor. The threads share
+    the processor, e.g. a single tokenizer with its caches and compiled
+    regexes, instead of a copy per worker process.
+
+        >>> executor = ThreadedExecutor(str.upper, threads=2, chunksize=2)
+        >>> list(executor.map(["a", "b", "c"]))
+        ['A', 'B', 'C']
+
+    The threads run in parallel where the processor doesn't hold the GIL: on
+    free-threaded CPython builds, and in the matchers of the ``regex`` module
+    that are called with ``concurrent=True``, i.e. the rule chains of a
+    MosesTokenizer(concurrent=True) and the removal of the control characters
+    of MosesPunctNormalizer. The rest of the processors, e.g. the normalizer
+    rules and the truecaser, hold the GIL on the other builds.
+    """
+
+    def __init__(self, func, threads, chunksize=1000, prefetch=2, batched=False):
+        """
+        :param func: The processor, it has to be thread-safe, see the
+            "Thread safety" notes of the tokenizers, truecasers and
+            normalizer.
+        :type func: callable
+        :param threads: No. of threads.
+        :type threads: int
+        :param chunksize: No. of lines given to a thread at once.
+        :type chunksize: int
+        :param prefetch: No. of chunks per thread that are queued ahead of the
+            results that are yielded.
+        :type prefetch: int
+        :param batched: The *func* takes a list of lines and returns the list
+            of their results.
+        :type batched: bool
+        """
+        super().__init__(func, threads, chunksize, prefetch, batched)
+
+    def map(self, iterable):
+        """Yields the results of the processor on every line, in order."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(self.processes) as pool:
+            yield from self._map(pool, iterable)
+
+    def _submit(self, pool, chunk):
+        if self.batched:
+            return pool.submit(self.func, chunk), None
+        return pool.submit(_map_lines, self.func, chunk), None
+
+
+def parallelize_preprocess(
+    func,
+    iterator,
+    processes,
+    progress_bar=False,
+    chunksize=1000,
+    start_method=None,
+    shared_memory=False,
+    backend="processes",
+):
+    """
+    Maps *func* over the *iterator*, with a ChunkedExecutor if *processes* is
+    more than one, or a ThreadedExecutor of as many threads if the *backend*
+    is "threads". Returns an iterator of the results, in order.
+    """
+    if backend not in ("processes", "threads"):
+        raise ValueError(
+            "backend must be 'processes' or 'threads', got {!r}".format(backend)
+        )
+    if progress_bar:
+        from tqdm import tqdm
+
+        iterator = tqdm(iterator)
     if processes <= 1:
         return map(func, iterator)
-    return Parallel(n_jobs=processes)(delayed(func)(line) for line in iterator)
+    if backend == "threads":
+        return ThreadedExecutor(func, processes, chunksize=chunksize).map(iterator)
+    executor = ChunkedExecutor(
+        func,
+        processes,
+        chunksize=chunksize,
+        start_method=start_method,
+        shared_memory=shared_memory,
+    )
+    return executor.map(iterator)
+
+
+# The no. of bytes read, and characters written, at once by read_lines() and
+# write_lines().
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+
+def read_lines(fileobj, encoding="utf8", buffer_size=DEFAULT_BUFFER_SIZE):
+    """
+    Yields the lines of the binary *fileobj* with their "\\n", as a text file
+    in universal newlines mode does. The bytes are read and decoded a block of
+    up to *buffer_size* at a time instead of line by line.
+
+        >>> fin = io.BytesIO("a\\r\\nb\\rc\\n\\n\\xe9".encode("utf8"))
+        >>> list(read_lines(fin, buffer_size=2))
+        ['a\\n', 'b\\n', 'c\\n', '\\n', 'é']
+
+    :param fileobj: A file object opened in binary mode, e.g. sys.stdin.buffer.
+    :param encoding: The encoding of the file.
+    :type encoding: str
+    :param buffer_size: The no. of bytes read at once.
+    :type buffer_size: int
+    """
+    # Returns what is available instead of blocking until the block is full,
+    # so the lines of a pipe are yielded as they come.
+    read = getattr(fileobj, "read1", fileobj.read)
+    return decode_lines(iter(partial(read, buffer_size), b""), encoding)
+
+
+def decode_lines(blocks, encoding="utf8"):
+    """
+    Yields the lines of the iterable of byte strings *blocks*, see
+    read_lines().
+
+        >>> list(decode_lines([b"a\\r", b"", b"\\nb\\xc3", b"\\xa9"]))
+        ['a\\n', 'bé']
+    """
+    decoder = io.IncrementalNewlineDecoder(
+        codecs.getincrementaldecoder(encoding)(), translate=True
+    )
+    rest = ""
+    for block in chain(filter(None, blocks), [b""]):
+        lines = (rest + decoder.decode(block, final=not block)).split("\n")
+        rest = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    if rest:
+        yield rest
+
+
+def write_lines(lines, fileobj, encoding="utf8", buffer_size=DEFAULT_BUFFER_SIZE):
+    """
+    Writes the *lines*, each followed by a newline, to the binary *fileobj*,
+    encoded and flushed in blocks of about *buffer_size* characters instead of
+    line by line.
+
+        >>> fout = io.BytesIO()
+        >>> write_lines(["Hello,", "world!", "\xe9"], fout, buffer_size=4)
+        >>> fout.getvalue().decode("utf8")
+        'Hello,\\nworld!\\né\\n'
+
+    :param lines: The lines, without their newlines.
+    :type lines: iter(str)
+    :param fileobj: A file object opened in binary mode, e.g. sys.stdout.buffer.
+    :param encoding: The encoding of the file.
+    :type encoding: str
+    :param buffer_size: The no. of characters written at once.
+    :type buffer_size: int
+    """
+    # Writes a byte order mark, e.g. of UTF-16, only once.
+    encode = codecs.getincrementalencoder(encoding)().encode
+    block, size = [], 0
+    for line in lines:
+        block.append(line)
+        size += len(line) + 1
+        if size >= buffer_size:
+            block.append("")
+            fileobj.write(encode("\n".join(block)))
+            fileobj.flush()
+            block, size = [], 0
+    if block:
+        block.append("")
+        fileobj.write(encode("\n".join(block)))
+    fileobj.flush()
+
+
+def newline_aligned(encoding):
+    """
+    Whether the text in *encoding* can be split at any b"\\n" byte between
+    two lines, e.g. by newline_ranges(), and its pieces decoded, and encoded,
+    on their own.
+
+        >>> newline_aligned("utf8"), newline_aligned("utf-16")
+        (True, False)
+    """
+    return codecs.getincrementalencoder(encoding)().encode("\n") == b"\n"
+
+
+def newline_ranges(filename, count):
+    """
+    Splits the file into at most *count* byte ranges of about the same size,
+    each ending after a b"\\n" byte but the last one, e.g. to process them in
+    parallel with read_range_lines().
+
+    :type filename: str
+    :type count: int
+    :return: The (start, end) offsets of the ranges, in order.
+    :rtype: list(tuple(int, int))
+    """
+    size = os.path.getsize(filename)
+    if not size:
+        return []
+    bounds = [0]
+    with open(filename, "rb") as fin:
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for i in range(1, count):
+                newline = mapped.find(b"\n", max(bounds[-1], size * i // count))
+                if newline < 0 or newline + 1 >= size:
+                    break
+                if newline + 1 > bounds[-1]:
+                    bounds.append(newline + 1)
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def _mapped_blocks(mapped, start, end, buffer_size):
+    for position in range(start, end, buffer_size):
+        yield mapped[position : min(end, position + buffer_size)]
+
+
+def read_range_lines(
+    filename, start, end, encoding="utf8", buffer_size=DEFAULT_BUFFER_SIZE
+):
+    """
+    Yields the lines of the bytes *start* to *end* of the file, as
+    read_lines() does, read from a memory map of the file instead of through
+    its file object.
+
+    :type filename: str
+    :type start: int
+    :type end: int
+    """
+    with open(filename, "rb") as fin:
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL, start - start % mmap.PAGESIZE)
+            blocks = _mapped_blocks(mapped, start, end, buffer_size)
+            yield from decode_lines(blocks, encoding)
+
+
+# The modules of the standard library that open the compressed files, by the
+# extension of the file name.
+COMPRESSIONS = {".gz": "gzip", ".bz2": "bz2", ".xz": "lzma"}
+
+# The start of a stream of the compressed formats: the gzip magic bytes, the
+# deflate method and no reserved flags; the bzip2 magic bytes, block size
+# and the magic of its first block, or of the end of an empty stream; the xz
+# magic bytes and stream flags.
+_STREAM_STARTS = {
+    ".gz": re.compile(b"\x1f\x8b\x08[\x00-\x1f]"),
+    ".bz2": re.compile(b"BZh[1-9](?:1AY&SY|\x17rE8P\x90)"),
+    ".xz": re.compile(b"\xfd7zXZ\x00\x00[\x00-\x0f]"),
+}
+
+
+def compression(filename):
+    """
+    Returns the extension of the compressed format of the file, or None.
+
+        >>> compression("big.txt.gz"), compression("big.txt")
+        ('.gz', None)
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    return extension if extension in COMPRESSIONS else None
+
+
+def open_file(filename, mode="r", **kwargs):
+    """
+    Opens a file as open() does, decompressing or compressing the .gz, .bz2
+    and .xz files on the fly.
+
+    :param filename: The name of the file.
+    :type filename: str
+    :param mode: The mode of open(), in text mode unless it has a "b".
+    :type mode: str
+    """
+    extension = compression(filename)
+    if extension is None:
+        return open(filename, mode, **kwargs)
+    if "b" not in mode and "t" not in mode:
+        mode += "t"
+    return import_module(COMPRESSIONS[extension]).open(filename, mode, **kwargs)
+
+
+# The temporary file of atomic_open(), named after the file it replaces.
+_ATOMIC_TEMP = re.compile(r"\.[0-9a-f]{8}\.(.+)\Z", re.DOTALL)
+
+
+def _sync(fout):
+    """Flushes the file *fout* and writes it to the disk."""
+    fout.flush()
+    os.fsync(fout.fileno())
+
+
+@contextmanager
+def atomic_open(filename, mode="w", **kwargs):
+    """
+    Opens a file to write with open_file(), as a temporary file next to it
+    that replaces *filename* once it is closed without an error, so that
+    *filename* is never left half-written, even if the process is killed.
+
+    :param filename: The name of the file.
+    :type filename: str
+    :param mode: The mode of open(), "w" or "wb".
+    :type mode: str
+    """
+    directory, name = os.path.split(os.path.abspath(filename))
+    # The temporary file keeps the extension, and so the compression.
+    temp = os.path.join(directory, ".{}.{}".format(uuid.uuid4().hex[:8], name))
+    extension = compression(temp)
+    try:
+        if extension is None:
+            with open(temp, mode.replace("w", "x"), **kwargs) as fout:
+                yield fout
+                _sync(fout)
+        else:
+            # The compressor is closed first, it writes its trailer to the
+            # file, which is synced before it is closed.
+            if "b" not in mode and "t" not in mode:
+                mode += "t"
+            module = import_module(COMPRESSIONS[extension])
+            with open(temp, "xb") as raw:
+                with module.open(raw, mode, **kwargs) as fout:
+                    yield fout
+                _sync(raw)
+        # The data is on the disk before the file takes its name.
+        os.replace(temp, filename)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+
+def atomic_temp_files(filenames):
+    """
+    Yields the temporary files of atomic_open() for the *filenames* that are
+    left over by processes that were killed while writing them.
+
+    :type filenames: iter(str)
+    """
+    names = {}
+    for filename in filenames:
+        directory, name = os.path.split(os.path.abspath(filename))
+        names.setdefault(directory, set()).add(name)
+    # Every directory is listed once, however many files are in it.
+    for directory, dir_names in names.items():
+        if not os.path.isdir(directory):
+            continue
+        for entry in os.listdir(directory):
+            match = _ATOMIC_TEMP.match(entry)
+            if match and match.group(1) in dir_names:
+                yield os.path.join(directory, entry)
+
+
+def _decompressor(extension):
+    if extension == ".gz":
+        import zlib
+
+        # A gzip header and trailer around the deflate stream.
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if extension == ".bz2":
+        import bz2
+
+        return bz2.BZ2Decompressor()
+    import lzma
+
+    return lzma.LZMADecompressor()
+
+
+def _decompress(mapped, start, end, extension, buffer_size):
+    """
+    Yields the decompressed bytes of the streams in the bytes *start* to *end*
+    of a memory map, one after the other.
+    """
+    decompressor, started = _decompressor(extension), False
+    for data in _mapped_blocks(mapped, start, end, buffer_size):
+        while data:
+            if not started:
+                # The streams can be padded with null bytes.
+                data = data.lstrip(b"\0")
+                if not data:
+                    break
+                started = True
+            yield decompressor.decompress(data)
+            data = b""
+            if decompressor.eof:
+                data = decompressor.unused_data
+                decompressor, started = _decompressor(extension), False
+    if started:
+        raise EOFError(
+            "Compressed file ended before the end-of-stream marker was reached"
+        )
+
+
+def _is_stream_start(mapped, position, extension):
+    # Whether the magic bytes at the position are followed by valid data.
+    try:
+        data = mapped[position : position + (1 << 16)]
+        _decompressor(extension).decompress(data)
+    except Exception:
+        return False
+    return True
+
+
+def stream_ranges(filename, count):
+    """
+    Splits a compressed file of concatenated streams, e.g. the gzip members
+    of bgzip or of ``cat a.gz b.gz``, into at most *count* byte ranges of
+    whole streams of about the same size, to decompress them in parallel
+    with read_compressed_range_lines(). A file of a single stream is a
+    single range.
+
+    :type filename: str
+    :type count: int
+    :return: The (start, end) offsets of the ranges, in order.
+    :rtype: list(tuple(int, int))
+    """
+    extension = compression(filename)
+    size = os.path.getsize(filename)
+    if not size:
+        return []
+    bounds = [0]
+    with open(filename, "rb") as fin:
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for i in range(1, count):
+                position = max(bounds[-1] + 1, size * i // count)
+                for match in _STREAM_STARTS[extension].finditer(mapped, position):
+                    if _is_stream_start(mapped, match.start(), extension):
+                        bounds.append(match.start())
+                        break
+                else:
+                    break
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def _line_aligned(head, tail, skip_first):
+    """
+    Yields the bytes of *head* from the start of its first line that begins
+    in it, after the first b"\\n" if *skip_first*, up to the end of the line
+    that spans into the bytes of *tail*.
+    """
+    for block in head:
+        if skip_first:
+            newline = block.find(b"\n")
+            if newline < 0:
+                continue
+            block, skip_first = block[newline + 1 :], False
+        yield block
+    if skip_first:
+        # No line begins in the head.
+        return
+    for block in tail:
+        newline = block.find(b"\n")
+        if newline >= 0:
+            yield block[: newline + 1]
+            return
+        yield block
+
+
+def read_compressed_range_lines(
+    filename, start, end, encoding="utf8", buffer_size=DEFAULT_BUFFER_SIZE
+):
+    """
+    Yields the lines that begin in the decompressed streams of the bytes
+    *start* to *end* of a compressed file, see stream_ranges(). The streams
+    need not end at the end of a line: the line that spans the end of a range
+    belongs to that range, and the range that starts in the middle of a line
+    skips it, as for the newline_aligned() encodings.
+
+    :type filename: str
+    :type start: int
+    :type end: int
+    """
+    extension = compression(filename)
+    with open(filename, "rb") as fin:
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            head = _decompress(mapped, start, end, extension, buffer_size)
+            tail = _decompress(mapped, end, len(mapped), extension, buffer_size)
+            blocks = _line_aligned(head, tail, skip_first=start > 0)
+            yield from decode_lines(blocks, encoding)
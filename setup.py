@@ -1,6 +1,9 @@
 import re
 import os
+import importlib.util
 from setuptools import setup
+from setuptools.command.build_py import build_py
+from setuptools.command.sdist import sdist
 
 console_scripts = """
 [console_scripts]
@@ -15,6 +18,31 @@ with open(os.path.join(os.path.dirname(__file__), 'sacremoses/__init__.py'), 'r'
 with open(os.path.join(os.path.dirname(__file__), 'README.md'), 'r') as fh:
   long_description = fh.read()
 
+
+def build_data_bundle():
+  """Packs the data files into sacremoses/data/sacremoses.bundle, that is shipped
+  with the package instead of built when it is imported."""
+  # Loads sacremoses/corpus.py on its own, the dependencies of the package
+  # aren't installed yet.
+  path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sacremoses', 'corpus.py')
+  spec = importlib.util.spec_from_file_location('_sacremoses_corpus', path)
+  corpus = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(corpus)
+  corpus.write_data_bundle()
+
+
+class BuildPy(build_py):
+  def run(self):
+    build_data_bundle()
+    build_py.run(self)
+
+
+class SDist(sdist):
+  def run(self):
+    build_data_bundle()
+    sdist.run(self)
+
+
 setup(
   name = 'sacremoses',
   packages = ['sacremoses'],
@@ -23,7 +51,7 @@ setup(
   long_description = long_description,
   long_description_content_type = 'text/markdown',
   author = '',
-  package_data={'sacremoses': ['data/perluniprops/*.txt', 'data/nonbreaking_prefixes/nonbreaking_prefix.*']},
+  package_data={'sacremoses': ['data/perluniprops/*.txt', 'data/nonbreaking_prefixes/nonbreaking_prefix.*', 'data/sacremoses.bundle']},
   url = 'https://github.com/hplt-project/sacremoses',
   keywords = [],
   classifiers = [
@@ -33,5 +61,6 @@ setup(
   ],
   install_requires = ['regex', 'click', 'joblib', 'tqdm'],
   entry_points=console_scripts,
+  cmdclass={'build_py': BuildPy, 'sdist': SDist},
   python_requires='>=3.8',
 )
\ No newline at end of file